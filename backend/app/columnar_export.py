@@ -0,0 +1,226 @@
+"""
+列式数据导出（供研究分析使用）
+
+与 Excel 的宽表（每位玩家一行、每轮若干列）不同，这里按长格式导出四张表，每张表一个文件：
+- games：每局一行（game_id、房间码、状态、创建 / 结束时间）；
+- players：每位玩家一行（昵称、初始 / 当前 / 最终 NT 与生态值、是否获胜）；
+- rounds：每 (局, 轮, 玩家) 一行，即 game_rounds 的全部字段；
+- votes：每 (局, 轮, 投票者) 一行，target_id 为空表示谁都不选（Excel 中记 0）。
+
+安装 pyarrow 时写 Parquet（默认）或 Arrow IPC（.arrow，pandas / polars 可直接读取），否则退回 CSV。
+按局分批（EXPORT_CHUNK_GAMES 局一批）查询并逐批写出，内存占用只与批大小有关。
+"""
+import csv
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Game, GamePlayer, GameRound, GameVote, User
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow 为可选依赖，缺失时只能导出 CSV
+    pyarrow = None
+
+EXPORT_CHUNK_GAMES = int(os.environ.get("EXPORT_CHUNK_GAMES", "200"))
+
+FORMATS = ("parquet", "arrow", "csv")
+FILE_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+# 各表的列：(列名, 类型)，类型为 int / float / bool / str / datetime
+GAMES_COLUMNS = [
+    ("game_id", "int"), ("game_code", "str"), ("status", "str"),
+    ("created_at", "datetime"), ("finished_at", "datetime"),
+]
+PLAYERS_COLUMNS = [
+    ("game_id", "int"), ("player_id", "int"), ("username", "str"),
+    ("initial_nt", "float"), ("current_nt", "float"), ("current_env", "float"),
+    ("final_nt", "float"), ("final_env", "float"), ("is_winner", "bool"),
+]
+ROUNDS_COLUMNS = [
+    ("game_id", "int"), ("round_number", "int"), ("phase", "int"), ("player_id", "int"),
+    ("choice", "str"), ("applied_subsidy", "bool"), ("subsidy_verified", "bool"), ("votes_received", "int"),
+    ("caught_by", "str"),
+    ("nt_before", "float"), ("nt_after", "float"), ("env_before", "float"), ("env_after", "float"),
+    ("round_nt_earned", "float"),
+]
+VOTES_COLUMNS = [
+    ("game_id", "int"), ("round_number", "int"), ("voter_id", "int"), ("target_id", "int"),
+]
+
+Columns = Sequence[Tuple[str, str]]
+
+
+def resolve_format(fmt: str = "parquet") -> str:
+    """请求的格式在缺少 pyarrow 时退回 csv"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式：{fmt}（可选 {', '.join(FORMATS)}）")
+    if fmt != "csv" and pyarrow is None:
+        print(f"未安装 pyarrow，{fmt} 导出退回 CSV")
+        return "csv"
+    return fmt
+
+
+class _CsvTableWriter:
+    def __init__(self, path: str, columns: Columns):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows: List[tuple]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ArrowTableWriter:
+    """Parquet / Arrow IPC：每批写成一个 row group / record batch"""
+
+    TYPES = {
+        "int": lambda: pyarrow.int64(),
+        "float": lambda: pyarrow.float64(),
+        "bool": lambda: pyarrow.bool_(),
+        "str": lambda: pyarrow.string(),
+        "datetime": lambda: pyarrow.timestamp("us"),
+    }
+
+    def __init__(self, path: str, columns: Columns, fmt: str):
+        self._schema = pyarrow.schema([(name, self.TYPES[kind]()) for name, kind in columns])
+        if fmt == "parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+        else:
+            self._writer = pyarrow.ipc.new_file(path, self._schema)
+
+    def write(self, rows: List[tuple]) -> None:
+        arrays = [
+            pyarrow.array(values, type=field.type)
+            for values, field in zip(zip(*rows), self._schema)
+        ]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _open_writer(path: str, columns: Columns, fmt: str):
+    if fmt == "csv":
+        return _CsvTableWriter(path, columns)
+    return _ArrowTableWriter(path, columns, fmt)
+
+
+def _chunks(ids: Sequence[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(ids), size):
+        yield list(ids[start:start + size])
+
+
+def select_game_ids(
+    db: Session,
+    game_ids: Optional[Sequence[int]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    finished_only: bool = True,
+) -> List[int]:
+    """
+    按 id 列表与时间范围选出要导出的游戏
+
+    时间取结束时间（未结束或旧数据没有结束时间时取创建时间），范围为 [since, until)。
+    """
+    query = db.query(Game.id)
+    if game_ids:
+        query = query.filter(Game.id.in_(list(game_ids)))
+    if finished_only:
+        query = query.filter(Game.status == "finished")
+    stamp = func.coalesce(Game.finished_at, Game.created_at)
+    if since is not None:
+        query = query.filter(stamp >= since)
+    if until is not None:
+        query = query.filter(stamp < until)
+    return [game_id for (game_id,) in query.order_by(Game.id)]
+
+
+def _games_rows(db: Session, chunk: List[int]) -> List[tuple]:
+    return db.query(
+        Game.id, Game.game_code, Game.status, Game.created_at, Game.finished_at
+    ).filter(Game.id.in_(chunk)).order_by(Game.id).all()
+
+
+def _players_rows(db: Session, chunk: List[int]) -> List[tuple]:
+    rows = db.query(
+        GamePlayer.game_id, GamePlayer.id, GamePlayer.username, User.username,
+        GamePlayer.initial_nt, GamePlayer.current_nt, GamePlayer.current_env,
+        GamePlayer.final_nt, GamePlayer.final_env, GamePlayer.is_winner,
+    ).outerjoin(User, User.id == GamePlayer.user_id).filter(
+        GamePlayer.game_id.in_(chunk)
+    ).order_by(GamePlayer.game_id, GamePlayer.id).all()
+    result = []
+    for game_id, player_id, nickname, account_name, *values in rows:
+        # 与 Excel 导出一致：本局昵称 > 旧数据的用户名 > 玩家{id}
+        if nickname and nickname.strip():
+            username = nickname.strip()
+        else:
+            username = account_name or f"玩家{player_id}"
+        result.append((game_id, player_id, username, *values))
+    return result
+
+
+def _rounds_rows(db: Session, chunk: List[int]) -> List[tuple]:
+    return db.query(
+        GameRound.game_id, GameRound.round_number, GameRound.phase, GameRound.player_id,
+        GameRound.choice, GameRound.applied_subsidy, GameRound.subsidy_verified, GameRound.votes_received,
+        GameRound.caught_by,
+        GameRound.nt_before, GameRound.nt_after, GameRound.env_before, GameRound.env_after,
+        GameRound.round_nt_earned,
+    ).filter(GameRound.game_id.in_(chunk)).order_by(
+        GameRound.game_id, GameRound.round_number, GameRound.player_id
+    ).all()
+
+
+def _votes_rows(db: Session, chunk: List[int]) -> List[tuple]:
+    return db.query(
+        GameVote.game_id, GameVote.round_number, GameVote.voter_id, GameVote.target_id
+    ).filter(GameVote.game_id.in_(chunk)).order_by(
+        GameVote.game_id, GameVote.round_number, GameVote.voter_id
+    ).all()
+
+
+TABLES = [
+    ("games", GAMES_COLUMNS, _games_rows),
+    ("players", PLAYERS_COLUMNS, _players_rows),
+    ("rounds", ROUNDS_COLUMNS, _rounds_rows),
+    ("votes", VOTES_COLUMNS, _votes_rows),
+]
+
+
+def export_columnar(
+    db: Session,
+    game_ids: Sequence[int],
+    output_dir: str,
+    fmt: str = "parquet",
+    chunk_games: int = EXPORT_CHUNK_GAMES,
+) -> Dict[str, str]:
+    """
+    把选中的游戏导出为四张长格式表
+
+    Returns:
+        表名 -> 文件路径
+    """
+    fmt = resolve_format(fmt)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {name: os.path.join(output_dir, name + FILE_SUFFIXES[fmt]) for name, _, _ in TABLES}
+    writers = {name: _open_writer(paths[name], columns, fmt) for name, columns, _ in TABLES}
+    try:
+        for chunk in _chunks(game_ids, chunk_games):
+            for name, _, load_rows in TABLES:
+                rows = load_rows(db, chunk)
+                if rows:
+                    writers[name].write(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return paths
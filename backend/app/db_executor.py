@@ -0,0 +1,184 @@
+"""
+数据库执行器：所有同步 SQLAlchemy / SQLite 操作都交给专用线程池执行，协程只 await 结果，
+一个房间结算时不会阻塞其他房间的 WebSocket 收发。
+
+- 线程数默认 1：SQLite 同一时刻只允许一个写入者，单线程即可串行化所有写入，避免 database is locked；
+- 等待中的任务数有上限（有界队列），超出时调用方在 await 处排队，形成反压而不是无限堆积；
+- run_in_session 在线程内创建会话、执行函数并关闭会话，ORM 对象不跨线程使用，
+  函数应返回普通数据（dict / list / 数值）供协程广播；
+- write_behind 是写后队列：调用方提交写入任务后不必等待，任务按提交顺序逐个执行。
+  房间的任务（submit_room）失败时先重试 WRITE_RETRIES 次；仍失败则标记该房间（room.write_error），
+  该房间之后排队的任务都不再执行（数据库停在最后一次成功写入的轮次边界），并调用 on_room_failure
+  由应用丢弃内存中的房间、从数据库重建并通知玩家。
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.models import SessionLocal
+
+DB_THREADS = int(os.environ.get("DB_THREADS", "1"))
+DB_QUEUE_SIZE = int(os.environ.get("DB_QUEUE_SIZE", "256"))
+WRITE_RETRIES = int(os.environ.get("WRITE_RETRIES", "2"))
+WRITE_RETRY_DELAY = 0.2  # 秒，第 n 次重试前等待 n 倍
+
+
+class DBExecutor:
+    """专用数据库线程池 + 有界等待队列"""
+
+    def __init__(self, threads: int = DB_THREADS, queue_size: int = DB_QUEUE_SIZE):
+        self.threads = threads
+        self.queue_size = queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_started(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="db")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在数据库线程中执行 fn(*args, **kwargs)；队列已满时等待空位"""
+        self._ensure_started()
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def run_in_session(self, fn: Callable, *args, **kwargs) -> Any:
+        """在数据库线程中以新会话执行 fn(db, *args, **kwargs)，结束后关闭会话"""
+        return await self.run(_call_with_session, fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._slots = None
+
+
+def _call_with_session(fn: Callable, *args, **kwargs) -> Any:
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+db_executor = DBExecutor()
+
+
+class WriteBehindError(RuntimeError):
+    """房间此前的写后任务已失败，本任务未执行"""
+
+
+class WriteBehindQueue:
+    """
+    写后队列：任务按提交顺序在数据库线程中逐个执行（各自一个会话），调用方无需等待；
+    需要结果时 await submit 返回的 Future；需要读到某个房间的最新数据时先 await flush_room(game_id)，
+    只等待该房间的任务，不受其他房间排队任务的影响；flush() 等待全部任务（关闭时使用）
+    """
+
+    def __init__(self, executor: DBExecutor):
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 房间任务最终失败时调用 on_room_failure(room, error)（在独立任务中执行，不阻塞队列）
+        self.on_room_failure: Optional[Callable[[Any, BaseException], Awaitable[None]]] = None
+        self._failure_tasks: Set[asyncio.Task] = set()
+        self._room_tails: Dict[int, asyncio.Future] = {}  # game_id -> 该房间最后提交、尚未完成的任务
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """提交写入任务 fn(db, *args, **kwargs)"""
+        return self._enqueue(None, fn, args, kwargs)
+
+    def submit_room(self, room, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        提交属于某个房间的写入任务；房间此前的任务已失败（room.write_error 不为空）时不执行，
+        Future 以 WriteBehindError 结束
+        """
+        return self._enqueue(room, fn, args, kwargs)
+
+    def _enqueue(self, room, fn: Callable, args: tuple, kwargs: dict) -> asyncio.Future:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_log_write_failure)
+        if room is not None:
+            self._room_tails[room.game_id] = future
+            future.add_done_callback(partial(self._drop_tail, room.game_id))
+        self._queue.put_nowait((room, fn, args, kwargs, future))
+        return future
+
+    def _drop_tail(self, game_id: int, future: asyncio.Future) -> None:
+        if self._room_tails.get(game_id) is future:
+            del self._room_tails[game_id]
+
+    async def flush(self) -> None:
+        """等待已提交的写入全部完成"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def flush_room(self, game_id: int) -> None:
+        """等待某个房间已提交的写入全部完成（任务按提交顺序执行，等到它最后一个任务即可）；任务失败不抛出"""
+        future = self._room_tails.get(game_id)
+        if future is not None:
+            await asyncio.wait([future])
+
+    async def _run(self) -> None:
+        while True:
+            room, fn, args, kwargs, future = await self._queue.get()
+            try:
+                if room is not None and room.write_error is not None:
+                    raise WriteBehindError(f"房间 {room.game_id} 此前的写入失败，已跳过 {fn.__name__}")
+                result = await self._run_with_retry(fn, args, kwargs)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if room is not None and room.write_error is None:
+                    room.write_error = e
+                    self._notify_room_failure(room, e)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _run_with_retry(self, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        """写后任务在同一事务中提交，失败时整体回滚，可以直接重试（如 database is locked 等暂时性错误）"""
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                return await self.executor.run_in_session(fn, *args, **kwargs)
+            except Exception as e:
+                if attempt == WRITE_RETRIES:
+                    raise
+                print(f"写入数据库失败（{fn.__name__}），第 {attempt + 1} 次重试: {e!r}")
+                await asyncio.sleep(WRITE_RETRY_DELAY * (attempt + 1))
+
+    def _notify_room_failure(self, room, error: BaseException) -> None:
+        if self.on_room_failure is None:
+            return
+        # 保留任务引用，避免任务在完成前被回收
+        task = asyncio.ensure_future(self.on_room_failure(room, error))
+        self._failure_tasks.add(task)
+        task.add_done_callback(self._failure_tasks.discard)
+
+
+def _log_write_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        if not isinstance(future.exception(), WriteBehindError):
+            print(f"写入数据库失败: {future.exception()!r}")
+
+
+write_behind = WriteBehindQueue(db_executor)
+
+
+async def run_db(fn: Callable, *args, **kwargs) -> Any:
+    """在专用数据库线程中执行同步函数"""
+    return await db_executor.run(fn, *args, **kwargs)
+
+
+async def run_in_session(fn: Callable, *args, **kwargs) -> Any:
+    """在专用数据库线程中以新会话执行 fn(db, ...)"""
+    return await db_executor.run_in_session(fn, *args, **kwargs)
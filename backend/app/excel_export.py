@@ -1,39 +1,27 @@
 """
 Excel数据导出功能
+
+工作簿使用 openpyxl 的只写模式：每行生成后立即写入工作表的临时文件，不在内存中保留单元格对象；
+表头样式以命名样式在工作簿中登记一次，所有表头单元格共用。导出多局时内存占用不随局数增长。
+数据用列查询加载（load_games），多局导出按批用 IN 查询一次取出一批游戏的玩家、轮次、投票与用户名。
 """
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.dimensions import ColumnDimension
 from sqlalchemy.orm import Session
-from app.models import Game, GamePlayer, GameRound, User
+from app.models import Game, GamePlayer, GameRound, GameVote, User
 from app.game_logic import FINAL_ENV_POSITIVE_RATE, FINAL_ENV_NEGATIVE_RATE
-from typing import List
+from app.columnar_export import EXPORT_CHUNK_GAMES
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Sequence
 import os
 
-
-def _excel_column_letter(col_index: int) -> str:
-    """1-based column index to Excel column letter: 1->A, 26->Z, 27->AA, ..."""
-    result = ""
-    while col_index > 0:
-        col_index, r = (col_index - 1) // 26, (col_index - 1) % 26
-        result = chr(65 + r) + result
-    return result or "A"
+HEADER_STYLE = "game_header"
 
 
-def write_game_to_sheet(ws, db: Session, game_id: int):
-    """
-    将单局游戏数据写入已有工作表。含：每轮 NT/ENV/选择，6–10 轮申领补贴，11–15 轮申领补贴+投票（谁都不选记 0）。
-    """
-    from openpyxl.styles import Font, Alignment, PatternFill
-    from app.models import GameVote
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise ValueError(f"游戏 {game_id} 不存在")
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    if not players:
-        raise ValueError("游戏没有玩家")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    center_align = Alignment(horizontal="center", vertical="center")
+def _game_headers() -> List[str]:
     headers = ["玩家", "用户名"]
     for round_num in range(1, 16):
         headers.append(f"Round{round_num} NT")
@@ -44,84 +32,182 @@ def write_game_to_sheet(ws, db: Session, game_id: int):
         if round_num >= 11:
             headers.append(f"Round{round_num} 投票")
     headers.extend(["NT(结算前)", "最终ENV", "生态结算", "最终NT", "总收益", "是否获胜"])
-    for col_idx, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_idx)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_align
-    all_rounds = db.query(GameRound).filter(GameRound.game_id == game_id).order_by(
-        GameRound.round_number, GameRound.player_id
-    ).all()
-    player_rounds = {}
-    for round_data in all_rounds:
-        if round_data.player_id not in player_rounds:
-            player_rounds[round_data.player_id] = {}
-        player_rounds[round_data.player_id][round_data.round_number] = round_data
-    votes_list = db.query(GameVote).filter(GameVote.game_id == game_id).all()
-    votes_map = {}
-    for v in votes_list:
-        votes_map[(v.round_number, v.voter_id)] = v.target_id if v.target_id is not None else 0
-    for row_idx, player in enumerate(players, 2):
-        if getattr(player, "username", None) and str(player.username).strip():
-            username = (player.username or "").strip()
-        elif getattr(player, "user_id", None):
-            user = db.query(User).filter(User.id == player.user_id).first()
-            username = user.username if user else f"玩家{player.id}"
-        else:
-            username = f"玩家{player.id}"
-        ws.cell(row=row_idx, column=1, value=player.id)
-        ws.cell(row=row_idx, column=2, value=username)
-        col_idx = 3
+    return headers
+
+
+GAME_HEADERS = _game_headers()
+COMBINED_HEADERS = ["游戏"] + GAME_HEADERS
+
+
+def create_workbook() -> Workbook:
+    """只写模式的工作簿，并登记表头共用的命名样式"""
+    wb = Workbook(write_only=True)
+    wb.add_named_style(NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+        alignment=Alignment(horizontal="center", vertical="center"),
+    ))
+    return wb
+
+
+def _header_row(ws, headers: List[str]) -> List[WriteOnlyCell]:
+    row = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = HEADER_STYLE
+        row.append(cell)
+    return row
+
+
+@dataclass
+class GameSheetData:
+    """单局导出所需的全部数据（列查询得到的行，不含 ORM 对象）"""
+    game_id: int
+    players: list = field(default_factory=list)
+    player_rounds: Dict[int, dict] = field(default_factory=dict)  # player_id -> {round_number: 轮次行}
+    votes_map: Dict[tuple, int] = field(default_factory=dict)  # (round_number, voter_id) -> target_id（谁都不选为 0）
+    usernames: Dict[int, str] = field(default_factory=dict)  # player_id -> 显示名
+
+
+def load_games(db: Session, game_ids: Sequence[int]) -> Dict[int, GameSheetData]:
+    """
+    一次加载多局的导出数据：游戏、玩家、轮次、投票、旧数据的用户名各一次 IN 查询（调用方负责分批）
+
+    游戏不存在或没有玩家时抛出 ValueError，与逐局导出一致。
+    """
+    game_ids = list(game_ids)
+    found = {game_id for (game_id,) in db.query(Game.id).filter(Game.id.in_(game_ids))}
+    for game_id in game_ids:
+        if game_id not in found:
+            raise ValueError(f"游戏 {game_id} 不存在")
+    games = {game_id: GameSheetData(game_id) for game_id in game_ids}
+    for player in db.query(
+        GamePlayer.game_id, GamePlayer.id, GamePlayer.user_id, GamePlayer.username,
+        GamePlayer.initial_nt, GamePlayer.current_nt, GamePlayer.current_env,
+        GamePlayer.final_nt, GamePlayer.final_env, GamePlayer.is_winner,
+    ).filter(GamePlayer.game_id.in_(game_ids)).order_by(GamePlayer.game_id, GamePlayer.id):
+        games[player.game_id].players.append(player)
+    for game in games.values():
+        if not game.players:
+            raise ValueError("游戏没有玩家")
+    for rd in db.query(
+        GameRound.game_id, GameRound.round_number, GameRound.player_id, GameRound.choice,
+        GameRound.applied_subsidy, GameRound.nt_after, GameRound.env_after,
+    ).filter(GameRound.game_id.in_(game_ids)).order_by(
+        GameRound.game_id, GameRound.round_number, GameRound.player_id
+    ):
+        games[rd.game_id].player_rounds.setdefault(rd.player_id, {})[rd.round_number] = rd
+    for v in db.query(
+        GameVote.game_id, GameVote.round_number, GameVote.voter_id, GameVote.target_id
+    ).filter(GameVote.game_id.in_(game_ids)):
+        games[v.game_id].votes_map[(v.round_number, v.voter_id)] = v.target_id if v.target_id is not None else 0
+
+    # 显示名：本局昵称 > 旧数据关联的用户名 > 玩家{id}
+    user_ids = {
+        p.user_id for game in games.values() for p in game.players
+        if not (p.username and str(p.username).strip()) and p.user_id
+    }
+    accounts = dict(db.query(User.id, User.username).filter(User.id.in_(user_ids)).all()) if user_ids else {}
+    for game in games.values():
+        for p in game.players:
+            if p.username and str(p.username).strip():
+                game.usernames[p.id] = p.username.strip()
+            else:
+                game.usernames[p.id] = accounts.get(p.user_id) or f"玩家{p.id}"
+    return games
+
+
+def iter_games(db: Session, game_ids: Sequence[int], chunk_games: int = EXPORT_CHUNK_GAMES) -> Iterator[GameSheetData]:
+    """按 chunk_games 局一批加载，按 game_ids 的顺序逐局产出"""
+    game_ids = list(game_ids)
+    for start in range(0, len(game_ids), chunk_games):
+        chunk = game_ids[start:start + chunk_games]
+        games = load_games(db, chunk)
+        for game_id in chunk:
+            yield games[game_id]
+
+
+def _player_rows(game: GameSheetData) -> Iterator[list]:
+    """逐个玩家生成一行数据"""
+    for player in game.players:
+        row = [player.id, game.usernames[player.id]]
+        rounds = game.player_rounds.get(player.id, {})
         for round_num in range(1, 16):
-            if player.id in player_rounds and round_num in player_rounds[player.id]:
-                rd = player_rounds[player.id][round_num]
-                ws.cell(row=row_idx, column=col_idx, value=round(rd.nt_after, 1))
-                ws.cell(row=row_idx, column=col_idx + 1, value=round(rd.env_after, 1))
-                ws.cell(row=row_idx, column=col_idx + 2, value="有机" if rd.choice == "organic" else "无机")
-                col_idx += 3
+            rd = rounds.get(round_num)
+            if rd is not None:
+                row.append(round(rd.nt_after, 1))
+                row.append(round(rd.env_after, 1))
+                row.append("有机" if rd.choice == "organic" else "无机")
                 if round_num >= 6:
-                    ws.cell(row=row_idx, column=col_idx, value="是" if rd.applied_subsidy else "否")
-                    col_idx += 1
+                    row.append("是" if rd.applied_subsidy else "否")
                 if round_num >= 11:
-                    vote_val = votes_map.get((round_num, player.id), "")
-                    ws.cell(row=row_idx, column=col_idx, value=vote_val if vote_val != "" else 0)
-                    col_idx += 1
+                    row.append(game.votes_map.get((round_num, player.id), 0))
             else:
-                ws.cell(row=row_idx, column=col_idx, value="-")
-                ws.cell(row=row_idx, column=col_idx + 1, value="-")
-                ws.cell(row=row_idx, column=col_idx + 2, value="-")
-                col_idx += 3
+                row.extend(["-", "-", "-"])
                 if round_num >= 6:
-                    ws.cell(row=row_idx, column=col_idx, value="-")
-                    col_idx += 1
+                    row.append("-")
                 if round_num >= 11:
-                    ws.cell(row=row_idx, column=col_idx, value="-")
-                    col_idx += 1
+                    row.append("-")
         final_nt = player.final_nt if player.final_nt else player.current_nt
         final_env = player.final_env if player.final_env is not None else player.current_env
         env_settlement = (final_env * FINAL_ENV_POSITIVE_RATE if final_env > 0 else final_env * FINAL_ENV_NEGATIVE_RATE) if final_env is not None else 0
         nt_before_settlement = final_nt - env_settlement if final_nt is not None else player.current_nt
-        ws.cell(row=row_idx, column=col_idx, value=round(nt_before_settlement, 1))
-        ws.cell(row=row_idx, column=col_idx + 1, value=round(final_env, 1) if final_env is not None else "-")
-        ws.cell(row=row_idx, column=col_idx + 2, value=round(env_settlement, 1))
-        ws.cell(row=row_idx, column=col_idx + 3, value=round(final_nt, 1) if final_nt is not None else "-")
         total_reward = (final_nt or player.current_nt) - player.initial_nt
-        ws.cell(row=row_idx, column=col_idx + 4, value=round(total_reward, 1))
-        ws.cell(row=row_idx, column=col_idx + 5, value="是" if getattr(player, "is_winner", False) else "否")
-    ws.column_dimensions['A'].width = 10
-    ws.column_dimensions['B'].width = 15
-    for col in range(3, len(headers) + 1):
-        ws.column_dimensions[_excel_column_letter(col)].width = 12
-
-
-def export_batch_to_excel(db: Session, game_ids: List[int], output_path: str):
-    """将多局游戏导出到同一 Excel 文件，每局一页（sheet）。"""
-    wb = Workbook()
-    wb.remove(wb.active)
-    for idx, game_id in enumerate(game_ids, 1):
-        ws = wb.create_sheet(title=f"游戏{idx}", index=idx - 1)
-        write_game_to_sheet(ws, db, game_id)
+        row.extend([
+            round(nt_before_settlement, 1),
+            round(final_env, 1) if final_env is not None else "-",
+            round(env_settlement, 1),
+            round(final_nt, 1) if final_nt is not None else "-",
+            round(total_reward, 1),
+            "是" if player.is_winner else "否",
+        ])
+        yield row
+
+
+def _prepare_sheet(ws, headers: List[str], widths: List[int]) -> None:
+    """只写模式下列宽须在写入第一行之前设置：前几列按 widths，其余列共用一个列宽定义（12）"""
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    ws.column_dimensions[get_column_letter(len(widths) + 1)] = ColumnDimension(
+        ws, min=len(widths) + 1, max=len(headers), width=12
+    )
+    ws.append(_header_row(ws, headers))
+
+
+def write_game_data_to_sheet(ws, game: GameSheetData) -> None:
+    """将已加载的单局数据写入只写工作表"""
+    _prepare_sheet(ws, GAME_HEADERS, [10, 15])
+    for row in _player_rows(game):
+        ws.append(row)
+
+
+def write_game_to_sheet(ws, db: Session, game_id: int):
+    """
+    将单局游戏数据写入只写工作表（由 create_workbook() 创建的工作簿）。
+    含：每轮 NT/ENV/选择，6–10 轮申领补贴，11–15 轮申领补贴+投票（谁都不选记 0）。
+    """
+    write_game_data_to_sheet(ws, load_games(db, [game_id])[game_id])
+
+
+def export_batch_to_excel(db: Session, game_ids: List[int], output_path: str, combined: bool = False):
+    """
+    将多局游戏导出到同一 Excel 文件：默认每局一页（sheet）；combined=True 时全部写入一页，首列为游戏序号。
+    数据按 EXPORT_CHUNK_GAMES 局一批加载，查询次数与局数无关。
+    """
+    wb = create_workbook()
+    if combined:
+        ws = wb.create_sheet(title="全部游戏")
+        _prepare_sheet(ws, COMBINED_HEADERS, [8, 10, 15])
+        for idx, game in enumerate(iter_games(db, game_ids), 1):
+            for row in _player_rows(game):
+                ws.append([idx] + row)
+    else:
+        for idx, game in enumerate(iter_games(db, game_ids), 1):
+            ws = wb.create_sheet(title=f"游戏{idx}")
+            write_game_data_to_sheet(ws, game)
+            # 写完即关闭：释放该页的临时文件句柄与写缓冲，局数再多也不会同时打开大量文件
+            ws.close()
     os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
     wb.save(output_path)
     return output_path
@@ -131,9 +217,8 @@ def export_game_to_excel(db: Session, game_id: int, output_path: str = None):
     """
     导出单局游戏数据到Excel
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "游戏数据"
+    wb = create_workbook()
+    ws = wb.create_sheet(title="游戏数据")
     write_game_to_sheet(ws, db, game_id)
     if output_path is None:
         output_dir = "exports"
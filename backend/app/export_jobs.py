@@ -0,0 +1,288 @@
+"""
+Excel 导出任务与导出缓存：工作簿在专用导出线程池中生成，不阻塞事件循环，也不占用数据库写线程（导出只读数据库）。
+
+缓存按内容寻址：文件名为 exports/game_{game_id}_{version}.xlsx，version 是该局数据版本的摘要
+（状态、轮次、结束时间、最大玩家 / 轮次 / 投票 id，见 export_version），数据不变时版本不变、文件直接复用，
+也用作下载接口的 ETag。
+
+- 每个任务有 job_id，可通过 /api/games/{game_id}/exports/{job_id} 查询状态；
+- 单飞：同一局同一版本同时只有一个进行中的任务，并发请求等待同一个任务；
+- 先写临时文件再原子重命名，多个进程同时生成同一版本也不会读到写了一半的文件；
+- 缓存目录超过 EXPORT_CACHE_MAX_MB 时按最近使用时间（命中时刷新 mtime）删除最旧的缓存文件，
+  只删除符合缓存命名的文件，批量测试等其他导出不受影响；
+- 任务结束（成功或失败）后依次 await 提交时登记的回调，main 中用于向房间广播 excel_ready。
+
+任务记录只在本进程内存中，最多保留 EXPORT_JOBS_KEEP 个已结束的任务。
+下载接口的数据版本（version）在单独的读线程中计算，既不占用数据库写线程，也不排在正在生成的工作簿之后。
+"""
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.excel_export import export_game_to_excel
+from app.models import SessionLocal, Game, GamePlayer, GameRound, GameVote
+
+EXPORT_THREADS = int(os.environ.get("EXPORT_THREADS", "1"))
+EXPORT_JOBS_KEEP = int(os.environ.get("EXPORT_JOBS_KEEP", "256"))
+EXPORT_CACHE_MAX_MB = float(os.environ.get("EXPORT_CACHE_MAX_MB", "256"))
+EXPORT_DIR = "exports"
+
+# 导出格式变化时递增，使旧版本的缓存文件失效
+EXPORT_FORMAT_VERSION = 1
+
+CACHE_FILE_RE = re.compile(r"^game_\d+_[0-9a-f]{16}\.xlsx$")
+
+JOB_PENDING = "pending"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class ExportJob:
+    job_id: str
+    game_id: int
+    version: Optional[str] = None  # 提交时未知（游戏结束时）则由任务在导出前计算
+    status: str = JOB_PENDING
+    path: Optional[str] = None
+    error: Optional[str] = None
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+    callbacks: List[Callable[["ExportJob"], Awaitable[None]]] = field(default_factory=list, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "game_id": self.game_id,
+            "version": self.version,
+            "status": self.status,
+            "excel_path": self.path,
+            "error": self.error,
+        }
+
+
+def export_version(db: Session, game_id: int) -> Optional[str]:
+    """
+    该局导出内容的数据版本；游戏不存在时为 None
+
+    轮次记录、投票、玩家只会新增，余额等更新与新增在同一写后任务中提交，
+    因此各表的最大 id 加上房间状态即可确定导出内容。
+    """
+    def max_id(model):
+        return db.query(func.max(model.id)).filter(model.game_id == game_id).scalar_subquery()
+
+    row = db.query(
+        Game.status, Game.current_round, Game.phase, Game.finished_at,
+        max_id(GamePlayer), max_id(GameRound), max_id(GameVote),
+    ).filter(Game.id == game_id).first()
+    if row is None:
+        return None
+    key = repr((EXPORT_FORMAT_VERSION, game_id, *row))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _read_version(game_id: int) -> Optional[str]:
+    """在导出读线程中执行：独立会话计算数据版本"""
+    db = SessionLocal()
+    try:
+        return export_version(db, game_id)
+    finally:
+        db.close()
+
+
+def touch(path: Optional[str]) -> bool:
+    """刷新缓存文件的 mtime（记为最近使用）；文件已被删除时返回 False"""
+    if path is None:
+        return False
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def cache_path(game_id: int, version: str) -> str:
+    return os.path.join(EXPORT_DIR, f"game_{game_id}_{version}.xlsx")
+
+
+def evict_cache(keep: Optional[str] = None, max_bytes: Optional[float] = None) -> List[str]:
+    """
+    缓存文件总大小超出上限时，按 mtime 从旧到新删除（keep 为刚生成 / 命中的文件，不删除）
+
+    Returns:
+        删除的文件路径
+    """
+    if max_bytes is None:
+        max_bytes = EXPORT_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    try:
+        with os.scandir(EXPORT_DIR) as it:
+            for entry in it:
+                if entry.is_file() and CACHE_FILE_RE.match(entry.name):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return []
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def _export_game(game_id: int, version: Optional[str]):
+    """在导出线程中执行：命中缓存则刷新 mtime，否则生成到临时文件后原子重命名"""
+    db = SessionLocal()
+    try:
+        if version is None:
+            version = export_version(db, game_id)
+            if version is None:
+                raise ValueError(f"游戏 {game_id} 不存在")
+        path = cache_path(game_id, version)
+        if touch(path):
+            return path, version
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            export_game_to_excel(db, game_id, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        db.close()
+    evict_cache(keep=path)
+    return path, version
+
+
+async def _notify(callback: Callable[[ExportJob], Awaitable[None]], job: ExportJob) -> None:
+    try:
+        await callback(job)
+    except Exception as e:
+        print(f"导出任务回调失败: {e!r}")
+
+
+class ExportJobs:
+    """导出线程池 + 按 (局, 版本) 去重的任务表"""
+
+    def __init__(self, threads: int = EXPORT_THREADS, keep: int = EXPORT_JOBS_KEEP):
+        self.threads = threads
+        self.keep = keep
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._reader: Optional[ThreadPoolExecutor] = None  # 计算数据版本的读线程
+        self._jobs: "OrderedDict[str, ExportJob]" = OrderedDict()
+        self._latest: dict = {}  # game_id -> 最近一个任务的 job_id
+        self._callback_tasks: Set[asyncio.Task] = set()  # 保留回调任务的引用，避免完成前被回收
+
+    async def version(self, game_id: int) -> Optional[str]:
+        """该局当前的数据版本（游戏不存在时为 None），在读线程中计算"""
+        if self._reader is None:
+            self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-read")
+        return await asyncio.get_running_loop().run_in_executor(self._reader, _read_version, game_id)
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self._jobs.get(job_id)
+
+    def latest(self, game_id: int) -> Optional[ExportJob]:
+        job_id = self._latest.get(game_id)
+        return self._jobs.get(job_id) if job_id is not None else None
+
+    def submit(
+        self,
+        game_id: int,
+        version: Optional[str] = None,
+        on_done: Optional[Callable[[ExportJob], Awaitable[None]]] = None,
+    ) -> ExportJob:
+        """
+        提交该局指定版本的导出任务（version 为空表示导出时的最新数据）
+
+        该局进行中的任务版本相同（或尚未确定）时返回它；已完成的同版本任务文件仍在时也直接返回它
+        （并刷新文件的 mtime，缓存按最近使用淘汰）；否则新建任务。on_done 在任务结束后被 await（任务已结束时立即调度）。
+        """
+        job = self.latest(game_id)
+        reusable = job is not None and (
+            (job.status == JOB_PENDING and (version is None or job.version in (None, version)))
+            or (job.status == JOB_DONE and version in (None, job.version) and touch(job.path))
+        )
+        if not reusable:
+            job = self._start(game_id, version)
+        if on_done is not None:
+            if job.status == JOB_PENDING:
+                job.callbacks.append(on_done)
+            else:
+                task = asyncio.ensure_future(_notify(on_done, job))
+                self._callback_tasks.add(task)
+                task.add_done_callback(self._callback_tasks.discard)
+        return job
+
+    def _start(self, game_id: int, version: Optional[str]) -> ExportJob:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="export")
+        job = ExportJob(job_id=uuid.uuid4().hex, game_id=game_id, version=version)
+        self._jobs[job.job_id] = job
+        self._latest[game_id] = job.job_id
+        job.future = asyncio.ensure_future(self._run(job))
+        self._evict()
+        return job
+
+    async def _run(self, job: ExportJob) -> ExportJob:
+        loop = asyncio.get_running_loop()
+        try:
+            job.path, job.version = await loop.run_in_executor(
+                self._executor, _export_game, job.game_id, job.version
+            )
+            job.status = JOB_DONE
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)
+            print(f"导出Excel失败: {e}")
+        for callback in job.callbacks:
+            await _notify(callback, job)
+        job.callbacks.clear()
+        return job
+
+    def _evict(self) -> None:
+        """超出上限时从最早的任务开始移除已结束的任务"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.keep:
+                break
+            job = self._jobs[job_id]
+            if job.status == JOB_PENDING:
+                continue
+            del self._jobs[job_id]
+            if self._latest.get(job.game_id) == job_id:
+                del self._latest[job.game_id]
+
+    async def join(self) -> None:
+        """等待进行中的任务全部结束"""
+        pending = [job.future for job in self._jobs.values() if job.status == JOB_PENDING]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        if self._reader is not None:
+            self._reader.shutdown(wait=wait)
+            self._reader = None
+
+
+export_jobs = ExportJobs()
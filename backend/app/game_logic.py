@@ -1,8 +1,10 @@
 """
 游戏核心逻辑：收益计算、生态值影响、识破机制等
 所有数值均在此处以常量定义，避免 magic number。
+调参 / 批量模拟时可用不可变的 GameRules 覆盖部分常量，各计算函数通过 rules 参数接收。
 """
 import random
+from dataclasses import dataclass, fields, replace
 from typing import Dict, List, Tuple
 
 # ========== 初始状态 ==========
@@ -42,7 +44,52 @@ PHASE3_CATCH_PROBABILITY = 0.5
 # ========== 房间人数上限 ==========
 MAX_PLAYERS_PER_GAME = 99
 
-def calculate_earnings(choice: str, current_env: float = 0.0) -> float:
+@dataclass(frozen=True)
+class GameRules:
+    """
+    一套完整的数值规则（不可变）。默认值即上面的模块常量；
+    调参时用 DEFAULT_RULES.replace(...) 派生新规则传给各计算函数，无需修改本文件。
+    """
+    initial_nt: float = INITIAL_NT
+    initial_env: float = INITIAL_ENV
+    organic_base_nt: float = ORGANIC_BASE_NT
+    inorganic_base_nt: float = INORGANIC_BASE_NT
+    env_nt_bonus_rate: float = ENV_NT_BONUS_RATE
+    env_bonus_min_ratio: float = ENV_BONUS_MIN_RATIO
+    env_bonus_max_ratio: float = ENV_BONUS_MAX_RATIO
+    env_self_organic: float = ENV_SELF_ORGANIC
+    env_self_inorganic: float = ENV_SELF_INORGANIC
+    env_others_organic: float = ENV_OTHERS_ORGANIC
+    env_others_inorganic: float = ENV_OTHERS_INORGANIC
+    final_env_positive_rate: float = FINAL_ENV_POSITIVE_RATE
+    final_env_negative_rate: float = FINAL_ENV_NEGATIVE_RATE
+    phase2_subsidy: float = PHASE2_SUBSIDY
+    phase3_subsidy: float = PHASE3_SUBSIDY
+    phase2_catch_probability: float = PHASE2_CATCH_PROBABILITY
+    phase3_catch_probability: float = PHASE3_CATCH_PROBABILITY
+
+    def replace(self, **changes) -> "GameRules":
+        """返回修改了部分字段的新规则"""
+        return replace(self, **changes)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def subsidy(self, phase: int) -> float:
+        """该阶段的补贴 / 质押金额"""
+        return self.phase2_subsidy if phase == 2 else self.phase3_subsidy
+
+    def catch_probability(self, phase: int) -> float:
+        """该阶段无机肥申领补贴的系统识破概率"""
+        if phase == 2:
+            return self.phase2_catch_probability
+        if phase == 3:
+            return self.phase3_catch_probability
+        return 0.0
+
+DEFAULT_RULES = GameRules()
+
+def calculate_earnings(choice: str, current_env: float = 0.0, rules: GameRules = DEFAULT_RULES) -> float:
     """
     计算本轮收益。基础收益 + 当前环境值对 NT 的影响（每 10 ENV = 0.5 NT），
     环境影响封顶：加减不超过基础收益的 50%～200%（有机肥 ±1.5～6，无机肥 ±3～12）。
@@ -51,48 +98,80 @@ def calculate_earnings(choice: str, current_env: float = 0.0) -> float:
     Args:
         choice: "organic" 或 "inorganic"
         current_env: 该玩家在本轮开始时的环境值（第一轮后开始影响）
+        rules: 数值规则，默认 DEFAULT_RULES
     
     Returns:
         本轮 base + clamp(env_bonus, -base*50%, base*200%)
     """
-    base = ORGANIC_BASE_NT if choice == "organic" else INORGANIC_BASE_NT
-    raw_bonus = current_env * ENV_NT_BONUS_RATE
-    min_bonus = -base * ENV_BONUS_MIN_RATIO
-    max_bonus = base * ENV_BONUS_MAX_RATIO
+    base = rules.organic_base_nt if choice == "organic" else rules.inorganic_base_nt
+    raw_bonus = current_env * rules.env_nt_bonus_rate
+    min_bonus = -base * rules.env_bonus_min_ratio
+    max_bonus = base * rules.env_bonus_max_ratio
     bonus = max(min_bonus, min(max_bonus, raw_bonus))
     return base + bonus
 
-def calculate_env_change(choice: str, player_id: int, all_choices: Dict[int, str]) -> float:
+def count_choices(all_choices: Dict[int, str]) -> Tuple[int, int]:
     """
-    计算生态值变化
+    统计本轮有机肥 / 无机肥人数
     
     Args:
-        choice: 当前玩家的选择
-        player_id: 当前玩家ID
         all_choices: 所有玩家的选择 {player_id: choice}
     
     Returns:
-        生态值变化量
+        (有机肥人数, 无机肥人数)
+    """
+    organic_count = sum(1 for c in all_choices.values() if c == "organic")
+    return organic_count, len(all_choices) - organic_count
+
+def calculate_env_change_from_counts(choice: str, organic_count: int, inorganic_count: int,
+                                     rules: GameRules = DEFAULT_RULES) -> float:
     """
-    env_change = 0.0
+    按全场有机肥 / 无机肥人数计算生态值变化（O(1)，人数含自己）
+    
+    Args:
+        choice: 当前玩家的选择
+        organic_count: 本轮选择有机肥的总人数
+        inorganic_count: 本轮选择无机肥的总人数
+        rules: 数值规则，默认 DEFAULT_RULES
     
-    # 自己的选择影响
+    Returns:
+        生态值变化量
+    """
+    # 自己的选择影响；他人人数 = 总人数去掉自己
     if choice == "organic":
-        env_change += ENV_SELF_ORGANIC
+        self_change = rules.env_self_organic
+        organic_count -= 1
     else:  # inorganic
-        env_change += ENV_SELF_INORGANIC
+        self_change = rules.env_self_inorganic
+        inorganic_count -= 1
     
     # 其他人的选择影响
-    for pid, c in all_choices.items():
-        if pid != player_id:
-            if c == "organic":
-                env_change += ENV_OTHERS_ORGANIC
-            else:  # inorganic
-                env_change += ENV_OTHERS_INORGANIC
+    return 0.0 + self_change + organic_count * rules.env_others_organic + inorganic_count * rules.env_others_inorganic
+
+def calculate_env_change(choice: str, player_id: int, all_choices: Dict[int, str],
+                         rules: GameRules = DEFAULT_RULES) -> float:
+    """
+    计算生态值变化
     
-    return env_change
+    Args:
+        choice: 当前玩家的选择
+        player_id: 当前玩家ID
+        all_choices: 所有玩家的选择 {player_id: choice}
+        rules: 数值规则，默认 DEFAULT_RULES
+    
+    Returns:
+        生态值变化量
+    """
+    others = {pid: c for pid, c in all_choices.items() if pid != player_id}
+    organic_count, inorganic_count = count_choices(others)
+    if choice == "organic":
+        organic_count += 1
+    else:
+        inorganic_count += 1
+    return calculate_env_change_from_counts(choice, organic_count, inorganic_count, rules)
 
-def check_subsidy_verification(choice: str, phase: int, is_voted: bool = False) -> bool:
+def check_subsidy_verification(choice: str, phase: int, is_voted: bool = False, rng=None,
+                               rules: GameRules = DEFAULT_RULES) -> bool:
     """
     检查补贴验证结果
     
@@ -100,10 +179,15 @@ def check_subsidy_verification(choice: str, phase: int, is_voted: bool = False)
         choice: 玩家选择的肥料类型
         phase: 游戏阶段 (2 或 3)
         is_voted: 是否被投票质疑
+        rng: 随机源（需有 random() 方法，如 numpy.random.Generator），默认使用 random 模块
+        rules: 数值规则，默认 DEFAULT_RULES
     
     Returns:
         True=通过验证, False=被识破
     """
+    if rng is None:
+        rng = random
+    
     # 如果选择有机肥，总是通过
     if choice == "organic":
         return True
@@ -114,27 +198,28 @@ def check_subsidy_verification(choice: str, phase: int, is_voted: bool = False)
     
     # 无机肥申请补贴的识破概率
     if phase == 2:
-        return random.random() >= PHASE2_CATCH_PROBABILITY
+        return rng.random() >= rules.phase2_catch_probability
     elif phase == 3:
-        return random.random() >= PHASE3_CATCH_PROBABILITY
+        return rng.random() >= rules.phase3_catch_probability
     
     return True
 
-def final_settlement(nt: float, env: float) -> float:
+def final_settlement(nt: float, env: float, rules: GameRules = DEFAULT_RULES) -> float:
     """
     最终结算：将生态值转换为NT（仅 15 轮结束后调用）
     
     Args:
         nt: 当前NT数量
         env: 当前生态值
+        rules: 数值规则，默认 DEFAULT_RULES
     
     Returns:
         最终NT数量
     """
     if env > 0:
-        nt += env * FINAL_ENV_POSITIVE_RATE
+        nt += env * rules.final_env_positive_rate
     else:
-        nt += env * FINAL_ENV_NEGATIVE_RATE
+        nt += env * rules.final_env_negative_rate
     return nt
 
 def get_env_change_text(env_change: float) -> str:
@@ -0,0 +1,218 @@
+"""
+游戏核心逻辑的 NumPy 向量化版本：一次调用处理整个房间（形状 [players]）
+或整批对局（形状 [games, players]）。
+
+与 game_logic.py 中的标量函数逐元素、逐比特一致：
+- 选择用布尔数组表示，True=有机肥，False=无机肥；
+- 补贴验证结果用 int8 表示：VERIFIED_PASSED=1 通过，VERIFIED_CAUGHT=0 识破，VERIFIED_NONE=-1 未申请；
+- 识破判定使用 numpy.random.Generator 生成的均匀随机数 u，
+  判定规则与 check_subsidy_verification 相同（u >= 识破概率 即通过），
+  因此把同一个 u 交给标量函数（rng.random() 返回 u）会得到完全相同的结果；
+- 所有函数都接受 rules（GameRules），默认 DEFAULT_RULES。
+"""
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+from app.game_logic import GameRules, DEFAULT_RULES
+
+VERIFIED_NONE = -1
+VERIFIED_CAUGHT = 0
+VERIFIED_PASSED = 1
+
+
+def make_rng(seed=None) -> np.random.Generator:
+    """创建可复现的随机源；seed 可为 int、SeedSequence 或已有的 Generator"""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def encode_choices(choices: Sequence[str]) -> np.ndarray:
+    """["organic", "inorganic", ...] → 布尔数组（True=有机肥）"""
+    return np.asarray(choices) == "organic"
+
+
+def decode_choices(organic: np.ndarray) -> np.ndarray:
+    """布尔数组 → "organic" / "inorganic" 字符串数组"""
+    return np.where(organic, "organic", "inorganic")
+
+
+def calculate_earnings_array(organic: np.ndarray, current_env: np.ndarray,
+                             rules: GameRules = DEFAULT_RULES) -> np.ndarray:
+    """
+    calculate_earnings 的向量化版本
+
+    Args:
+        organic: 是否选择有机肥（布尔数组）
+        current_env: 每位玩家本轮开始时的环境值
+
+    Returns:
+        每位玩家本轮 base + clamp(env_bonus, -base*50%, base*100%)
+    """
+    base = np.where(organic, rules.organic_base_nt, rules.inorganic_base_nt)
+    raw_bonus = np.asarray(current_env, dtype=np.float64) * rules.env_nt_bonus_rate
+    min_bonus = -base * rules.env_bonus_min_ratio
+    max_bonus = base * rules.env_bonus_max_ratio
+    bonus = np.maximum(min_bonus, np.minimum(max_bonus, raw_bonus))
+    return base + bonus
+
+
+def calculate_env_change_array(organic: np.ndarray, active: Optional[np.ndarray] = None,
+                               rules: GameRules = DEFAULT_RULES) -> np.ndarray:
+    """
+    calculate_env_change 的向量化版本：按最后一维（玩家）统计全场有机/无机人数
+
+    Args:
+        organic: 是否选择有机肥，形状 [players] 或 [games, players]
+        active: 本轮参与结算的座位（人数不等的对局用 False 填充空位），默认全部参与
+
+    Returns:
+        每位玩家的生态值变化量；空位为 0
+    """
+    organic = np.asarray(organic, dtype=bool)
+    if active is None:
+        active = np.ones(organic.shape, dtype=bool)
+    organic_count = np.count_nonzero(organic & active, axis=-1)[..., None]
+    inorganic_count = np.count_nonzero(~organic & active, axis=-1)[..., None]
+    # 他人人数 = 总人数去掉自己
+    others_organic = organic_count - organic
+    others_inorganic = inorganic_count - ~organic
+    self_change = np.where(organic, rules.env_self_organic, rules.env_self_inorganic)
+    env_change = (0.0 + self_change + others_organic * rules.env_others_organic
+                  + others_inorganic * rules.env_others_inorganic)
+    return np.where(active, env_change, 0.0)
+
+
+def check_subsidy_verification_array(organic: np.ndarray, phase: int, draws: np.ndarray,
+                                     is_voted: Optional[np.ndarray] = None,
+                                     rules: GameRules = DEFAULT_RULES) -> np.ndarray:
+    """
+    check_subsidy_verification 的向量化版本
+
+    Args:
+        organic: 是否选择有机肥
+        phase: 游戏阶段 (2 或 3)
+        draws: 每个座位一个 [0, 1) 均匀随机数
+        is_voted: 是否被投票质疑（被质疑的无机肥 100% 识破）
+
+    Returns:
+        布尔数组：True=通过验证，False=被识破
+    """
+    if phase not in (2, 3):
+        return np.ones(np.shape(organic), dtype=bool)
+    passed = organic | (draws >= rules.catch_probability(phase))
+    if is_voted is not None:
+        passed = organic | (passed & ~is_voted)
+    return passed
+
+
+def final_settlement_array(nt: np.ndarray, env: np.ndarray, rules: GameRules = DEFAULT_RULES) -> np.ndarray:
+    """final_settlement 的向量化版本"""
+    nt = np.asarray(nt, dtype=np.float64)
+    env = np.asarray(env, dtype=np.float64)
+    return np.where(env > 0, nt + env * rules.final_env_positive_rate, nt + env * rules.final_env_negative_rate)
+
+
+def resolve_round_array(
+    organic: np.ndarray,
+    apply_subsidy: np.ndarray,
+    current_nt: np.ndarray,
+    current_env: np.ndarray,
+    phase: int,
+    rng: Optional[np.random.Generator] = None,
+    draws: Optional[np.ndarray] = None,
+    active: Optional[np.ndarray] = None,
+    rules: GameRules = DEFAULT_RULES,
+) -> Dict[str, np.ndarray]:
+    """
+    round_engine.resolve_round 的向量化版本：一次调用算出整房间 / 整批对局本轮结果。
+    Phase 2 立即验证补贴；Phase 3 只扣质押，验证留给 settle_phase3_array。
+
+    Args:
+        organic / apply_subsidy / current_nt / current_env: 形状相同的每座位数组
+        phase: 当前阶段 (1, 2, 3)
+        rng: Phase 2 识破用随机源（未给 draws 时每个座位抽一个均匀数）
+        draws: 直接指定识破用均匀随机数（便于与标量函数逐个对照）
+        active: 参与本轮的座位
+        rules: 数值规则
+
+    Returns:
+        {"earnings", "env_change", "subsidy_verified", "nt_after", "env_after"}
+    """
+    organic = np.asarray(organic, dtype=bool)
+    if active is None:
+        active = np.ones(organic.shape, dtype=bool)
+    applied = np.asarray(apply_subsidy, dtype=bool) & active & (phase >= 2)
+    current_nt = np.asarray(current_nt, dtype=np.float64)
+    current_env = np.asarray(current_env, dtype=np.float64)
+
+    env_change = calculate_env_change_array(organic, active, rules)
+    earnings = calculate_earnings_array(organic, current_env, rules)
+    verified = np.full(organic.shape, VERIFIED_NONE, dtype=np.int8)
+
+    if phase >= 2:
+        amount = rules.subsidy(phase)
+        # 先扣除质押
+        earnings = np.where(applied, earnings - amount, earnings)
+        if phase == 2:
+            if draws is None:
+                draws = make_rng(rng).random(organic.shape)
+            passed = check_subsidy_verification_array(organic, 2, draws, rules=rules)
+            verified = np.where(applied, passed.astype(np.int8), verified).astype(np.int8)
+            # 验证通过，返还质押并获得补贴
+            earnings = np.where(applied & passed, earnings + amount * 2, earnings)
+
+    earnings = np.where(active, earnings, 0.0)
+    return {
+        "earnings": earnings,
+        "env_change": env_change,
+        "subsidy_verified": verified,
+        "nt_after": np.where(active, current_nt + earnings, current_nt),
+        "env_after": np.where(active, current_env + env_change, current_env),
+    }
+
+
+def settle_phase3_array(
+    organic: np.ndarray,
+    applied: np.ndarray,
+    env_before: np.ndarray,
+    round_nt_earned: np.ndarray,
+    subsidy_verified: np.ndarray,
+    rng: Optional[np.random.Generator] = None,
+    draws: Optional[np.ndarray] = None,
+    rules: GameRules = DEFAULT_RULES,
+) -> Dict[str, np.ndarray]:
+    """
+    Phase 3 投票之后的补贴结算（与 process_phase3_final_calculation 一致）：
+    - 已被投票识破（VERIFIED_CAUGHT）：不再处理；
+    - 被投票核查通过（VERIFIED_PASSED）：返还质押并获得补贴；
+    - 未核查（VERIFIED_NONE）：按 phase3_catch_probability 系统识破，
+      识破则失去本轮基础收益，本轮收益记为 -phase3_subsidy，否则返还质押并获得补贴。
+
+    Returns:
+        {"nt_delta": 需加到 current_nt 上的调整量, "round_nt_earned", "subsidy_verified",
+         "system_caught": 本步被系统识破的座位}
+    """
+    organic = np.asarray(organic, dtype=bool)
+    applied = np.asarray(applied, dtype=bool)
+    verified = np.asarray(subsidy_verified, dtype=np.int8)
+    earned = np.asarray(round_nt_earned, dtype=np.float64)
+    if draws is None:
+        draws = make_rng(rng).random(organic.shape)
+
+    pending = applied & (verified == VERIFIED_NONE)
+    passed_now = check_subsidy_verification_array(organic, 3, draws, rules=rules)
+    system_caught = pending & ~passed_now
+    rewarded = applied & ((verified == VERIFIED_PASSED) | (pending & passed_now))
+
+    subsidy = rules.phase3_subsidy
+    base_earnings = calculate_earnings_array(organic, env_before, rules)
+    nt_delta = np.where(system_caught, -base_earnings, np.where(rewarded, subsidy * 2, 0.0))
+    earned = np.where(system_caught, -subsidy, np.where(rewarded, earned + subsidy * 2, earned))
+    verified = np.where(pending, passed_now.astype(np.int8), verified).astype(np.int8)
+    return {
+        "nt_delta": nt_delta,
+        "round_nt_earned": earned,
+        "subsidy_verified": verified,
+        "system_caught": system_caught,
+    }
@@ -1,32 +1,48 @@
 """
 FastAPI主应用
+
+所有数据库操作都在专用数据库线程中执行（app.db_executor），协程只 await 结果：
+接口中的同步步骤写成 _xxx(db, ...) 函数，返回普通数据。
+游戏进行中的状态以内存中的房间（app.rooms）为准，数据库在轮次边界由写后队列落库。
+多进程部署时每个房间只在所有者 worker 中处理，其他 worker 通过房间总线（app.room_bus）转发。
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Dict, List, Any
+from typing import List, Any, Optional
+import asyncio
 import json
+import os
 import random
 import string
-from datetime import datetime
+from datetime import date, datetime
 
 from app.models import (
-    Base, engine, SessionLocal, init_db,
-    User, Game, GamePlayer, GameRound, GameVote
+    Base, engine, init_db,
+    User, Game, GamePlayer
 )
 from app.schemas import (
     UserCreate, UserResponse, GameResponse, PlayerResponse,
     RoundChoice, RoundResult, GameState, BroadcastMessage, QuestionnaireSubmit
 )
 from app.game_logic import (
-    calculate_earnings, calculate_env_change, check_subsidy_verification,
-    final_settlement, get_env_change_text, PHASE2_SUBSIDY, PHASE3_SUBSIDY,
+    calculate_earnings, check_subsidy_verification,
+    final_settlement, get_env_change_text, PHASE3_SUBSIDY,
     FINAL_ENV_POSITIVE_RATE, FINAL_ENV_NEGATIVE_RATE,
     INITIAL_NT, INITIAL_ENV, MAX_PLAYERS_PER_GAME,
 )
-from app.websocket import manager
-from app.excel_export import export_game_to_excel
+from app.round_engine import resolve_round, round_results_from_outcomes, player_display_names
+from app.db_executor import db_executor, run_in_session, write_behind
+from app.rooms import (
+    Room, rooms, advance_room, STAGE_CHOOSING, STAGE_VOTING, STAGE_READY,
+    persist_round_job, persist_votes_job, persist_advance_job,
+)
+from app.websocket import manager, status_publisher
+from app.room_bus import room_bus
+from app.sharding import owns_game
+from app.export_jobs import ExportJob, export_jobs, JOB_DONE
+from app.stats import accumulate_game, stats_cache
 
 app = FastAPI(title="迷雾南塘游戏API")
 
@@ -39,23 +55,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化数据库
-init_db()
-
-# 依赖注入：获取数据库会话
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("startup")
+async def init_database():
+    """初始化数据库：检查 schema_version 并执行待执行的迁移"""
+    await db_executor.run(init_db)
+
+@app.on_event("startup")
+async def recover_rooms():
+    """连接房间总线；崩溃恢复：从数据库重建所有进行中（且归本进程）的房间"""
+    write_behind.on_room_failure = reload_failed_room
+    await room_bus.start(handle_bus_message)
+    if room_bus.remote:
+        manager.relay = room_bus.publish
+    await rooms.recover(claim=claim_room)
+
+@app.on_event("shutdown")
+async def shutdown_db_executor():
+    await write_behind.flush()
+    await export_jobs.join()
+    await room_bus.close()
+    export_jobs.shutdown()
+    stats_cache.shutdown()
+    db_executor.shutdown()
+    # 关闭连接池中的连接，WAL 模式下最后一个连接关闭时合并并删除 -wal 文件
+    engine.dispose()
+
+async def claim_room(game_id: int) -> bool:
+    """启动恢复时是否由本进程负责该房间（分片部署见 app.sharding，多进程总线见 app.room_bus）"""
+    return owns_game(game_id) and await room_bus.is_owner(game_id)
+
+async def handle_bus_message(message: dict):
+    """处理其他 worker 经房间总线发来的消息"""
+    kind = message.get("kind")
+    if kind == "deliver":
+        manager.deliver(message)
+    elif kind == "command":
+        await handle_websocket_message(message["game_id"], message["player_id"], message["data"])
+    elif kind == "snapshot":
+        room = await rooms.get(message["game_id"])
+        return room.snapshot_payload() if room else None
+    elif kind == "discard":
+        rooms.discard(message["game_id"])
+
+async def discard_room(game_id: int):
+    """各 worker 都移除该房间的内存状态（仅用于等待开始的房间）"""
+    rooms.discard(game_id)
+    await room_bus.publish({"kind": "discard", "game_id": game_id})
+
+async def reload_failed_room(room: Room, error: BaseException):
+    """
+    写后任务重试后仍失败：写后队列已停止该房间之后的写入，数据库停在最后一次成功写入的轮次边界。
+    丢弃内存中的房间、从数据库重建，并通知玩家回到重建后的阶段（未落库的提交 / 投票需要重新操作）
+    """
+    game_id = room.game_id
+    print(f"房间 {game_id} 写入数据库失败，从数据库重建: {error!r}")
+    # 等待正在处理的消息结束，之后排队的消息见 room.write_error 直接丢弃
+    async with room.lock:
+        status_publisher.reset(game_id)
+        rooms.discard(game_id, room)
+        try:
+            new_room = await rooms.get(game_id)
+        except Exception as e:
+            print(f"房间 {game_id} 重建失败: {e!r}")
+            new_room = None
+    if new_room is None:
+        await manager.broadcast_to_all_in_game({
+            "type": "error",
+            "message": "服务器保存游戏数据失败，请稍后刷新页面重新进入房间",
+        }, game_id)
+        return
+    async with new_room.lock:
+        await manager.broadcast_to_all_in_game({
+            **new_room.snapshot_payload(),
+            "type": "room_reloaded",
+            "stage": new_room.stage,
+            "message": "服务器保存数据失败，已恢复到最近一次保存的进度，请重新完成本轮操作",
+        }, game_id)
+        # 按重建后的阶段补发进入该阶段时的消息
+        if new_room.status != "playing":
+            return
+        if new_room.stage == STAGE_VOTING:
+            await process_phase3_subsidy_broadcast(game_id, new_room.current_round, _subsidy_applicants(new_room))
+        elif new_room.stage == STAGE_READY:
+            await broadcast_round_results(
+                game_id, round_results_from_outcomes(list(new_room.records.values())),
+                new_room.phase, new_room.current_round)
+
+async def room_snapshot(game_id: int) -> Optional[dict]:
+    """房间快照：房间归本进程时直接读取，否则向所有者请求"""
+    owner = await room_bus.owner_of(game_id)
+    if owner == room_bus.worker_id:
+        room = await rooms.get(game_id)
+        return room.snapshot_payload() if room else None
+    return await room_bus.request(owner, {"kind": "snapshot", "game_id": game_id})
 
-# 游戏状态管理（内存中）
-game_states: Dict[int, Dict] = {}  # {game_id: {player_id: choice_data}}
-# Phase 2/3：等待所有人点击「下一轮」再进入下一轮
-ready_for_next_round_states: Dict[tuple, set] = {}  # (game_id, round_number) -> set of player_id
-# Phase 3：每轮两条广播（投票结果 + 系统识破）一起在结果页展示
-phase3_round_broadcasts: Dict[tuple, list] = {}  # (game_id, round_number) -> list of {type, message, ...}
 
 @app.get("/")
 async def root():
@@ -74,9 +167,7 @@ def _user_to_response(user: User) -> dict:
     return {"id": user.id, "username": user.username, "questionnaire_answers": q}
 
 
-@app.post("/api/users/register")
-async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
-    """注册/登录：用户名为唯一标识，存在则返回该用户，否则创建新用户"""
+def _register_user(db: Session, user_data: UserCreate) -> dict:
     name = (user_data.username or "").strip()
     if not name:
         raise HTTPException(status_code=400, detail="用户名不能为空")
@@ -90,18 +181,26 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     return _user_to_response(new_user)
 
 
-@app.get("/api/users/{user_id}")
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    """获取用户信息"""
+@app.post("/api/users/register")
+async def register_user(user_data: UserCreate):
+    """注册/登录：用户名为唯一标识，存在则返回该用户，否则创建新用户"""
+    return await run_in_session(_register_user, user_data)
+
+
+def _get_user(db: Session, user_id: int) -> dict:
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     return _user_to_response(user)
 
 
-@app.post("/api/users/{user_id}/questionnaire")
-async def submit_questionnaire(user_id: int, data: QuestionnaireSubmit, db: Session = Depends(get_db)):
-    """提交问卷 Q1–Q12，保存到用户"""
+@app.get("/api/users/{user_id}")
+async def get_user(user_id: int):
+    """获取用户信息"""
+    return await run_in_session(_get_user, user_id)
+
+
+def _submit_questionnaire(db: Session, user_id: int, data: QuestionnaireSubmit) -> dict:
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
@@ -110,15 +209,19 @@ async def submit_questionnaire(user_id: int, data: QuestionnaireSubmit, db: Sess
     db.commit()
     return {"message": "问卷已保存"}
 
+
+@app.post("/api/users/{user_id}/questionnaire")
+async def submit_questionnaire(user_id: int, data: QuestionnaireSubmit):
+    """提交问卷 Q1–Q12，保存到用户"""
+    return await run_in_session(_submit_questionnaire, user_id, data)
+
 # ========== 游戏相关 ==========
 
 def generate_game_code() -> str:
     """生成游戏房间号"""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
-@app.post("/api/games/create")
-async def create_game(user_id: int = None, username: str = None, db: Session = Depends(get_db)):
-    """创建新游戏：优先使用 user_id（关联用户表唯一昵称），否则用 username 作为本局昵称"""
+def _create_game(db: Session, user_id: Optional[int], username: Optional[str]) -> dict:
     game_code = generate_game_code()
     new_game = Game(game_code=game_code, status="waiting", creator_id=None)
     db.add(new_game)
@@ -141,12 +244,11 @@ async def create_game(user_id: int = None, username: str = None, db: Session = D
     db.add(creator_player)
     db.commit()
     db.refresh(creator_player)
-    
+
     new_game.creator_id = creator_player.id
     db.commit()
     db.refresh(new_game)
-    
-    game_states[new_game.id] = {}
+
     return {
         "id": new_game.id,
         "game_code": new_game.game_code,
@@ -157,14 +259,12 @@ async def create_game(user_id: int = None, username: str = None, db: Session = D
         "player_id": creator_player.id,
     }
 
-@app.post("/api/games/{game_id}/join")
-async def join_game(
-    game_id: int,
-    user_id: int = None,
-    username: str = None,
-    db: Session = Depends(get_db)
-):
-    """加入游戏：优先使用 user_id。若游戏已开始/已结束，且该 user 曾在此房间，则允许重新连接（复入）"""
+@app.post("/api/games/create")
+async def create_game(user_id: int = None, username: str = None):
+    """创建新游戏：优先使用 user_id（关联用户表唯一昵称），否则用 username 作为本局昵称"""
+    return await run_in_session(_create_game, user_id, username)
+
+def _join_game(db: Session, game_id: int, user_id: Optional[int], username: Optional[str]) -> dict:
     game = db.query(Game).filter(Game.id == game_id).first()
     if not game:
         raise HTTPException(status_code=404, detail="游戏不存在")
@@ -211,38 +311,48 @@ async def join_game(
     db.add(new_player)
     db.commit()
     db.refresh(new_player)
-    
+
     return {"player_id": new_player.id, "message": "成功加入游戏"}
 
+@app.post("/api/games/{game_id}/join")
+async def join_game(
+    game_id: int,
+    user_id: int = None,
+    username: str = None,
+):
+    """加入游戏：优先使用 user_id。若游戏已开始/已结束，且该 user 曾在此房间，则允许重新连接（复入）"""
+    result = await run_in_session(_join_game, game_id, user_id, username)
+    if not result.get("rejoined"):
+        # 等待中的房间没有未落库状态，新玩家加入后下次访问时重新加载
+        await discard_room(game_id)
+    return result
+
+def _get_game(db: Session, game_id: int = None, game_code: str = None) -> GameResponse:
+    if game_code is not None:
+        game = db.query(Game).filter(Game.game_code == game_code.strip().upper()).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="房间号不存在，请检查后重试")
+    else:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="游戏不存在")
+    return GameResponse.model_validate(game)
+
 @app.get("/api/games/{game_id}", response_model=GameResponse)
-async def get_game(game_id: int, db: Session = Depends(get_db)):
+async def get_game(game_id: int):
     """获取游戏信息"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="游戏不存在")
-    return game
+    await write_behind.flush_room(game_id)
+    return await run_in_session(_get_game, game_id=game_id)
 
 @app.get("/api/games/by-code/{game_code}", response_model=GameResponse)
-async def get_game_by_code(game_code: str, db: Session = Depends(get_db)):
+async def get_game_by_code(game_code: str):
     """根据 6 位房间号获取游戏（用于加入房间）"""
-    game = db.query(Game).filter(Game.game_code == game_code.strip().upper()).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="房间号不存在，请检查后重试")
-    return game
-
-def _player_display_name(player, db):
-    if getattr(player, "username", None) and str(player.username).strip():
-        return (player.username or "").strip()
-    if player.user_id:
-        user = db.query(User).filter(User.id == player.user_id).first()
-        return user.username if user else f"玩家{player.id}"
-    return f"玩家{player.id}"
+    return await run_in_session(_get_game, game_code=game_code)
 
-@app.get("/api/games/{game_id}/players")
-async def get_game_players(game_id: int, db: Session = Depends(get_db)):
-    """获取游戏玩家列表；同一 user_id 只返回一条（去重），游戏结束时含结算前NT、生态值、生态结算、最终NT"""
+def _get_game_players(db: Session, game_id: int) -> List[dict]:
     game = db.query(Game).filter(Game.id == game_id).first()
     players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
+    names = player_display_names(db, players)
     result = []
     seen_user_ids = set()
     for player in players:
@@ -254,7 +364,7 @@ async def get_game_players(game_id: int, db: Session = Depends(get_db)):
         item = {
             "id": player.id,
             "user_id": uid,
-            "username": _player_display_name(player, db),
+            "username": names[player.id],
             "current_nt": player.current_nt,
             "current_env": player.current_env,
         }
@@ -268,28 +378,38 @@ async def get_game_players(game_id: int, db: Session = Depends(get_db)):
         result.append(item)
     return result
 
-@app.post("/api/games/{game_id}/start")
-async def start_game(game_id: int, player_id: int, db: Session = Depends(get_db)):
-    """开始游戏（仅房间创建者可调用，传当前玩家的 player_id）"""
+@app.get("/api/games/{game_id}/players")
+async def get_game_players(game_id: int):
+    """获取游戏玩家列表；同一 user_id 只返回一条（去重），游戏结束时含结算前NT、生态值、生态结算、最终NT"""
+    await write_behind.flush_room(game_id)
+    return await run_in_session(_get_game_players, game_id)
+
+def _start_game(db: Session, game_id: int, player_id: int) -> None:
     game = db.query(Game).filter(Game.id == game_id).first()
     if not game:
         raise HTTPException(status_code=404, detail="游戏不存在")
-    
+
     if game.creator_id is not None and game.creator_id != player_id:
         raise HTTPException(status_code=403, detail="只有房间创建者可以开始游戏")
-    
+
     if game.status != "waiting":
         raise HTTPException(status_code=400, detail="游戏已开始")
-    
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    if len(players) < 2:
+
+    players_count = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).count()
+    if players_count < 2:
         raise HTTPException(status_code=400, detail="玩家数量不足")
-    
+
     game.status = "playing"
     game.current_round = 1
     game.phase = 1
     db.commit()
-    
+
+@app.post("/api/games/{game_id}/start")
+async def start_game(game_id: int, player_id: int):
+    """开始游戏（仅房间创建者可调用，传当前玩家的 player_id）"""
+    await run_in_session(_start_game, game_id, player_id)
+    await discard_room(game_id)
+
     # 广播游戏开始
     await manager.broadcast_to_all_in_game({
         "type": "game_started",
@@ -298,294 +418,211 @@ async def start_game(game_id: int, player_id: int, db: Session = Depends(get_db)
         "current_round": 1,
         "phase": 1
     }, game_id)
-    
+
     return {"message": "游戏已开始", "current_round": 1, "phase": 1}
 
+@app.get("/api/games/{game_id}/snapshot")
+async def get_game_snapshot(game_id: int):
+    """房间完整快照（带序号 seq），客户端错过增量时用来重新同步"""
+    snapshot = await room_snapshot(game_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="游戏不存在")
+    return snapshot
+
 # ========== WebSocket连接 ==========
 
 @app.websocket("/ws/game/{game_id}/player/{player_id}")
 async def websocket_endpoint(websocket: WebSocket, game_id: int, player_id: int):
     """WebSocket连接端点"""
     await manager.connect(websocket, game_id, player_id)
+    # 连接时先发送完整快照，之后只发送增量
+    snapshot = await room_snapshot(game_id)
+    if snapshot is not None:
+        await manager.send_personal_message(snapshot, game_id, player_id)
     try:
         while True:
             data = await websocket.receive_json()
-            # 处理WebSocket消息
-            await handle_websocket_message(game_id, player_id, data)
+            # 处理WebSocket消息（房间不归本进程时转发给所有者）
+            await dispatch_websocket_message(game_id, player_id, data)
     except WebSocketDisconnect:
-        manager.disconnect(game_id, player_id)
+        manager.disconnect(game_id, player_id, websocket)
+
+async def dispatch_websocket_message(game_id: int, player_id: int, data: dict):
+    """在房间所有者进程中处理消息"""
+    owner = await room_bus.owner_of(game_id)
+    if owner == room_bus.worker_id:
+        await handle_websocket_message(game_id, player_id, data)
+    else:
+        await room_bus.send(owner, {"kind": "command", "game_id": game_id, "player_id": player_id, "data": data})
 
 async def handle_websocket_message(game_id: int, player_id: int, data: dict):
-    """处理WebSocket消息"""
+    """处理WebSocket消息：同一房间的消息持房间锁逐条处理，不同房间互不等待"""
     message_type = data.get("type")
-    
-    if message_type == "submit_choice":
-        await handle_submit_choice(game_id, player_id, data)
-    elif message_type == "submit_vote":
-        await handle_submit_vote(game_id, player_id, data)
-    elif message_type == "ready_for_next_round":
-        await handle_ready_for_next_round(game_id, player_id, data)
-
-async def handle_ready_for_next_round(game_id: int, player_id: int, data: dict):
-    """Phase 2：所有人点击「下一轮」后才进入下一轮"""
-    db = SessionLocal()
-    try:
-        game = db.query(Game).filter(Game.id == game_id).first()
-        if not game or game.status != "playing":
-            return
-        round_number = game.current_round
-        key = (game_id, round_number)
-        if key not in ready_for_next_round_states:
+    handler = WEBSOCKET_HANDLERS.get(message_type)
+    if handler is None:
+        return
+    room = await rooms.get(game_id)
+    if room is None:
+        return
+    async with room.lock:
+        if room.write_error is not None:
+            # 房间写入失败、正在从数据库重建：丢弃作废房间上的消息，玩家收到 room_reloaded 后重新操作
             return
-        ready_for_next_round_states[key].add(player_id)
-        players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-        if len(ready_for_next_round_states[key]) >= len(players):
-            ready_for_next_round_states.pop(key, None)
-            await check_next_round_or_phase(game_id, db)
-    finally:
-        db.close()
-
-async def handle_submit_choice(game_id: int, player_id: int, data: dict):
+        await handler(room, player_id, data)
+
+# 房间状态全部在内存中（app.rooms），以下处理只改内存并广播，数据库由写后队列在轮次边界落库。
+# 处理函数都在房间锁内执行（含结算与切换轮次），每次状态转换只会被处理一次。
+
+async def handle_ready_for_next_round(room: Room, player_id: int, data: dict):
+    """Phase 2/3：所有人点击「下一轮」后才进入下一轮"""
+    if room.status != "playing" or room.stage != STAGE_READY:
+        return
+    if player_id not in room.players:
+        return
+    room.ready.add(player_id)
+    if len(room.ready) >= room.num_players:
+        await check_next_round_or_phase(room)
+
+async def handle_submit_choice(room: Room, player_id: int, data: dict):
     """处理玩家提交选择"""
-    db = SessionLocal()
-    try:
-        game = db.query(Game).filter(Game.id == game_id).first()
-        if not game or game.status != "playing":
-            return
-        
-        choice = data.get("choice")  # "organic" or "inorganic"
-        apply_subsidy = data.get("apply_subsidy", False)
-        
-        # 保存选择
-        if game_id not in game_states:
-            game_states[game_id] = {}
-        game_states[game_id][player_id] = {
-            "choice": choice,
-            "apply_subsidy": apply_subsidy,
-            "submitted": True
-        }
-        
-        # 广播「谁已选择」给房间内所有人，方便大家看到进度
-        await manager.broadcast_to_all_in_game({
-            "type": "submission_status",
-            "submitted_player_ids": list(game_states[game_id].keys())
-        }, game_id)
-        
-        # 检查是否所有玩家都已提交
-        players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-        all_submitted = len(game_states[game_id]) == len(players)
-        
-        if all_submitted:
-            # 处理本轮结果
-            await process_round(game_id, db)
-    finally:
-        db.close()
-
-async def handle_submit_vote(game_id: int, player_id: int, data: dict):
+    game_id = room.game_id
+    if room.status != "playing" or room.stage != STAGE_CHOOSING:
+        return
+    if player_id not in room.players:
+        return
+
+    choice = data.get("choice")  # "organic" or "inorganic"
+    apply_subsidy = data.get("apply_subsidy", False)
+
+    # 保存选择
+    room.submissions[player_id] = {
+        "choice": choice,
+        "apply_subsidy": apply_subsidy,
+        "submitted": True
+    }
+    # 检查是否所有玩家都已提交
+    all_submitted = len(room.submissions) == room.num_players
+
+    # 广播「谁已选择」给房间内所有人，方便大家看到进度；提交集中时按窗口合并，全员提交时立即发送
+    if all_submitted:
+        await status_publisher.publish_now(game_id, _submission_status(room))
+    else:
+        status_publisher.publish(game_id, "submission_status", lambda: _submission_status(room))
+
+    if all_submitted:
+        # 处理本轮结果
+        await process_round(room)
+
+async def handle_submit_vote(room: Room, player_id: int, data: dict):
     """处理投票"""
-    db = SessionLocal()
-    try:
-        game = db.query(Game).filter(Game.id == game_id).first()
-        if not game or game.status != "playing" or game.phase != 3:
-            return
-        
-        target_id = data.get("target_id")  # 0 或缺失表示「谁都不选」，记入 Excel 为 0
-        round_number = game.current_round
-        
-        # 检查是否已投票
-        existing_vote = db.query(GameVote).filter(
-            GameVote.game_id == game_id,
-            GameVote.round_number == round_number,
-            GameVote.voter_id == player_id
-        ).first()
-        
-        if existing_vote:
-            return
-        
-        # 创建投票（target_id 为 None 表示谁都不选，导出 Excel 时写 0）
-        vote = GameVote(
-            game_id=game_id,
-            round_number=round_number,
-            voter_id=player_id,
-            target_id=int(target_id) if target_id else None
-        )
-        db.add(vote)
-        db.commit()
-        
-        # 广播「谁已投票」给房间内所有人
-        votes = db.query(GameVote).filter(
-            GameVote.game_id == game_id,
-            GameVote.round_number == round_number
-        ).all()
-        await manager.broadcast_to_all_in_game({
-            "type": "vote_submission_status",
-            "submitted_player_ids": [v.voter_id for v in votes]
-        }, game_id)
-        
-        # 检查是否所有玩家都已投票
-        players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-        if len(votes) == len(players):
-            # 处理投票结果
-            await process_voting_phase(game_id, db)
-    finally:
-        db.close()
-
-async def process_round(game_id: int, db: Session):
+    game_id = room.game_id
+    if room.status != "playing" or room.phase != 3 or room.stage != STAGE_VOTING:
+        return
+    # 检查是否已投票
+    if player_id not in room.players or player_id in room.votes:
+        return
+
+    # 记录投票（None 表示谁都不选，导出 Excel 时写 0）
+    target_id = data.get("target_id")  # 0 或缺失表示「谁都不选」，记入 Excel 为 0
+    room.votes[player_id] = int(target_id) if target_id else None
+    all_voted = len(room.votes) == room.num_players
+
+    # 广播「谁已投票」给房间内所有人；同样按窗口合并，全员投票时立即发送
+    if all_voted:
+        await status_publisher.publish_now(game_id, _vote_submission_status(room))
+    else:
+        status_publisher.publish(game_id, "vote_submission_status", lambda: _vote_submission_status(room))
+
+    # 检查是否所有玩家都已投票
+    if all_voted:
+        # 处理投票结果
+        await process_voting_phase(room)
+
+WEBSOCKET_HANDLERS = {
+    "submit_choice": handle_submit_choice,
+    "submit_vote": handle_submit_vote,
+    "ready_for_next_round": handle_ready_for_next_round,
+}
+
+def _submission_status(room: Room) -> dict:
+    return {"type": "submission_status", "submitted_player_ids": list(room.submissions.keys())}
+
+def _vote_submission_status(room: Room) -> dict:
+    return {"type": "vote_submission_status", "submitted_player_ids": list(room.votes.keys())}
+
+async def process_round(room: Room):
     """处理一轮游戏"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    round_number = game.current_round
-    phase = game.phase
-    
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    choices = game_states[game_id]
-    
-    # 收集所有选择
-    all_choices = {}
-    for player in players:
-        if player.id in choices:
-            all_choices[player.id] = choices[player.id]["choice"]
-    
-    # 处理每个玩家的收益
-    round_results = {}
-    
-    for player in players:
-        if player.id not in choices:
-            continue
-        
-        choice_data = choices[player.id]
-        choice = choice_data["choice"]
-        apply_subsidy = choice_data.get("apply_subsidy", False)
-        
-        # 计算收益和生态值变化（收益含当前 ENV 影响：每 10 ENV = 0.5 NT）
-        env_change = calculate_env_change(choice, player.id, all_choices)
-        earnings = calculate_earnings(choice, player.current_env)
-        
-        # 补贴处理（Phase 2和3）
-        subsidy_amount = 0
-        subsidy_verified = None
-        if apply_subsidy and phase >= 2:
-            subsidy_amount = PHASE2_SUBSIDY if phase == 2 else PHASE3_SUBSIDY
-            
-            # 先扣除质押
-            earnings -= subsidy_amount
-            
-            # Phase 3的补贴验证在投票后处理
-            if phase == 3:
-                # 暂时不处理补贴，等投票完成后再处理
-                pass
-            else:
-                # Phase 2: 立即验证
-                subsidy_verified = check_subsidy_verification(choice, phase)
-                if subsidy_verified:
-                    # 验证通过，返还质押并获得补贴
-                    earnings += subsidy_amount * 2
-                else:
-                    # 被识破，质押被罚没（已经扣除了，不需要再扣）
-                    pass
-        
-        # 更新玩家数据
-        nt_before = player.current_nt
-        env_before = player.current_env
-        
-        player.current_nt += earnings
-        player.current_env += env_change
-        
-        nt_after = player.current_nt
-        env_after = player.current_env
-        
-        # 保存轮次数据
-        round_record = GameRound(
-            game_id=game_id,
-            round_number=round_number,
-            phase=phase,
-            player_id=player.id,
-            choice=choice,
-            applied_subsidy=apply_subsidy,
-            subsidy_verified=subsidy_verified,
-            nt_before=nt_before,
-            nt_after=nt_after,
-            env_before=env_before,
-            env_after=env_after,
-            round_nt_earned=earnings
-        )
-        db.add(round_record)
-        
-        round_results[player.id] = {
-            "nt_before": nt_before,
-            "nt_after": nt_after,
-            "env_before": env_before,
-            "env_after": env_after,
-            "round_nt_earned": earnings,
-            "env_change": get_env_change_text(env_change),
-            "subsidy_result": None
-        }
-    
-    db.commit()
-    
-    # Phase 3: 先保存基础数据，然后进入投票阶段
+    game_id, round_number, phase = room.game_id, room.current_round, room.phase
+
+    # 一次批量结算全房间（收益含当前 ENV 影响：每 10 ENV = 0.5 NT），结果先写入内存，再交给写后队列落库
+    outcomes = resolve_round(room.player_list, room.submissions, phase)
+    for outcome in outcomes:
+        player = room.players[outcome["player_id"]]
+        player.current_nt = outcome["nt_after"]
+        player.current_env = outcome["env_after"]
+    room.records = {o["player_id"]: o for o in outcomes}
+    write_behind.submit_room(room, persist_round_job, game_id, round_number, phase, [dict(o) for o in outcomes])
+    round_results = round_results_from_outcomes(outcomes)
+
+    # Phase 3: 基础收益（不含补贴）已结算，进入投票阶段
     if phase == 3:
-        # 先保存基础收益（不含补贴）
-        db.commit()
+        room.stage = STAGE_VOTING
         # 广播补贴申请，然后进入投票阶段
-        await process_phase3_subsidy_broadcast(game_id, round_number, choices, db)
+        await process_phase3_subsidy_broadcast(game_id, round_number, _subsidy_applicants(room))
         # 投票阶段由handle_submit_vote触发，投票完成后会调用process_phase3_final_calculation
         return
-    
+
     # Phase 2: 处理补贴申请和广播，然后等待所有人点击「下一轮」
     if phase == 2:
-        await process_phase2_broadcast(game_id, round_number, choices, round_results, db)
-        ready_for_next_round_states[(game_id, round_number)] = set()
+        room.stage = STAGE_READY
+        await process_phase2_broadcast(
+            game_id, round_number, _subsidy_applicants(room), _phase2_caught_players(room, round_results),
+            round_results)
         return
-    
+
     # Phase 1: 直接显示结果
     if phase == 1:
         await broadcast_round_results(game_id, round_results, phase, round_number)
-    
-    # 检查是否进入下一轮或下一阶段
-    await check_next_round_or_phase(game_id, db)
 
-async def process_phase2_broadcast(game_id: int, round_number: int, choices: dict, round_results: dict, db: Session):
-    """处理Phase 2的广播：一条消息包含申请补贴与识破名单，所有人看到一致"""
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    
-    subsidy_applicants = []
-    for player in players:
-        if player.id in choices and choices[player.id].get("apply_subsidy"):
-            subsidy_applicants.append({"player_id": player.id, "username": _player_display_name(player, db)})
-    
+    # 检查是否进入下一轮或下一阶段
+    await check_next_round_or_phase(room)
+
+def _subsidy_applicants(room: Room) -> List[dict]:
+    """本轮申请补贴的玩家（按房间玩家顺序）"""
+    return [
+        {"player_id": player.id, "username": player.username}
+        for player in room.player_list
+        if player.id in room.submissions and room.submissions[player.id].get("apply_subsidy")
+    ]
+
+def _phase2_caught_players(room: Room, round_results: dict) -> List[dict]:
+    """Phase 2 使用无机肥申请补贴且被识破的玩家，同时在 round_results 中标记「识破」"""
     caught_players = []
-    for player in players:
-        if player.id in choices:
-            choice_data = choices[player.id]
+    for player in room.player_list:
+        if player.id in room.submissions:
+            choice_data = room.submissions[player.id]
             if choice_data.get("apply_subsidy") and choice_data.get("choice") == "inorganic":
-                round_record = db.query(GameRound).filter(
-                    GameRound.game_id == game_id,
-                    GameRound.round_number == round_number,
-                    GameRound.player_id == player.id
-                ).first()
-                if round_record and round_record.subsidy_verified == False:
-                    caught_players.append({"player_id": player.id, "username": _player_display_name(player, db)})
+                record = room.records.get(player.id)
+                if record and record["subsidy_verified"] == False:
+                    caught_players.append({"player_id": player.id, "username": player.username})
                     round_results[player.id]["subsidy_result"] = "识破"
-    
+    return caught_players
+
+async def process_phase2_broadcast(game_id: int, round_number: int, subsidy_applicants: List[dict],
+                                   caught_players: List[dict], round_results: dict):
+    """处理Phase 2的广播：一条消息包含申请补贴与识破名单，所有人看到一致"""
     # 一条广播包含两段内容，保证所有人看到相同
     await manager.broadcast_to_all_in_game({
         "type": "phase2_broadcasts",
         "applicants": subsidy_applicants,
         "caught_players": caught_players,
     }, game_id)
-    
+
     await broadcast_round_results(game_id, round_results, 2, round_number)
 
-async def process_phase3_subsidy_broadcast(game_id: int, round_number: int, choices: dict, db: Session):
+async def process_phase3_subsidy_broadcast(game_id: int, round_number: int, subsidy_applicants: List[dict]):
     """处理Phase 3的补贴申请广播（投票前）"""
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    
     # 广播：谁申请了补贴
-    subsidy_applicants = []
-    for player in players:
-        if player.id in choices and choices[player.id].get("apply_subsidy"):
-            subsidy_applicants.append({"player_id": player.id, "username": _player_display_name(player, db)})
-    
     if subsidy_applicants:
         await manager.broadcast_to_all_in_game({
             "type": "subsidy_applied",
@@ -593,7 +630,7 @@ async def process_phase3_subsidy_broadcast(game_id: int, round_number: int, choi
             "applicants": subsidy_applicants,
             "next_step": "voting"
         }, game_id)
-    
+
     # 通知进入投票阶段
     await manager.broadcast_to_all_in_game({
         "type": "voting_start",
@@ -602,120 +639,119 @@ async def process_phase3_subsidy_broadcast(game_id: int, round_number: int, choi
         "vote_submitted_player_ids": []
     }, game_id)
 
-async def process_voting_phase(game_id: int, db: Session):
-    """处理投票阶段"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    round_number = game.current_round
-    
-    # 统计投票
-    votes = db.query(GameVote).filter(
-        GameVote.game_id == game_id,
-        GameVote.round_number == round_number
-    ).all()
-    
+def _settle_votes(room: Room) -> Optional[dict]:
+    """
+    Phase 3 投票核查（只改内存）：得票最高者若用无机肥申请补贴则识破，投票者平分罚没的质押
+
+    Returns:
+        vote_result 广播消息，无人得票时为 None
+    """
     vote_counts = {}
-    for vote in votes:
-        if vote.target_id is None:  # 谁都不选不记入得票
+    for target_id in room.votes.values():
+        if target_id is None:  # 谁都不选不记入得票
             continue
-        vote_counts[vote.target_id] = vote_counts.get(vote.target_id, 0) + 1
-    
+        vote_counts[target_id] = vote_counts.get(target_id, 0) + 1
+
     # 找出得票最高者
-    if vote_counts:
-        max_votes = max(vote_counts.values())
-        most_voted = [pid for pid, count in vote_counts.items() if count == max_votes]
-        
-        if most_voted:
-            target_id = most_voted[0] if len(most_voted) == 1 else random.choice(most_voted)
-            
-            # 核查被投票者
-            target_round = db.query(GameRound).filter(
-                GameRound.game_id == game_id,
-                GameRound.round_number == round_number,
-                GameRound.player_id == target_id
-            ).first()
-            
-            target_player = db.query(GamePlayer).filter(GamePlayer.id == target_id).first()
-            username = _player_display_name(target_player, db)
-            
-            if target_round and target_round.choice == "inorganic" and target_round.applied_subsidy:
-                # 被识破
-                target_round.subsidy_verified = False
-                base_earnings = calculate_earnings("inorganic", target_round.env_before)
-                # 当前round_nt_earned = 基础收益 - 质押
-                # 需要调整为：-质押（失去基础收益和质押）
-                target_player.current_nt -= base_earnings  # 扣除基础收益
-                target_round.round_nt_earned = -PHASE3_SUBSIDY  # 只扣除质押，无收益
-                db.commit()
-                
-                # 投票者平分罚没的 2 NT 质押
-                voters = [v.voter_id for v in votes if v.target_id == target_id]
-                if voters:
-                    reward_per_voter = PHASE3_SUBSIDY / len(voters)  # 共 2 NT 平分
-                    for voter_id in voters:
-                        voter_player = db.query(GamePlayer).filter(GamePlayer.id == voter_id).first()
-                        if voter_player:
-                            voter_player.current_nt += reward_per_voter
-                    db.commit()
-                
-                vote_msg = {"type": "vote_result", "message": f"{username} 被投票质疑，核查后发现使用无机肥申请补贴，被识破！", "target_id": target_id, "caught": True}
-                await manager.broadcast_to_all_in_game(vote_msg, game_id)
-                phase3_round_broadcasts.setdefault((game_id, round_number), []).append(vote_msg)
-            else:
-                # 通过验证
-                target_round.subsidy_verified = True
-                db.commit()
-                
-                vote_msg = {"type": "vote_result", "message": f"{username} 被投票质疑，核查后确认使用有机肥，通过验证。", "target_id": target_id, "caught": False}
-                await manager.broadcast_to_all_in_game(vote_msg, game_id)
-                phase3_round_broadcasts.setdefault((game_id, round_number), []).append(vote_msg)
-    
+    if not vote_counts:
+        return None
+    max_votes = max(vote_counts.values())
+    most_voted = [pid for pid, count in vote_counts.items() if count == max_votes]
+    target_id = most_voted[0] if len(most_voted) == 1 else random.choice(most_voted)
+
+    # 核查被投票者
+    target_record = room.records.get(target_id)
+    target_player = room.players.get(target_id)
+    username = room.name_of(target_id)
+
+    if target_record and target_record["choice"] == "inorganic" and target_record["applied_subsidy"]:
+        # 被识破
+        target_record["subsidy_verified"] = False
+        target_record["caught_by"] = "vote"
+        base_earnings = calculate_earnings("inorganic", target_record["env_before"])
+        # 当前round_nt_earned = 基础收益 - 质押
+        # 需要调整为：-质押（失去基础收益和质押）
+        target_player.current_nt -= base_earnings  # 扣除基础收益
+        target_record["round_nt_earned"] = -PHASE3_SUBSIDY  # 只扣除质押，无收益
+
+        # 投票者平分罚没的 2 NT 质押
+        voters = [voter_id for voter_id, t in room.votes.items() if t == target_id]
+        if voters:
+            reward_per_voter = PHASE3_SUBSIDY / len(voters)  # 共 2 NT 平分
+            for voter_id in voters:
+                voter_player = room.players.get(voter_id)
+                if voter_player:
+                    voter_player.current_nt += reward_per_voter
+
+        return {"type": "vote_result", "message": f"{username} 被投票质疑，核查后发现使用无机肥申请补贴，被识破！", "target_id": target_id, "caught": True}
+
+    # 通过验证
+    if target_record:
+        target_record["subsidy_verified"] = True
+    return {"type": "vote_result", "message": f"{username} 被投票质疑，核查后确认使用有机肥，通过验证。", "target_id": target_id, "caught": False}
+
+async def process_voting_phase(room: Room):
+    """处理投票阶段"""
+    game_id, round_number = room.game_id, room.current_round
+    vote_msg = _settle_votes(room)
     # 处理50%概率识破和最终收益计算
-    await process_phase3_final_calculation(game_id, round_number, db)
+    caught_players = _phase3_final_calculation(room)
+    room.stage = STAGE_READY
+    write_behind.submit_room(
+        room, persist_votes_job, game_id, round_number, dict(room.votes),
+        {pid: dict(record) for pid, record in room.records.items()},
+        {pid: player.current_nt for pid, player in room.players.items()},
+    )
 
-async def process_phase3_final_calculation(game_id: int, round_number: int, db: Session):
-    """处理Phase 3的最终计算（50%概率识破和补贴收益）"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    choices = game_states[game_id]
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    
+    if vote_msg is not None:
+        await manager.broadcast_to_all_in_game(vote_msg, game_id)
+        room.broadcasts.append(vote_msg)
+
+    await process_phase3_final_calculation(room, round_number, caught_players)
+
+def _phase3_final_calculation(room: Room) -> List[dict]:
+    """
+    Phase 3 的系统识破（50%概率）与补贴收益结算（只改内存）
+
+    Returns:
+        被系统识破的玩家列表
+    """
     caught_players = []
-    for player in players:
-        if player.id in choices:
-            choice_data = choices[player.id]
-            round_record = db.query(GameRound).filter(
-                GameRound.game_id == game_id,
-                GameRound.round_number == round_number,
-                GameRound.player_id == player.id
-            ).first()
-            
-            if not round_record:
+    for player in room.player_list:
+        if player.id in room.submissions:
+            record = room.records.get(player.id)
+
+            if not record:
                 continue
-            
+
             # 如果申请了补贴
-            if round_record.applied_subsidy:
+            if record["applied_subsidy"]:
                 # 如果还没被投票识破，检查50%概率
-                if round_record.subsidy_verified is None:
-                    is_caught = check_subsidy_verification(round_record.choice, 3, False)
-                    round_record.subsidy_verified = is_caught
-                    
+                if record["subsidy_verified"] is None:
+                    is_caught = check_subsidy_verification(record["choice"], 3, False)
+                    record["subsidy_verified"] = is_caught
+
                     if not is_caught:
                         # 被识破，质押已被扣除，还需要扣除本轮基础收益
-                        base_earnings = calculate_earnings(round_record.choice, round_record.env_before)
+                        record["caught_by"] = "system"
+                        base_earnings = calculate_earnings(record["choice"], record["env_before"])
                         player.current_nt -= base_earnings  # 扣除基础收益
-                        round_record.round_nt_earned = -PHASE3_SUBSIDY  # 只扣除质押，无收益
-                        caught_players.append({"player_id": player.id, "username": _player_display_name(player, db)})
+                        record["round_nt_earned"] = -PHASE3_SUBSIDY  # 只扣除质押，无收益
+                        caught_players.append({"player_id": player.id, "username": player.username})
                     else:
                         # 通过验证，返还质押并获得补贴
                         player.current_nt += PHASE3_SUBSIDY * 2
-                        round_record.round_nt_earned += PHASE3_SUBSIDY * 2
-                elif round_record.subsidy_verified == True:
+                        record["round_nt_earned"] += PHASE3_SUBSIDY * 2
+                elif record["subsidy_verified"] == True:
                     # 通过验证，返还质押并获得补贴
                     player.current_nt += PHASE3_SUBSIDY * 2
-                    round_record.round_nt_earned += PHASE3_SUBSIDY * 2
+                    record["round_nt_earned"] += PHASE3_SUBSIDY * 2
                 # 如果subsidy_verified == False，说明被投票识破，已经处理过了
-    
-    db.commit()
-    
+
+    return caught_players
+
+async def process_phase3_final_calculation(room: Room, round_number: int, caught_players: List[dict]):
+    """广播Phase 3的最终计算结果（50%概率识破与补贴收益已由 _phase3_final_calculation 结算）"""
     # 始终加入「系统识破」广播，无人识破时显示「没有」
     sys_caught_msg = {
         "type": "subsidy_caught",
@@ -723,64 +759,54 @@ async def process_phase3_final_calculation(game_id: int, round_number: int, db:
         "caught_players": caught_players,
     }
     if caught_players:
-        await manager.broadcast_to_all_in_game(sys_caught_msg, game_id)
-    phase3_round_broadcasts.setdefault((game_id, round_number), []).append(sys_caught_msg)
-    
+        await manager.broadcast_to_all_in_game(sys_caught_msg, room.game_id)
+    room.broadcasts.append(sys_caught_msg)
+
     # 广播最终结果（携带本轮两条广播，供结果页同时展示）
-    await broadcast_phase3_final_results(game_id, round_number, db)
-    
-    # Phase 3 也等待所有人点击「下一轮」再进入下一轮，保证同步
-    ready_for_next_round_states[(game_id, round_number)] = set()
-    # 不在此处调用 check_next_round_or_phase，由 handle_ready_for_next_round 在全员确认后调用
+    await broadcast_phase3_final_results(room, round_number)
+    # Phase 3 也等待所有人点击「下一轮」再进入下一轮，由 handle_ready_for_next_round 在全员确认后调用
 
-async def broadcast_phase3_final_results(game_id: int, round_number: int, db: Session):
+async def broadcast_phase3_final_results(room: Room, round_number: int):
     """广播Phase 3最终结果（含本轮投票结果 + 系统识破两条广播，供结果页同时展示）"""
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
     round_results = {}
-    phase3_broadcasts = phase3_round_broadcasts.pop((game_id, round_number), [])
-    
-    for player in players:
-        round_record = db.query(GameRound).filter(
-            GameRound.game_id == game_id,
-            GameRound.round_number == round_number,
-            GameRound.player_id == player.id
-        ).first()
-        
-        if round_record:
+    phase3_broadcasts = list(room.broadcasts)
+
+    for player in room.player_list:
+        record = room.records.get(player.id)
+
+        if record:
             round_results[player.id] = {
-                "nt_before": round_record.nt_before,
+                "nt_before": record["nt_before"],
                 "nt_after": player.current_nt,  # 可能被扣除
-                "env_before": round_record.env_before,
+                "env_before": record["env_before"],
                 "env_after": player.current_env,
-                "round_nt_earned": round_record.round_nt_earned,
-                "env_change": get_env_change_text(player.current_env - round_record.env_before),
-                "subsidy_result": "通过" if round_record.subsidy_verified else ("识破" if round_record.subsidy_verified == False else None),
+                "round_nt_earned": record["round_nt_earned"],
+                "env_change": get_env_change_text(player.current_env - record["env_before"]),
+                "subsidy_result": "通过" if record["subsidy_verified"] else ("识破" if record["subsidy_verified"] == False else None),
                 "phase3_broadcasts": phase3_broadcasts,
             }
-    
-    await broadcast_round_results(game_id, round_results, 3, round_number)
+
+    await broadcast_round_results(room.game_id, round_results, 3, round_number)
 
 async def broadcast_round_results(game_id: int, round_results: dict, phase: int, round_number: int = None):
     """广播轮次结果给所有玩家"""
-    db = SessionLocal()
-    try:
-        if round_number is None:
-            game = db.query(Game).filter(Game.id == game_id).first()
-            round_number = game.current_round if game else 0
-    finally:
-        db.close()
-    
+    if round_number is None:
+        room = await rooms.get(game_id)
+        round_number = room.current_round if room else 0
+
+    # 每人一条个人结果，并发发送
+    messages = {}
     for player_id, result in round_results.items():
         # Phase 1: 只显示NT和生态值变化
         if phase == 1:
-            await manager.send_personal_message({
+            messages[player_id] = {
                 "type": "round_result",
                 "round_number": round_number,
                 "phase": phase,
                 "nt_after": result["nt_after"],
                 "env_change": result["env_change"],
                 "round_nt_earned": result["round_nt_earned"]
-            }, game_id, player_id)
+            }
         else:
             # Phase 2和3: 显示完整信息；Phase 3 额外带 phase3_broadcasts 供结果页展示两条广播
             payload = {
@@ -796,95 +822,156 @@ async def broadcast_round_results(game_id: int, round_results: dict, phase: int,
             }
             if phase == 3 and result.get("phase3_broadcasts"):
                 payload["phase3_broadcasts"] = result["phase3_broadcasts"]
-            await manager.send_personal_message(payload, game_id, player_id)
+            messages[player_id] = payload
+    await manager.send_to_players(messages, game_id)
 
-async def check_next_round_or_phase(game_id: int, db: Session):
+async def check_next_round_or_phase(room: Room):
     """检查是否进入下一轮或下一阶段"""
-    game = db.query(Game).filter(Game.id == game_id).first()
-    
-    # 清空当前轮次的选择
-    if game_id in game_states:
-        game_states[game_id] = {}
-    
-    # 判断下一阶段
-    if game.current_round == 5:
-        game.phase = 2
-    elif game.current_round == 10:
-        game.phase = 3
-    elif game.current_round == 15:
-        # 游戏结束
-        await finish_game(game_id, db)
+    # 内存中切换轮次并清空当前轮次的选择；第 15 轮后结算整局
+    if advance_room(room):
+        await finish_game(room)
         return
-    
-    # 进入下一轮
-    game.current_round += 1
-    db.commit()
-    
-    # 附带最新玩家数据供前端同步
-    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    players_data = []
-    for p in players:
-        players_data.append({
-            "id": p.id,
-            "user_id": getattr(p, "user_id", None),
-            "username": _player_display_name(p, db),
-            "current_nt": p.current_nt,
-            "current_env": p.current_env
-        })
-    
+    write_behind.submit_room(room, persist_advance_job, room.game_id, room.current_round, room.phase)
+
+    # 只附带 NT / ENV 有变化的字段（相对上一版本 seq），前端发现序号不连续时重新获取快照
+    changes = room.take_delta()
     await manager.broadcast_to_all_in_game({
         "type": "next_round",
-        "message": f"进入第 {game.current_round} 轮",
-        "current_round": game.current_round,
-        "phase": game.phase,
-        "players": players_data,
+        "message": f"进入第 {room.current_round} 轮",
+        "current_round": room.current_round,
+        "phase": room.phase,
+        "seq": room.seq,
+        "player_changes": changes,
         "submitted_player_ids": []
-    }, game_id)
+    }, room.game_id)
 
-async def finish_game(game_id: int, db: Session):
-    """结束游戏并结算"""
+def _finish_game(db: Session, game_id: int):
+    """最终结算（写后任务，此前各轮已按顺序落库），并在同一事务中把本局加入汇总统计"""
     game = db.query(Game).filter(Game.id == game_id).first()
+    already_finished = game.status == "finished"
     game.status = "finished"
     game.finished_at = datetime.utcnow()
-    
+
     players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).all()
-    
+
     # 最终结算
     max_env = max([p.current_env for p in players])
     for player in players:
         # 生态值转换为NT
         player.final_nt = final_settlement(player.current_nt, player.current_env)
         player.final_env = player.current_env
-        
+
         # 标记获胜者
         if player.current_env == max_env:
             player.is_winner = True
-    
+
+    if not already_finished:
+        db.flush()
+        accumulate_game(db, game_id)
     db.commit()
-    
-    # 导出Excel
+
+async def finish_game(room: Room):
+    """结束游戏并结算；Excel 由导出任务在后台生成，完成后另行广播 excel_ready"""
+    room.status = "finished"
     try:
-        excel_path = export_game_to_excel(db, game_id)
-    except Exception as e:
-        print(f"导出Excel失败: {e}")
-        excel_path = None
-    
-    # 广播游戏结束
+        await write_behind.submit_room(room, _finish_game, room.game_id)
+    except Exception:
+        # 结算未能写入：房间由 reload_failed_room 从数据库重建并通知玩家
+        return
+    stats_cache.invalidate()
+    rooms.discard(room.game_id)
+    await room_bus.release(room.game_id)
+    job = export_jobs.submit(room.game_id, on_done=notify_excel_ready)
+
+    # 广播游戏结束（不等待 Excel 生成）
     await manager.broadcast_to_all_in_game({
         "type": "game_finished",
         "message": "游戏结束！",
-        "excel_path": excel_path
-    }, game_id)
+        "excel_job_id": job.job_id
+    }, room.game_id)
+
+async def notify_excel_ready(job: ExportJob):
+    """导出任务结束后通知房间内的玩家（status 为 done 或 failed）"""
+    await manager.broadcast_to_all_in_game({"type": "excel_ready", **job.to_dict()}, job.game_id)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXCEL_DOWNLOAD_ATTEMPTS = 2
+
+def _iter_file(file, chunk_size: int = 64 * 1024):
+    """逐块读取已打开的文件（StreamingResponse 在线程池中迭代同步生成器），读完后关闭"""
+    with file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
 
 @app.get("/api/games/{game_id}/excel")
-async def download_excel(game_id: int, db: Session = Depends(get_db)):
-    """下载游戏Excel数据"""
+async def download_excel(game_id: int, if_none_match: Optional[str] = Header(None)):
+    """
+    下载游戏Excel数据：按数据版本缓存（见 app.export_jobs），数据未变时直接发送已生成的文件；
+    ETag 为数据版本，客户端带 If-None-Match 且版本未变时返回 304。
+    版本在导出读线程中计算，不经过数据库写线程；只等待本局尚未落库的写入（没有时直接返回）。
+    文件在发送前被缓存淘汰删除时重新生成一次
+    """
+    await write_behind.flush_room(game_id)
+    version = await export_jobs.version(game_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="游戏不存在")
+    etag = f'"{version}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     try:
-        excel_path = export_game_to_excel(db, game_id)
-        return FileResponse(excel_path, filename=f"game_{game_id}_data.xlsx")
+        for _ in range(EXCEL_DOWNLOAD_ATTEMPTS):
+            job = export_jobs.submit(game_id, version)
+            await asyncio.shield(job.future)
+            if job.status != JOB_DONE:
+                raise RuntimeError(job.error)
+            try:
+                # 先打开文件：之后即使被缓存淘汰删除，已打开的文件仍可读完
+                file = open(job.path, "rb")
+            except FileNotFoundError:
+                # 任务完成后文件已被淘汰：重新提交，submit 发现文件不在时新建任务重新生成
+                continue
+            return StreamingResponse(
+                _iter_file(file),
+                media_type=XLSX_MEDIA_TYPE,
+                headers={
+                    "Content-Length": str(os.fstat(file.fileno()).st_size),
+                    "Content-Disposition": f'attachment; filename="game_{game_id}_data.xlsx"',
+                    "ETag": f'"{job.version}"',
+                    "Cache-Control": "no-cache",
+                },
+            )
+        raise RuntimeError("导出文件生成后被缓存清理删除，请重试")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/games/{game_id}/exports/{job_id}")
+async def get_export_job(game_id: int, job_id: str):
+    """查询 Excel 导出任务状态（任务记录在负责该房间的进程中）"""
+    job = export_jobs.get(job_id)
+    if job is None or job.game_id != game_id:
+        raise HTTPException(status_code=404, detail="导出任务不存在")
+    return job.to_dict()
+
+@app.get("/api/stats")
+async def get_stats(since: Optional[date] = None, until: Optional[date] = None):
+    """
+    已结束对局的汇总统计：按阶段 / 轮次的有机肥占比、补贴申请率、系统 / 投票识破率、NT / ENV 分布，
+    以及局数、获胜者数与最终 NT / ENV 分布；since / until 为结束日期（YYYY-MM-DD，含两端，UTC）。
+    只读汇总表，在统计线程中执行并短时缓存（见 app.stats），不占用数据库写线程。
+    """
+    if since is not None and until is not None and since > until:
+        raise HTTPException(status_code=400, detail="since 不能晚于 until")
+    return await stats_cache.get(since, until)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
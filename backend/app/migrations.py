@@ -0,0 +1,269 @@
+"""
+数据库迁移：按版本号依次执行的迁移步骤，已执行到的版本记录在 schema_version 表中。
+
+启动时只读一次当前版本；没有待执行的步骤时直接返回，不再执行任何 DDL。
+每个步骤以 BEGIN IMMEDIATE 加写锁后重新确认版本，多个 worker 同时启动也只会有一个执行该步骤；
+每个步骤与其版本记录在同一事务中提交（SQLite 的 DDL 支持事务），失败时只回滚该步骤，之前的步骤保持已提交。
+
+新增步骤：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，函数接收 sqlite3 连接，不要修改已发布的步骤。
+各步骤的 DDL 按发布时的表结构写成固定文本，不从 models 的当前定义生成：models 之后的改动由新的步骤完成，
+已发布的步骤在新库和旧库上执行的结果始终相同。
+旧库（没有 schema_version 表）从版本 0 开始执行，因此每个步骤都需要对已存在的表 / 列 / 索引可重复执行。
+"""
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from app.models import engine
+from app.stats import rebuild_stats
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+# 版本 1 发布时的基础表（含版本 2 补上的列：新库直接建全，旧库由版本 2 补列）及单列索引
+_BASE_TABLES_DDL = [
+    """CREATE TABLE IF NOT EXISTS games (
+        id INTEGER NOT NULL,
+        game_code VARCHAR,
+        creator_id INTEGER,
+        status VARCHAR,
+        current_round INTEGER,
+        phase INTEGER,
+        created_at DATETIME,
+        finished_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_games_game_code ON games (game_code)",
+    "CREATE INDEX IF NOT EXISTS ix_games_id ON games (id)",
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER NOT NULL,
+        username VARCHAR NOT NULL,
+        questionnaire_answers TEXT,
+        created_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+    """CREATE TABLE IF NOT EXISTS game_players (
+        id INTEGER NOT NULL,
+        game_id INTEGER,
+        user_id INTEGER,
+        username VARCHAR,
+        initial_nt FLOAT,
+        current_nt FLOAT,
+        current_env FLOAT,
+        final_nt FLOAT,
+        final_env FLOAT,
+        is_winner BOOLEAN,
+        PRIMARY KEY (id),
+        FOREIGN KEY(game_id) REFERENCES games (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_game_players_id ON game_players (id)",
+    """CREATE TABLE IF NOT EXISTS game_rounds (
+        id INTEGER NOT NULL,
+        game_id INTEGER,
+        round_number INTEGER NOT NULL,
+        phase INTEGER NOT NULL,
+        player_id INTEGER,
+        choice VARCHAR NOT NULL,
+        applied_subsidy BOOLEAN,
+        subsidy_verified BOOLEAN,
+        votes_received INTEGER,
+        nt_before FLOAT NOT NULL,
+        nt_after FLOAT NOT NULL,
+        env_before FLOAT NOT NULL,
+        env_after FLOAT NOT NULL,
+        round_nt_earned FLOAT NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(game_id) REFERENCES games (id),
+        FOREIGN KEY(player_id) REFERENCES game_players (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_game_rounds_id ON game_rounds (id)",
+    """CREATE TABLE IF NOT EXISTS game_votes (
+        id INTEGER NOT NULL,
+        game_id INTEGER,
+        round_number INTEGER NOT NULL,
+        voter_id INTEGER,
+        target_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(game_id) REFERENCES games (id),
+        FOREIGN KEY(voter_id) REFERENCES game_players (id),
+        FOREIGN KEY(target_id) REFERENCES game_players (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_game_votes_id ON game_votes (id)",
+]
+
+# 版本 3 的复合索引：(索引名, 表, 列, 是否唯一)
+_COMPOSITE_INDEXES = [
+    ("ix_game_players_game_user", "game_players", ("game_id", "user_id"), False),
+    ("ix_game_rounds_game_round_player", "game_rounds", ("game_id", "round_number", "player_id"), False),
+    ("uq_game_votes_game_round_voter", "game_votes", ("game_id", "round_number", "voter_id"), True),
+]
+
+
+def _create_tables(conn: sqlite3.Connection) -> None:
+    """建表（已存在则跳过）及各表的单列索引"""
+    for statement in _BASE_TABLES_DDL:
+        conn.execute(statement)
+
+
+def _add_legacy_columns(conn: sqlite3.Connection) -> None:
+    """旧库补列：房间创建者、本局昵称、问卷答案"""
+    for table, column, column_type in [
+        ("games", "creator_id", "INTEGER"),
+        ("game_players", "username", "TEXT"),
+        ("users", "questionnaire_answers", "TEXT"),
+    ]:
+        if column not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _create_composite_indexes(conn: sqlite3.Connection) -> None:
+    """
+    热点查询的复合索引；唯一索引与旧数据冲突时改建同列的普通索引并打印提示，不删除任何数据
+    """
+    for name, table, columns, unique in _COMPOSITE_INDEXES:
+        column_list = ", ".join(columns)
+        try:
+            conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({column_list})")
+        except sqlite3.IntegrityError:
+            fallback = f"ix_{name}_nonunique"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {fallback} ON {table} ({column_list})")
+            print(f"索引 {name} 与已有重复数据冲突，已改建普通索引 {fallback}")
+
+
+def _infer_caught_by(conn: sqlite3.Connection) -> None:
+    """
+    旧数据补填识破途径：Phase 2 只有系统核查；Phase 3 中被识破者若是该轮得票最多的玩家记为投票识破，否则为系统核查
+    （平票时当时随机核查其中一人，无法区分，均记为投票识破）
+    """
+    rows = conn.execute(
+        "SELECT id, game_id, round_number, player_id, phase FROM game_rounds "
+        "WHERE subsidy_verified = 0 AND caught_by IS NULL"
+    ).fetchall()
+    if not rows:
+        return
+    counts = {}
+    for game_id, round_number, target_id, votes in conn.execute(
+        "SELECT game_id, round_number, target_id, count(*) FROM game_votes "
+        "WHERE target_id IS NOT NULL GROUP BY game_id, round_number, target_id"
+    ):
+        counts.setdefault((game_id, round_number), {})[target_id] = votes
+    updates = []
+    for row_id, game_id, round_number, player_id, phase in rows:
+        round_votes = counts.get((game_id, round_number), {})
+        most_voted = player_id in round_votes and round_votes[player_id] == max(round_votes.values())
+        updates.append(("vote" if phase == 3 and most_voted else "system", row_id))
+    conn.executemany("UPDATE game_rounds SET caught_by = ? WHERE id = ?", updates)
+
+
+# 版本 4 发布时的汇总统计表
+_STATS_TABLES_DDL = [
+    """CREATE TABLE IF NOT EXISTS stats_rounds (
+        day VARCHAR NOT NULL,
+        round_number INTEGER NOT NULL,
+        phase INTEGER NOT NULL,
+        games INTEGER NOT NULL,
+        player_rounds INTEGER NOT NULL,
+        organic INTEGER NOT NULL,
+        subsidy_applied INTEGER NOT NULL,
+        cheat_applied INTEGER NOT NULL,
+        caught_system INTEGER NOT NULL,
+        caught_vote INTEGER NOT NULL,
+        nt_sum FLOAT NOT NULL,
+        nt_sq_sum FLOAT NOT NULL,
+        nt_min FLOAT,
+        nt_max FLOAT,
+        env_sum FLOAT NOT NULL,
+        env_sq_sum FLOAT NOT NULL,
+        env_min FLOAT,
+        env_max FLOAT,
+        PRIMARY KEY (day, round_number)
+    )""",
+    """CREATE TABLE IF NOT EXISTS stats_games (
+        day VARCHAR NOT NULL,
+        games INTEGER NOT NULL,
+        players INTEGER NOT NULL,
+        winners INTEGER NOT NULL,
+        final_nt_sum FLOAT NOT NULL,
+        final_nt_sq_sum FLOAT NOT NULL,
+        final_nt_min FLOAT,
+        final_nt_max FLOAT,
+        final_env_sum FLOAT NOT NULL,
+        final_env_sq_sum FLOAT NOT NULL,
+        final_env_min FLOAT,
+        final_env_max FLOAT,
+        PRIMARY KEY (day)
+    )""",
+]
+
+
+def _create_stats_tables(conn: sqlite3.Connection) -> None:
+    """识破途径列 + 汇总统计表，并按已结束的对局重建汇总（见 app.stats）"""
+    if "caught_by" not in _columns(conn, "game_rounds"):
+        conn.execute("ALTER TABLE game_rounds ADD COLUMN caught_by TEXT")
+    for ddl in _STATS_TABLES_DDL:
+        conn.execute(ddl)
+    _infer_caught_by(conn)
+    rebuild_stats(conn)
+
+
+# (版本号, 说明, 迁移函数)，版本号从 1 开始连续递增
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "创建基础表", _create_tables),
+    (2, "旧库补列：games.creator_id / game_players.username / users.questionnaire_answers", _add_legacy_columns),
+    (3, "热点查询复合索引", _create_composite_indexes),
+    (4, "识破途径列 game_rounds.caught_by 与汇总统计表 stats_rounds / stats_games", _create_stats_tables),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {SCHEMA_VERSION_TABLE}").fetchone()[0]
+
+
+def run_migrations(bind=engine) -> int:
+    """
+    执行待执行的迁移步骤
+
+    Returns:
+        迁移后的版本号
+    """
+    raw = bind.raw_connection()
+    conn: sqlite3.Connection = raw.driver_connection
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None  # 手动控制事务
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+            "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL)"
+        )
+        if _current_version(conn) >= LATEST_VERSION:
+            return LATEST_VERSION
+
+        for version, description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 加锁后重新确认：其他进程可能已经执行了该步骤
+                if version <= _current_version(conn):
+                    conn.execute("COMMIT")
+                    continue
+                step(conn)
+                conn.execute(
+                    f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.utcnow().isoformat()),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"数据库迁移：版本 {version}（{description}）")
+        return LATEST_VERSION
+    finally:
+        conn.isolation_level = previous_isolation
+        raw.close()
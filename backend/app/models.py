@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, text
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
@@ -30,6 +31,10 @@ class Game(Base):
 
 class GamePlayer(Base):
     __tablename__ = "game_players"
+    __table_args__ = (
+        # 按房间取玩家 / 按 (房间, 用户) 查找复入玩家
+        Index("ix_game_players_game_user", "game_id", "user_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     game_id = Column(Integer, ForeignKey("games.id"))
@@ -48,6 +53,10 @@ class GamePlayer(Base):
 
 class GameRound(Base):
     __tablename__ = "game_rounds"
+    __table_args__ = (
+        # 按 (房间, 轮次[, 玩家]) 取轮次记录 / 按房间导出；旧库中存在同一玩家同一轮的重复记录，因此不设唯一
+        Index("ix_game_rounds_game_round_player", "game_id", "round_number", "player_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     game_id = Column(Integer, ForeignKey("games.id"))
@@ -58,6 +67,7 @@ class GameRound(Base):
     applied_subsidy = Column(Boolean, default=False)
     subsidy_verified = Column(Boolean, nullable=True)  # True=通过, False=识破, None=未申请
     votes_received = Column(Integer, default=0)
+    caught_by = Column(String, nullable=True)  # 被识破的途径：system=系统核查, vote=投票核查, None=未被识破
     nt_before = Column(Float, nullable=False)
     nt_after = Column(Float, nullable=False)
     env_before = Column(Float, nullable=False)
@@ -69,6 +79,10 @@ class GameRound(Base):
 
 class GameVote(Base):
     __tablename__ = "game_votes"
+    __table_args__ = (
+        # 每人每轮只能投一票
+        Index("uq_game_votes_game_round_voter", "game_id", "round_number", "voter_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     game_id = Column(Integer, ForeignKey("games.id"))
@@ -76,23 +90,114 @@ class GameVote(Base):
     voter_id = Column(Integer, ForeignKey("game_players.id"))
     target_id = Column(Integer, ForeignKey("game_players.id"), nullable=True)  # None = 谁都不选，Excel 记 0
 
+class StatsRound(Base):
+    """
+    统计汇总（app.stats）：按 (结束日期, 轮次) 累计已结束对局的轮次记录，游戏结束时增量更新。
+    分布只存和、平方和、最小、最大值，均值 / 标准差在读取时计算。
+    """
+    __tablename__ = "stats_rounds"
+
+    day = Column(String, primary_key=True)  # 结束日期 YYYY-MM-DD（UTC）
+    round_number = Column(Integer, primary_key=True)
+    phase = Column(Integer, nullable=False)
+    games = Column(Integer, nullable=False, default=0)
+    player_rounds = Column(Integer, nullable=False, default=0)
+    organic = Column(Integer, nullable=False, default=0)
+    subsidy_applied = Column(Integer, nullable=False, default=0)
+    cheat_applied = Column(Integer, nullable=False, default=0)  # 使用无机肥并申请补贴
+    caught_system = Column(Integer, nullable=False, default=0)
+    caught_vote = Column(Integer, nullable=False, default=0)
+    nt_sum = Column(Float, nullable=False, default=0.0)
+    nt_sq_sum = Column(Float, nullable=False, default=0.0)
+    nt_min = Column(Float, nullable=True)
+    nt_max = Column(Float, nullable=True)
+    env_sum = Column(Float, nullable=False, default=0.0)
+    env_sq_sum = Column(Float, nullable=False, default=0.0)
+    env_min = Column(Float, nullable=True)
+    env_max = Column(Float, nullable=True)
+
+class StatsGame(Base):
+    """统计汇总：按结束日期累计已结束对局的局数、玩家数、获胜者数与最终 NT / ENV 分布"""
+    __tablename__ = "stats_games"
+
+    day = Column(String, primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    players = Column(Integer, nullable=False, default=0)
+    winners = Column(Integer, nullable=False, default=0)
+    final_nt_sum = Column(Float, nullable=False, default=0.0)
+    final_nt_sq_sum = Column(Float, nullable=False, default=0.0)
+    final_nt_min = Column(Float, nullable=True)
+    final_nt_max = Column(Float, nullable=True)
+    final_env_sum = Column(Float, nullable=False, default=0.0)
+    final_env_sq_sum = Column(Float, nullable=False, default=0.0)
+    final_env_min = Column(Float, nullable=True)
+    final_env_max = Column(Float, nullable=True)
+
 # 数据库初始化
 DATABASE_URL = "sqlite:///./game.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+# SQLite 存储配置（DB_PROFILE）：每个新连接执行一次对应的 PRAGMA
+# - tuned（默认）：WAL 日志 + synchronous=NORMAL（只在检查点 fsync，断电最多丢失最近几次提交，不会损坏数据库），
+#   mmap / 页缓存加大，忙等待 5 秒，多个进程同时写入时排队而不是立即报 database is locked；
+# - durable：WAL + synchronous=FULL，每次提交都 fsync；
+# - default：与原先的引擎一致（回滚日志，每次提交 fsync，sqlite3 模块默认的 5 秒锁等待），不执行任何 PRAGMA。
+# sqlite3 模块的默认锁等待（秒）；配置中没有 busy_timeout 时使用，与原先未指定 timeout 的引擎相同
+SQLITE_DEFAULT_TIMEOUT = 5.0
+SQLITE_PROFILES = {
+    "default": {},
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # 负数表示 KiB，即 64 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+DB_PROFILE = os.environ.get("DB_PROFILE", "tuned")
+# 连接池：数据库操作都在数据库线程池中执行（app.db_executor，DB_THREADS 个线程），
+# 另留少量连接给导出脚本等同进程的直接调用
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", str(int(os.environ.get("DB_THREADS", "1")) + 2)))
+# 每个连接缓存的预编译语句数（sqlite3 模块按 SQL 文本复用预编译语句）
+DB_STATEMENT_CACHE = 256
+
+def create_sqlite_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE):
+    """按存储配置创建 SQLite 引擎；内存库只用默认设置"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"未知的存储配置: {profile}（可选：{', '.join(SQLITE_PROFILES)}）")
+    if url.startswith("sqlite:///:memory:") or url == "sqlite://":
+        return create_engine(url, connect_args={"check_same_thread": False})
+    pragmas = SQLITE_PROFILES[profile]
+    engine = create_engine(
+        url,
+        connect_args={
+            "check_same_thread": False,
+            "cached_statements": DB_STATEMENT_CACHE,
+            # sqlite3 模块自身的锁等待（秒），与 busy_timeout 一致
+            "timeout": pragmas["busy_timeout"] / 1000 if "busy_timeout" in pragmas else SQLITE_DEFAULT_TIMEOUT,
+        },
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_SIZE,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
-    # 兼容旧库：按需添加列
-    with engine.connect() as conn:
-        for sql in [
-            "ALTER TABLE games ADD COLUMN creator_id INTEGER",
-            "ALTER TABLE game_players ADD COLUMN username TEXT",
-            "ALTER TABLE users ADD COLUMN questionnaire_answers TEXT",
-        ]:
-            try:
-                conn.execute(text(sql))
-                conn.commit()
-            except Exception:
-                conn.rollback()
-                pass
+    """建表与迁移：只检查一次 schema_version，有待执行的迁移步骤时才执行（见 app.migrations）"""
+    from app.migrations import run_migrations
+    return run_migrations(engine)
@@ -0,0 +1,300 @@
+"""
+房间协调总线：让同一房间的玩家可以连接到不同的 worker 进程。
+
+- LocalRoomBus（默认，ROOM_BUS=local）：单进程，所有房间都归本进程，不做任何转发；
+- UnixSocketRoomBus（ROOM_BUS=unix）：多进程，通过本机 Unix socket 上的消息代理协调
+  （代理进程：python -m app.room_bus，地址 ROOM_BUS_PATH）：
+  - 每个房间同一时刻只归一个 worker（所有者），由代理按「先到先得」分配；
+    房间内存状态（app.rooms）与结算只在所有者进程中；
+  - 其他 worker 收到该房间的 WebSocket 消息时转发给所有者，需要快照时向所有者请求；
+  - 所有者的广播发布给其他 worker，各 worker 只发给本进程内的连接；
+  - worker 退出时代理释放它的房间并通知其他 worker，下一次访问由新的所有者从数据库恢复
+    （恢复语义见 app.rooms：尚未落库的提交 / 投票需要重新提交）。
+
+其他 worker 转来的同一房间的消息（命令、快照请求、广播）在该房间自己的队列中按到达顺序逐条处理，
+前一条处理完（含 rooms.get 与房间锁内的处理）才开始下一条；不同房间互不等待。
+
+代理协议：每行一条 JSON。worker → 代理：claim / release / send / publish；
+代理 → worker：welcome / reply / msg / owner_lost。
+"""
+import asyncio
+import itertools
+import json
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+ROOM_BUS = os.environ.get("ROOM_BUS", "local")  # local / unix
+ROOM_BUS_PATH = os.environ.get("ROOM_BUS_PATH", "/tmp/nantang_room_bus.sock")
+ROOM_BUS_REQUEST_TIMEOUT = float(os.environ.get("ROOM_BUS_REQUEST_TIMEOUT", "5"))
+FRAME_LIMIT = 16 * 1024 * 1024  # 单条消息上限（快照 / 广播文本）
+
+# 总线消息处理函数：收到转发的命令 / 请求 / 广播时调用，请求的返回值作为回复
+BusHandler = Callable[[dict], Awaitable[Any]]
+
+
+def _encode_frame(frame: dict) -> bytes:
+    return (json.dumps(frame, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+class LocalRoomBus:
+    """单进程：所有房间都归本进程"""
+    remote = False
+    worker_id = 0
+
+    async def start(self, handler: BusHandler) -> None:
+        pass
+
+    async def owner_of(self, game_id: int) -> int:
+        return self.worker_id
+
+    async def is_owner(self, game_id: int) -> bool:
+        return True
+
+    async def send(self, worker_id: int, message: dict) -> None:
+        raise RuntimeError("单进程总线没有其他 worker")
+
+    async def request(self, worker_id: int, message: dict) -> Any:
+        raise RuntimeError("单进程总线没有其他 worker")
+
+    async def publish(self, message: dict) -> None:
+        pass
+
+    async def release(self, game_id: int) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class UnixSocketRoomBus(LocalRoomBus):
+    """多进程：通过 Unix socket 消息代理协调房间所有权与消息转发"""
+    remote = True
+
+    def __init__(self, path: str = ROOM_BUS_PATH):
+        self.path = path
+        self.worker_id: Optional[int] = None
+        self.handler: Optional[BusHandler] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._owners: Dict[int, asyncio.Future] = {}   # game_id -> 所有者 worker_id（单次请求）
+        self._pending: Dict[int, asyncio.Future] = {}  # 请求编号 -> 回复
+        self._request_ids = itertools.count(1)
+        self._inboxes: Dict[int, Deque[dict]] = {}  # game_id -> 待处理的转发消息（有处理任务时存在）
+        self._tasks: Set[asyncio.Task] = set()      # 保留处理任务的引用，避免完成前被回收
+
+    async def start(self, handler: BusHandler) -> None:
+        self.handler = handler
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=FRAME_LIMIT)
+        welcome = json.loads(await self._reader.readline())
+        self.worker_id = welcome["worker"]
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def owner_of(self, game_id: int) -> int:
+        """房间所有者；尚无所有者时由本进程认领"""
+        owner = self._owners.get(game_id)
+        if owner is None:
+            owner = asyncio.ensure_future(self._call({"op": "claim", "game_id": game_id}))
+            self._owners[game_id] = owner
+            owner.add_done_callback(lambda f: self._forget_failed_claim(game_id, f))
+        return await asyncio.shield(owner)
+
+    def _forget_failed_claim(self, game_id: int, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            if self._owners.get(game_id) is future:
+                del self._owners[game_id]
+
+    async def is_owner(self, game_id: int) -> bool:
+        return await self.owner_of(game_id) == self.worker_id
+
+    async def send(self, worker_id: int, message: dict) -> None:
+        """发给指定 worker（不等待处理）"""
+        await self._write({"op": "send", "to": worker_id, "msg": message})
+
+    async def request(self, worker_id: int, message: dict) -> Any:
+        """发给指定 worker 并等待其处理结果"""
+        req = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req] = future
+        try:
+            await self._write({"op": "send", "to": worker_id,
+                               "msg": {**message, "req": req, "reply_to": self.worker_id}})
+            return await asyncio.wait_for(future, timeout=ROOM_BUS_REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(req, None)
+
+    async def publish(self, message: dict) -> None:
+        """发给其他所有 worker"""
+        await self._write({"op": "publish", "msg": message})
+
+    async def release(self, game_id: int) -> None:
+        self._owners.pop(game_id, None)
+        await self._write({"op": "release", "game_id": game_id})
+
+    async def close(self) -> None:
+        if self._read_task is not None:
+            self._read_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _call(self, frame: dict) -> Any:
+        """向代理发请求并等待回复"""
+        req = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req] = future
+        try:
+            await self._write({**frame, "req": req})
+            return await asyncio.wait_for(future, timeout=ROOM_BUS_REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(req, None)
+
+    async def _write(self, frame: dict) -> None:
+        self._writer.write(_encode_frame(frame))
+        await self._writer.drain()
+
+    def _resolve(self, req: int, result: Any) -> None:
+        future = self._pending.get(req)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def _read_loop(self) -> None:
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                print("房间总线代理连接已断开")
+                return
+            frame = json.loads(line)
+            op = frame["op"]
+            if op == "reply":
+                self._resolve(frame["req"], frame["result"])
+            elif op == "owner_lost":
+                for game_id in frame["game_ids"]:
+                    self._owners.pop(game_id, None)
+            elif op == "msg":
+                message = frame["msg"]
+                if message.get("kind") == "reply":
+                    self._resolve(message["req"], message["result"])
+                else:
+                    self._accept(message)
+
+    def _accept(self, message: dict) -> None:
+        """同一房间的消息放进该房间的队列，由一个任务逐条处理；不属于房间的消息直接处理"""
+        game_id = message.get("game_id")
+        if game_id is None:
+            self._track(self._handle(message))
+            return
+        inbox = self._inboxes.get(game_id)
+        if inbox is None:
+            inbox = self._inboxes[game_id] = deque()
+            self._track(self._drain(game_id, inbox))
+        inbox.append(message)
+
+    def _track(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, game_id: int, inbox: Deque[dict]) -> None:
+        """逐条处理房间队列中的消息；队列取空后结束，下一条消息到达时重新创建队列与任务"""
+        try:
+            while inbox:
+                await self._handle(inbox.popleft())
+        finally:
+            if self._inboxes.get(game_id) is inbox:
+                del self._inboxes[game_id]
+
+    async def _handle(self, message: dict) -> None:
+        try:
+            result = await self.handler(message)
+        except Exception as e:
+            print(f"处理房间总线消息失败: {e!r}")
+            result = None
+        if "reply_to" in message:
+            await self.send(message["reply_to"], {"kind": "reply", "req": message["req"], "result": result})
+
+
+def create_room_bus(kind: str = ROOM_BUS) -> LocalRoomBus:
+    if kind == "local":
+        return LocalRoomBus()
+    if kind == "unix":
+        return UnixSocketRoomBus()
+    raise ValueError(f"未知的房间总线: {kind}（可选：local / unix）")
+
+
+room_bus = create_room_bus()
+
+
+# ========== 消息代理（独立进程） ==========
+
+class RoomBroker:
+    """本机消息代理：分配 worker 编号与房间所有权，转发点对点消息与广播"""
+
+    def __init__(self):
+        self.workers: Dict[int, asyncio.StreamWriter] = {}
+        self.owners: Dict[int, int] = {}  # game_id -> worker_id
+        self._worker_ids = itertools.count(1)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker_id = next(self._worker_ids)
+        self.workers[worker_id] = writer
+        await self._send(writer, {"op": "welcome", "worker": worker_id})
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self._dispatch(worker_id, writer, json.loads(line))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.workers[worker_id]
+            lost = [game_id for game_id, owner in self.owners.items() if owner == worker_id]
+            for game_id in lost:
+                del self.owners[game_id]
+            if lost:
+                await self._broadcast({"op": "owner_lost", "game_ids": lost})
+            writer.close()
+
+    async def _dispatch(self, worker_id: int, writer: asyncio.StreamWriter, frame: dict) -> None:
+        op = frame["op"]
+        if op == "claim":
+            owner = self.owners.setdefault(frame["game_id"], worker_id)
+            await self._send(writer, {"op": "reply", "req": frame["req"], "result": owner})
+        elif op == "release":
+            if self.owners.get(frame["game_id"]) == worker_id:
+                del self.owners[frame["game_id"]]
+        elif op == "send":
+            target = self.workers.get(frame["to"])
+            if target is not None:
+                await self._send(target, {"op": "msg", "msg": frame["msg"]})
+        elif op == "publish":
+            await self._broadcast({"op": "msg", "msg": frame["msg"]}, exclude=worker_id)
+
+    async def _broadcast(self, frame: dict, exclude: Optional[int] = None) -> None:
+        for worker_id, writer in list(self.workers.items()):
+            if worker_id != exclude:
+                await self._send(writer, frame)
+
+    async def _send(self, writer: asyncio.StreamWriter, frame: dict) -> None:
+        try:
+            writer.write(_encode_frame(frame))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def run_broker(path: str = ROOM_BUS_PATH) -> None:
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = RoomBroker()
+    server = await asyncio.start_unix_server(broker.handle, path, limit=FRAME_LIMIT)
+    print(f"房间总线代理已启动: {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_broker())
@@ -0,0 +1,301 @@
+"""
+房间内存状态：玩家余额、当前轮次 / 阶段、本轮提交、投票与「下一轮」确认都以内存中的 Room 为准，
+提交与投票只是字典更新 + 广播，不再查询数据库。
+
+数据库在轮次边界由写后队列（app.db_executor.write_behind）按提交顺序批量落库：
+- 轮次结算：GameRound 批量插入 + GamePlayer 余额批量更新；
+- Phase 3 投票结算：本轮投票、补贴核查结果与余额；
+- 进入下一轮 / 下一阶段：Game.current_round / phase；
+- 整局结束：最终结算字段 + Excel 导出。
+
+玩家数据按版本同步：客户端连接时收到完整快照（snapshot_payload，带序号 seq），
+之后每次进入下一轮只收到 NT / ENV 有变化的字段（take_delta，seq 加 1）；
+客户端发现序号不连续时通过 /api/games/{game_id}/snapshot 重新获取完整快照。
+
+崩溃恢复：内存中没有的房间按需从数据库重建（load_room），启动时预先重建所有进行中的房间；
+写后任务失败时同样丢弃内存中的房间并从数据库重建（见 main.reload_failed_room）。
+恢复到最近一次落库的轮次边界：本轮已结算则直接进入等待「下一轮」（Phase 3 未落库投票时回到投票阶段），
+否则回到选择阶段；尚未落库的提交 / 投票需要玩家重新提交。
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+
+from app.models import Game, GamePlayer, GameVote
+from app.round_engine import load_round_context, player_display_names, persist_round
+from app.db_executor import run_in_session, write_behind
+
+STAGE_CHOOSING = "choosing"  # 等待所有人提交选择
+STAGE_VOTING = "voting"      # Phase 3：等待所有人投票
+STAGE_READY = "ready"        # Phase 2/3：等待所有人点击「下一轮」
+
+
+@dataclass
+class PlayerState:
+    """房间内一名玩家的内存状态"""
+    id: int
+    user_id: Optional[int]
+    username: str  # 展示名（本局昵称 / 用户名 / 玩家{id}）
+    current_nt: float
+    current_env: float
+
+
+@dataclass
+class Room:
+    """一个房间的权威状态"""
+    game_id: int
+    status: str
+    current_round: int
+    phase: int
+    players: Dict[int, PlayerState] = field(default_factory=dict)  # 按 player_id 升序
+    stage: str = STAGE_CHOOSING
+    submissions: Dict[int, dict] = field(default_factory=dict)    # {player_id: {"choice", "apply_subsidy", "submitted"}}
+    votes: Dict[int, Optional[int]] = field(default_factory=dict)  # {voter_id: target_id}，None = 谁都不选
+    ready: Set[int] = field(default_factory=set)
+    records: Dict[int, dict] = field(default_factory=dict)         # 本轮结算结果（round_engine.resolve_round 的 outcome）
+    broadcasts: List[dict] = field(default_factory=list)           # Phase 3 本轮投票结果 + 系统识破两条广播
+    seq: int = 0                                                   # 玩家数据版本号，每发出一次增量加 1
+    synced: Dict[int, Tuple[float, float]] = field(default_factory=dict)  # 版本 seq 时各玩家的 (NT, ENV)
+    # 房间锁：同一房间的消息（提交 / 投票 / 确认及其触发的结算、切换轮次）逐条处理
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+    # 写后任务最终失败的异常；不为空时该房间已作废，之后的写入都被跳过，由数据库重建的新房间替代
+    write_error: Optional[BaseException] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.synced:
+            self.synced = {pid: (p.current_nt, p.current_env) for pid, p in self.players.items()}
+
+    @property
+    def player_list(self) -> List[PlayerState]:
+        return list(self.players.values())
+
+    @property
+    def num_players(self) -> int:
+        return len(self.players)
+
+    def name_of(self, player_id: int) -> str:
+        player = self.players.get(player_id)
+        return player.username if player else f"玩家{player_id}"
+
+    def reset_round(self) -> None:
+        """进入新一轮：清空本轮提交、投票、确认与结算结果"""
+        self.stage = STAGE_CHOOSING
+        self.submissions = {}
+        self.votes = {}
+        self.ready = set()
+        self.records = {}
+        self.broadcasts = []
+
+    def snapshot_payload(self) -> dict:
+        """完整快照（连接时 / 重新同步时发送），与当前 seq 一致"""
+        return {
+            "type": "room_snapshot",
+            "seq": self.seq,
+            "status": self.status,
+            "current_round": self.current_round,
+            "phase": self.phase,
+            "players": [
+                {"id": pid, "current_nt": nt, "current_env": env, **self._identity(pid)}
+                for pid, (nt, env) in self.synced.items()
+            ],
+            "submitted_player_ids": list(self.submissions),
+            "vote_submitted_player_ids": list(self.votes),
+        }
+
+    def _identity(self, player_id: int) -> dict:
+        player = self.players[player_id]
+        return {"user_id": player.user_id, "username": player.username}
+
+    def take_delta(self) -> List[dict]:
+        """
+        与上一版本相比有变化的 NT / ENV 字段，并把版本号加 1
+
+        Returns:
+            [{"id", "current_nt"?, "current_env"?}]，只含有变化的玩家与字段
+        """
+        changes = []
+        for pid, player in self.players.items():
+            nt, env = self.synced.get(pid, (None, None))
+            change = {}
+            if player.current_nt != nt:
+                change["current_nt"] = player.current_nt
+            if player.current_env != env:
+                change["current_env"] = player.current_env
+            if change:
+                changes.append({"id": pid, **change})
+            self.synced[pid] = (player.current_nt, player.current_env)
+        self.seq += 1
+        return changes
+
+
+def _record_from_row(row) -> dict:
+    return {
+        "player_id": row.player_id,
+        "choice": row.choice,
+        "applied_subsidy": row.applied_subsidy,
+        "subsidy_verified": row.subsidy_verified,
+        "caught_by": row.caught_by,
+        "nt_before": row.nt_before,
+        "nt_after": row.nt_after,
+        "env_before": row.env_before,
+        "env_after": row.env_after,
+        "round_nt_earned": row.round_nt_earned,
+        "env_change": row.env_after - row.env_before,
+    }
+
+
+def load_room(db: Session, game_id: int) -> Optional[Room]:
+    """
+    从数据库重建房间（崩溃恢复 / 首次访问）
+
+    Returns:
+        Room，房间不存在时为 None
+    """
+    game = db.query(Game).filter(Game.id == game_id).first()
+    if not game:
+        return None
+    players = db.query(GamePlayer).filter(GamePlayer.game_id == game_id).order_by(GamePlayer.id).all()
+    names = player_display_names(db, players)
+    room = Room(
+        game_id=game_id,
+        status=game.status,
+        current_round=game.current_round,
+        phase=game.phase,
+        players={
+            p.id: PlayerState(p.id, p.user_id, names[p.id], p.current_nt, p.current_env)
+            for p in players
+        },
+    )
+    if game.status != "playing":
+        return room
+
+    ctx = load_round_context(db, game_id, game.current_round)
+    if not ctx.rounds:
+        return room
+    # 本轮已结算落库：恢复结算结果；Phase 1 结算后立即进入下一轮，这里补上
+    room.records = {pid: _record_from_row(row) for pid, row in ctx.rounds.items()}
+    room.submissions = {
+        pid: {"choice": r["choice"], "apply_subsidy": r["applied_subsidy"], "submitted": True}
+        for pid, r in room.records.items()
+    }
+    if game.phase == 1:
+        advance_room(room)
+        game.current_round, game.phase = room.current_round, room.phase
+        db.commit()
+    elif game.phase == 3 and not ctx.votes:
+        room.stage = STAGE_VOTING
+    else:
+        room.stage = STAGE_READY
+    return room
+
+
+def advance_room(room: Room) -> bool:
+    """
+    进入下一轮 / 下一阶段（只改内存）
+
+    Returns:
+        True 表示第 15 轮已结束，应结算整局
+    """
+    if room.current_round == 15:
+        return True
+    if room.current_round == 5:
+        room.phase = 2
+    elif room.current_round == 10:
+        room.phase = 3
+    room.current_round += 1
+    room.reset_round()
+    return False
+
+
+class RoomRegistry:
+    """进程内全部房间；不在内存中的房间首次访问时从数据库重建，同一房间并发访问只加载一次"""
+
+    def __init__(self):
+        self._rooms: Dict[int, Room] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    async def get(self, game_id: int) -> Optional[Room]:
+        room = self._rooms.get(game_id)
+        if room is not None:
+            return room
+        loading = self._loading.get(game_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(game_id))
+            self._loading[game_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(game_id, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, game_id: int) -> Optional[Room]:
+        # 先等待本局尚未落库的写入，保证读到最新的轮次边界
+        await write_behind.flush_room(game_id)
+        room = await run_in_session(load_room, game_id)
+        if room is not None and room.status != "finished":
+            self._rooms[game_id] = room
+        return room
+
+    def discard(self, game_id: int, room: Optional[Room] = None) -> None:
+        """
+        从内存移除房间，下次访问时从数据库重建；
+        仅用于没有未落库状态的时刻（等待开始的房间、整局结束后），或写入失败后丢弃作废的房间。
+        指定 room 时只在内存中仍是该房间对象时移除
+        """
+        if room is None or self._rooms.get(game_id) is room:
+            self._rooms.pop(game_id, None)
+
+    async def recover(self, claim: Optional[Callable[[int], Awaitable[bool]]] = None) -> List[int]:
+        """
+        启动时重建所有进行中的房间；多进程时只重建 claim 认领到的房间（见 app.room_bus）
+
+        Returns:
+            重建的房间 id
+        """
+        game_ids = await run_in_session(_playing_game_ids)
+        recovered = []
+        for game_id in game_ids:
+            if claim is None or await claim(game_id):
+                await self.get(game_id)
+                recovered.append(game_id)
+        return recovered
+
+
+def _playing_game_ids(db: Session) -> List[int]:
+    return [gid for (gid,) in db.query(Game.id).filter(Game.status == "playing").all()]
+
+
+rooms = RoomRegistry()
+
+
+# ========== 写后任务（在数据库线程中按提交顺序执行） ==========
+
+def persist_round_job(db: Session, game_id: int, round_number: int, phase: int, outcomes: List[dict]) -> None:
+    """轮次结算：GameRound 批量插入 + GamePlayer 余额批量更新"""
+    persist_round(db, game_id, round_number, phase, outcomes)
+    db.commit()
+
+
+def persist_votes_job(db: Session, game_id: int, round_number: int, votes: Dict[int, Optional[int]],
+                      records: Dict[int, dict], balances: Dict[int, float]) -> None:
+    """Phase 3 投票结算：本轮投票、补贴核查结果与余额"""
+    db.bulk_insert_mappings(GameVote, [
+        {"game_id": game_id, "round_number": round_number, "voter_id": voter_id, "target_id": target_id}
+        for voter_id, target_id in votes.items()
+    ])
+    ctx = load_round_context(db, game_id, round_number, votes=False)
+    for player_id, record in records.items():
+        row = ctx.round_of(player_id)
+        if row is not None:
+            row.subsidy_verified = record["subsidy_verified"]
+            row.caught_by = record.get("caught_by")
+            row.round_nt_earned = record["round_nt_earned"]
+    for player_id, nt in balances.items():
+        player = ctx.players_by_id.get(player_id)
+        if player is not None:
+            player.current_nt = nt
+    db.commit()
+
+
+def persist_advance_job(db: Session, game_id: int, current_round: int, phase: int) -> None:
+    """进入下一轮 / 下一阶段"""
+    db.query(Game).filter(Game.id == game_id).update({"current_round": current_round, "phase": phase})
+    db.commit()
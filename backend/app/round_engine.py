@@ -0,0 +1,199 @@
+"""
+轮次结算引擎：一次批量计算全房间的收益、生态值变化与补贴结果，
+并以一条批量 INSERT（GameRound）+ 一条批量 UPDATE（GamePlayer）落库。
+RoundContext 按 (game_id, round_number) 一次取出玩家、本轮记录、投票与昵称，
+供 Phase 2/3 的投票、系统识破与广播各步骤复用，避免逐玩家查询。
+"""
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.orm import Session
+
+from app.models import User, GamePlayer, GameRound, GameVote
+from app.game_logic import (
+    GameRules, DEFAULT_RULES,
+    calculate_earnings, calculate_env_change_from_counts, check_subsidy_verification,
+    count_choices, get_env_change_text,
+)
+
+
+def resolve_round(players: Iterable, choices: Dict[int, dict], phase: int,
+                  rules: GameRules = DEFAULT_RULES) -> List[dict]:
+    """
+    计算一轮内所有已提交玩家的结果（纯计算，不访问数据库）。
+    生态值变化用全场有机/无机人数聚合计算，整轮 O(N)。
+
+    Args:
+        players: 房间玩家（需有 id / current_nt / current_env），按此顺序结算
+        choices: {player_id: {"choice": ..., "apply_subsidy": ...}}
+        phase: 当前阶段 (1, 2, 3)
+        rules: 数值规则，默认 DEFAULT_RULES
+
+    Returns:
+        每个已提交玩家一条结果 dict：player_id、choice、applied_subsidy、subsidy_verified、caught_by、
+        nt_before/nt_after、env_before/env_after、round_nt_earned、env_change
+    """
+    players = [p for p in players if p.id in choices]
+    organic_count, inorganic_count = count_choices({p.id: choices[p.id]["choice"] for p in players})
+
+    outcomes = []
+    for player in players:
+        choice_data = choices[player.id]
+        choice = choice_data["choice"]
+        apply_subsidy = choice_data.get("apply_subsidy", False)
+
+        # 收益含当前 ENV 影响；生态值变化按全场人数聚合
+        env_change = calculate_env_change_from_counts(choice, organic_count, inorganic_count, rules)
+        earnings = calculate_earnings(choice, player.current_env, rules)
+
+        # 补贴处理（Phase 2和3）：先扣质押；Phase 2 立即验证，Phase 3 等投票后再算
+        subsidy_verified = None
+        if apply_subsidy and phase >= 2:
+            subsidy_amount = rules.subsidy(phase)
+            earnings -= subsidy_amount
+            if phase == 2:
+                subsidy_verified = check_subsidy_verification(choice, phase, rules=rules)
+                if subsidy_verified:
+                    # 验证通过，返还质押并获得补贴
+                    earnings += subsidy_amount * 2
+
+        outcomes.append({
+            "player_id": player.id,
+            "choice": choice,
+            "applied_subsidy": apply_subsidy,
+            "subsidy_verified": subsidy_verified,
+            "caught_by": "system" if subsidy_verified is False else None,
+            "nt_before": player.current_nt,
+            "nt_after": player.current_nt + earnings,
+            "env_before": player.current_env,
+            "env_after": player.current_env + env_change,
+            "round_nt_earned": earnings,
+            "env_change": env_change,
+        })
+    return outcomes
+
+
+def persist_round(db: Session, game_id: int, round_number: int, phase: int, outcomes: List[dict]) -> None:
+    """
+    将 resolve_round 的结果写入数据库：GameRound 一次批量插入，GamePlayer 一次批量更新。
+    不提交事务，由调用方 commit。
+    """
+    if not outcomes:
+        return
+    db.bulk_insert_mappings(GameRound, [
+        {
+            "game_id": game_id,
+            "round_number": round_number,
+            "phase": phase,
+            "player_id": o["player_id"],
+            "choice": o["choice"],
+            "applied_subsidy": o["applied_subsidy"],
+            "subsidy_verified": o["subsidy_verified"],
+            "caught_by": o.get("caught_by"),
+            "nt_before": o["nt_before"],
+            "nt_after": o["nt_after"],
+            "env_before": o["env_before"],
+            "env_after": o["env_after"],
+            "round_nt_earned": o["round_nt_earned"],
+        }
+        for o in outcomes
+    ])
+    db.bulk_update_mappings(GamePlayer, [
+        {"id": o["player_id"], "current_nt": o["nt_after"], "current_env": o["env_after"]}
+        for o in outcomes
+    ])
+
+
+def round_results_from_outcomes(outcomes: List[dict]) -> Dict[int, dict]:
+    """将结算结果转为广播用的 round_results：{player_id: {...}}"""
+    return {
+        o["player_id"]: {
+            "nt_before": o["nt_before"],
+            "nt_after": o["nt_after"],
+            "env_before": o["env_before"],
+            "env_after": o["env_after"],
+            "round_nt_earned": o["round_nt_earned"],
+            "env_change": get_env_change_text(o["env_change"]),
+            "subsidy_result": None,
+        }
+        for o in outcomes
+    }
+
+
+def player_display_names(db: Session, players: Iterable) -> Dict[int, str]:
+    """
+    批量取玩家展示名：优先本局昵称，其次关联用户名（一次 IN 查询），否则「玩家{id}」
+
+    Returns:
+        {player_id: 展示名}
+    """
+    players = list(players)
+    user_ids = {
+        p.user_id for p in players
+        if not (p.username and str(p.username).strip()) and p.user_id
+    }
+    usernames = {}
+    if user_ids:
+        usernames = dict(db.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+    names = {}
+    for p in players:
+        if p.username and str(p.username).strip():
+            names[p.id] = p.username.strip()
+        elif p.user_id and p.user_id in usernames:
+            names[p.id] = usernames[p.user_id]
+        else:
+            names[p.id] = f"玩家{p.id}"
+    return names
+
+
+class RoundContext:
+    """
+    一轮的批量加载结果：房间玩家、本轮 GameRound、本轮投票与展示名，
+    固定条数的查询取出，之后按 player_id 查字典。
+    取出的玩家与轮次记录都在会话中，可直接修改后由调用方 commit。
+    """
+
+    def __init__(self, db: Session, game_id: int, round_number: int):
+        self.db = db
+        self.game_id = game_id
+        self.round_number = round_number
+        self.players: List[GamePlayer] = []
+        self.players_by_id: Dict[int, GamePlayer] = {}
+        self.rounds: Dict[int, GameRound] = {}
+        self.votes: List[GameVote] = []
+        self.names: Dict[int, str] = {}
+
+    def load(self, votes: bool = True) -> "RoundContext":
+        """取出玩家、本轮记录（及投票、展示名）"""
+        self.reload()
+        if votes:
+            self.votes = self.db.query(GameVote).filter(
+                GameVote.game_id == self.game_id,
+                GameVote.round_number == self.round_number,
+            ).all()
+        self.names = player_display_names(self.db, self.players)
+        return self
+
+    def reload(self) -> "RoundContext":
+        """
+        commit 后会话中的对象会过期，逐个访问会各触发一次 SELECT；
+        重新整体查询一次玩家与本轮记录即可批量刷新
+        """
+        self.players = self.db.query(GamePlayer).filter(GamePlayer.game_id == self.game_id).all()
+        self.players_by_id = {p.id: p for p in self.players}
+        self.rounds = {}
+        for r in self.db.query(GameRound).filter(
+            GameRound.game_id == self.game_id,
+            GameRound.round_number == self.round_number,
+        ).order_by(GameRound.id).all():
+            self.rounds.setdefault(r.player_id, r)
+        return self
+
+    def round_of(self, player_id: int) -> Optional[GameRound]:
+        return self.rounds.get(player_id)
+
+    def name_of(self, player_id: int) -> str:
+        return self.names.get(player_id, f"玩家{player_id}")
+
+
+def load_round_context(db: Session, game_id: int, round_number: int, votes: bool = True) -> RoundContext:
+    """按 (game_id, round_number) 批量加载一轮数据"""
+    return RoundContext(db, game_id, round_number).load(votes=votes)
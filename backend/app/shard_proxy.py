@@ -0,0 +1,185 @@
+"""
+房间亲和分片前端：启动 K 个互不通信的后端 worker，按 game_id 一致性哈希把请求固定转发到其中一个。
+
+- /ws/game/{game_id}/player/{player_id} 与 /api/games/{game_id}/... 按 game_id 转发，
+  同一房间的所有连接与请求都落在同一个 worker 上，房间状态完全在该 worker 内存中，进程间没有通信；
+- 其他接口（注册、创建 / 按房间号查找游戏、问卷等）只读写数据库，轮流转发给各 worker；
+- worker 以 SHARD=i/K 启动，崩溃恢复时只重建归自己的房间（app.sharding）。
+
+用法（在 backend 目录下）：
+    python -m app.shard_proxy --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import re
+import subprocess
+import sys
+from typing import List, Optional
+
+import httpx
+import websockets
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+
+from app.sharding import HashRing
+
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "2"))
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", "8100"))
+PROXY_TIMEOUT = 60.0
+
+GAME_PATH = re.compile(r"^/api/games/(\d+)(/|$)")
+# 逐跳头不转发
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "host", "content-length"}
+
+
+class ShardRouter:
+    """worker 地址与路由"""
+
+    def __init__(self, workers: int, base_port: int, host: str = "127.0.0.1"):
+        self.ports = [base_port + i for i in range(workers)]
+        self.host = host
+        self.ring = HashRing(list(range(workers)))
+        self._round_robin = itertools.cycle(range(workers))
+
+    def worker_for(self, game_id: Optional[int]) -> int:
+        if game_id is None:
+            return next(self._round_robin)
+        return self.ring.node_for(game_id)
+
+    def http_url(self, worker: int) -> str:
+        return f"http://{self.host}:{self.ports[worker]}"
+
+    def ws_url(self, worker: int) -> str:
+        return f"ws://{self.host}:{self.ports[worker]}"
+
+
+def start_workers(router: ShardRouter) -> List[subprocess.Popen]:
+    """以子进程启动 K 个后端 worker（各自单进程、本地房间总线）"""
+    processes = []
+    for index, port in enumerate(router.ports):
+        env = dict(os.environ, SHARD=f"{index}/{len(router.ports)}", ROOM_BUS="local")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", router.host, "--port", str(port),
+             "--log-level", "warning"],
+            env=env,
+        ))
+    return processes
+
+
+async def wait_for_workers(router: ShardRouter, timeout: float = 30.0) -> None:
+    async with httpx.AsyncClient() as client:
+        for worker in range(len(router.ports)):
+            for _ in range(int(timeout / 0.2)):
+                try:
+                    await client.get(router.http_url(worker) + "/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise RuntimeError(f"worker {worker} 启动超时")
+
+
+def create_proxy_app(router: ShardRouter, spawn: bool = True) -> FastAPI:
+    app = FastAPI(title="迷雾南塘 分片前端")
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    state = {"processes": [], "client": None}
+
+    @app.on_event("startup")
+    async def startup():
+        if spawn:
+            state["processes"] = start_workers(router)
+        await wait_for_workers(router)
+        state["client"] = httpx.AsyncClient(timeout=PROXY_TIMEOUT)
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        if state["client"] is not None:
+            await state["client"].aclose()
+        for process in state["processes"]:
+            process.terminate()
+        for process in state["processes"]:
+            process.wait()
+
+    @app.websocket("/ws/game/{game_id}/player/{player_id}")
+    async def proxy_websocket(websocket: WebSocket, game_id: int, player_id: int):
+        worker = router.worker_for(game_id)
+        upstream_url = f"{router.ws_url(worker)}/ws/game/{game_id}/player/{player_id}"
+        await websocket.accept()
+        try:
+            async with websockets.connect(upstream_url, max_size=None) as upstream:
+                await _pump(websocket, upstream)
+        except (OSError, websockets.WebSocketException) as e:
+            print(f"转发 WebSocket 失败（游戏 {game_id} → worker {worker}）: {e!r}")
+        finally:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    async def proxy_http(request: Request, path: str):
+        match = GAME_PATH.match(request.url.path)
+        worker = router.worker_for(int(match.group(1)) if match else None)
+        upstream = await state["client"].request(
+            request.method,
+            router.http_url(worker) + request.url.path,
+            params=request.query_params,
+            headers={k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS},
+            content=await request.body(),
+        )
+        return Response(
+            content=upstream.content,
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS},
+        )
+
+    return app
+
+
+async def _pump(websocket: WebSocket, upstream) -> None:
+    """双向转发文本帧，任一方向结束时关闭另一方向"""
+    async def client_to_upstream():
+        try:
+            while True:
+                await upstream.send(await websocket.receive_text())
+        except WebSocketDisconnect:
+            pass
+
+    async def upstream_to_client():
+        async for message in upstream:
+            await websocket.send_text(message)
+
+    tasks = [asyncio.ensure_future(client_to_upstream()), asyncio.ensure_future(upstream_to_client())]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        if task.exception() is not None and not isinstance(task.exception(), websockets.ConnectionClosed):
+            raise task.exception()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="按 game_id 分片的前端代理")
+    parser.add_argument("--workers", type=int, default=SHARD_WORKERS, help="后端 worker 数")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--base-port", type=int, default=SHARD_BASE_PORT, help="worker 端口起点（依次 +1）")
+    args = parser.parse_args()
+
+    router = ShardRouter(args.workers, args.base_port)
+    uvicorn.run(create_proxy_app(router), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+房间分片：用一致性哈希把 game_id 固定映射到 K 个 worker 之一（见 app.shard_proxy）。
+
+worker 进程通过环境变量 SHARD=i/K 得知自己的分片号，启动恢复时只重建归自己的房间。
+"""
+import bisect
+import hashlib
+import os
+from typing import List, Optional, Tuple
+
+SHARD_REPLICAS = 100  # 每个 worker 在环上的虚拟节点数
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环：增减 worker 时只有约 1/K 的房间换到别的 worker"""
+
+    def __init__(self, nodes: List[int], replicas: int = SHARD_REPLICAS):
+        if not nodes:
+            raise ValueError("至少需要一个 worker")
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, game_id: int) -> int:
+        index = bisect.bisect(self._keys, _hash(str(game_id))) % len(self._keys)
+        return self._nodes[index]
+
+
+def parse_shard(spec: Optional[str]) -> Optional[Tuple[int, int]]:
+    """解析 "i/K"，未设置时返回 None（不分片）"""
+    if not spec:
+        return None
+    index, _, count = spec.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"分片号应在 0..{count - 1} 之间: {spec}")
+    return index, count
+
+
+SHARD = parse_shard(os.environ.get("SHARD"))
+_ring: Optional[HashRing] = HashRing(list(range(SHARD[1]))) if SHARD else None
+
+
+def owns_game(game_id: int) -> bool:
+    """本进程是否负责该房间（未分片时负责全部房间）"""
+    if SHARD is None:
+        return True
+    return _ring.node_for(game_id) == SHARD[0]
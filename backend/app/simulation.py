@@ -0,0 +1,522 @@
+"""
+纯内存蒙特卡洛模拟：不经过数据库，用 [games, players] 数组一次推进整批对局。
+完整执行 15 轮 3 阶段规则（含 Phase 3 投票识破与投票者平分罚没质押），
+仅在需要导出时才把结果写成 Game / GamePlayer / GameRound / GameVote 行。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import reduce
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Game, GamePlayer, GameRound, GameVote
+from app.game_logic import GameRules, DEFAULT_RULES
+from app.game_logic_np import (
+    VERIFIED_NONE, VERIFIED_CAUGHT, VERIFIED_PASSED,
+    calculate_earnings_array, final_settlement_array,
+    resolve_round_array, settle_phase3_array,
+)
+from app.strategies import DEFAULT_POPULATION, Population, RoundView
+
+TOTAL_ROUNDS = 15
+DEFAULT_CHUNK_SIZE = 2048
+
+
+def phase_of_round(round_number: int) -> int:
+    """第 1–5 轮 Phase 1，6–10 轮 Phase 2，11–15 轮 Phase 3"""
+    return 1 if round_number <= 5 else (2 if round_number <= 10 else 3)
+
+
+@dataclass
+class SimulationResult:
+    """
+    一批模拟对局的结果。每局一行，玩家按座位排列；人数不足 players 维度的座位 active=False。
+    history 仅在 record=True 时存在：{字段: [rounds, games, players] 数组}，用于导出。
+    """
+    active: np.ndarray            # [G, P] bool
+    nt_before_settlement: np.ndarray  # [G, P] 15 轮结束时的 NT
+    final_env: np.ndarray         # [G, P]
+    final_nt: np.ndarray          # [G, P] 生态值折算后的最终 NT
+    is_winner: np.ndarray         # [G, P] 生态值最高者
+    organic_rounds: np.ndarray    # [G, P] 选择有机肥的轮数
+    strategy: np.ndarray          # [G, P] 座位所用策略在 Population.strategies 中的下标
+    phase2_cheat_applications: np.ndarray  # [G] Phase 2 无机肥申领补贴次数
+    phase2_caught: np.ndarray              # [G] Phase 2 被系统识破次数
+    phase3_cheat_applications: np.ndarray  # [G] Phase 3 无机肥申领补贴次数
+    phase3_vote_caught: np.ndarray         # [G] Phase 3 被投票识破次数
+    phase3_system_caught: np.ndarray       # [G] Phase 3 被系统识破次数
+    history: Optional[Dict[str, np.ndarray]] = field(default=None, repr=False)
+
+    @property
+    def num_games(self) -> int:
+        return self.active.shape[0]
+
+    @property
+    def num_players(self) -> np.ndarray:
+        return self.active.sum(axis=1)
+
+    @classmethod
+    def concat(cls, results: List["SimulationResult"]) -> "SimulationResult":
+        """按顺序拼接多批结果；玩家维度不同时以空座位补齐"""
+        width = max(r.active.shape[1] for r in results)
+
+        def pad(a: np.ndarray, axis: int) -> np.ndarray:
+            extra = width - a.shape[axis]
+            if extra == 0:
+                return a
+            widths = [(0, 0)] * a.ndim
+            widths[axis] = (0, extra)
+            return np.pad(a, widths)
+
+        kwargs = {}
+        for name in cls.__dataclass_fields__:
+            values = [getattr(r, name) for r in results]
+            if name == "history":
+                if any(v is None for v in values):
+                    kwargs[name] = None
+                else:
+                    kwargs[name] = {
+                        key: np.concatenate([pad(v[key], 2) for v in values], axis=1)
+                        for key in values[0]
+                    }
+            elif values[0].ndim == 2:
+                kwargs[name] = np.concatenate([pad(v, 1) for v in values])
+            else:
+                kwargs[name] = np.concatenate(values)
+        return cls(**kwargs)
+
+
+def resolve_votes(rng: np.random.Generator, vote_target: np.ndarray):
+    """
+    统计得票并选出每局得票最高者（平票时等概率随机）。
+
+    Returns:
+        (counts [G, P] 每个座位得票数, top [G] 得票最高者座位号，无人得票为 -1)
+    """
+    games, players = vote_target.shape
+    voted = vote_target >= 0
+    flat = (np.arange(games)[:, None] * players + vote_target)[voted]
+    counts = np.bincount(flat, minlength=games * players).reshape(games, players)
+    max_votes = counts.max(axis=1)
+    candidates = (counts == max_votes[:, None]) & (max_votes[:, None] > 0)
+    keys = np.where(candidates, rng.random(counts.shape), -1.0)
+    top = np.where(max_votes > 0, keys.argmax(axis=1), -1)
+    return counts, top
+
+
+def simulate_chunk(num_players: np.ndarray, rng: np.random.Generator, record: bool = False,
+                   rules: GameRules = DEFAULT_RULES,
+                   population: Population = DEFAULT_POPULATION) -> SimulationResult:
+    """
+    模拟一批对局（向量化推进 15 轮）。
+
+    Args:
+        num_players: [G] 每局人数
+        rng: 随机源；同一 rng 状态与人数序列总能得到相同结果
+        record: 是否保留逐轮明细（导出时需要）
+        rules: 数值规则
+        population: 玩家策略构成，默认全部随机
+    """
+    num_players = np.asarray(num_players, dtype=np.int64)
+    games, width = len(num_players), int(num_players.max())
+    rows = np.arange(games)
+    active = np.arange(width)[None, :] < num_players[:, None]
+
+    nt = np.where(active, rules.initial_nt, 0.0)
+    env = np.where(active, rules.initial_env, 0.0)
+    strategy = population.assign(rng, active)
+    prev_env, prev_organic = env, np.ones((games, width), dtype=bool)
+    organic_rounds = np.zeros((games, width), dtype=np.int16)
+    phase2_cheats = np.zeros(games, dtype=np.int64)
+    phase2_caught = np.zeros(games, dtype=np.int64)
+    phase3_cheats = np.zeros(games, dtype=np.int64)
+    phase3_vote_caught = np.zeros(games, dtype=np.int64)
+    phase3_system_caught = np.zeros(games, dtype=np.int64)
+    history = {key: [] for key in (
+        "organic", "applied", "verified", "nt_before", "nt_after",
+        "env_before", "env_after", "earned", "vote_target", "vote_caught",
+    )} if record else None
+
+    for round_number in range(1, TOTAL_ROUNDS + 1):
+        phase = phase_of_round(round_number)
+        view = RoundView(round_number, phase, active, nt, env, prev_env, prev_organic, rules)
+        organic, applied = population.decide(strategy, view, rng)
+        applied = applied & active
+        out = resolve_round_array(organic, applied, nt, env, phase, rng=rng, active=active, rules=rules)
+        nt_before, env_before = nt, env
+        nt, env = out["nt_after"], out["env_after"]
+        earned, verified = out["earnings"], out["subsidy_verified"]
+        recorded_nt_after = nt
+        vote_target = np.full((games, width), -1, dtype=np.int64)
+        vote_caught = np.zeros((games, width), dtype=bool)
+        organic_rounds += organic & active
+        cheats = (applied & ~organic).sum(axis=1)
+
+        if phase == 2:
+            phase2_cheats += cheats
+            phase2_caught += (verified == VERIFIED_CAUGHT).sum(axis=1)
+        elif phase == 3:
+            phase3_cheats += cheats
+            vote_view = RoundView(round_number, phase, active, nt, env, env_before, organic, rules, applied)
+            vote_target = population.vote(strategy, vote_view, rng)
+            counts, top = resolve_votes(rng, vote_target)
+            has_top = top >= 0
+            top_seat = np.maximum(top, 0)
+            top_cheated = has_top & applied[rows, top_seat] & ~organic[rows, top_seat]
+            # 被投票核查：作弊则识破并失去本轮基础收益，否则记为通过
+            verified = verified.copy()
+            verified[rows[has_top], top_seat[has_top]] = np.where(top_cheated[has_top], VERIFIED_CAUGHT, VERIFIED_PASSED)
+            base_earnings = calculate_earnings_array(np.zeros(games, dtype=bool), env_before[rows, top_seat], rules)
+            nt = nt.copy()
+            earned = earned.copy()
+            nt[rows[top_cheated], top_seat[top_cheated]] -= base_earnings[top_cheated]
+            earned[rows[top_cheated], top_seat[top_cheated]] = -rules.phase3_subsidy
+            # 投票者平分罚没的质押
+            voters = top_cheated[:, None] & (vote_target == top[:, None])
+            reward = rules.phase3_subsidy / np.maximum(counts[rows, top_seat], 1)
+            nt = np.where(voters, nt + reward[:, None], nt)
+            phase3_vote_caught += top_cheated
+            vote_caught[rows[top_cheated], top_seat[top_cheated]] = True
+            # 其余申请者：系统识破 + 补贴结算
+            settled = settle_phase3_array(organic, applied, env_before, earned, verified, rng=rng, rules=rules)
+            nt = nt + settled["nt_delta"]
+            earned, verified = settled["round_nt_earned"], settled["subsidy_verified"]
+            phase3_system_caught += settled["system_caught"].sum(axis=1)
+
+        if record:
+            for key, value in (
+                ("organic", organic), ("applied", applied), ("verified", verified),
+                ("nt_before", nt_before), ("nt_after", recorded_nt_after),
+                ("env_before", env_before), ("env_after", env),
+                ("earned", earned), ("vote_target", vote_target), ("vote_caught", vote_caught),
+            ):
+                history[key].append(value)
+        prev_env, prev_organic = env_before, organic
+
+    max_env = np.where(active, env, -np.inf).max(axis=1, keepdims=True)
+    return SimulationResult(
+        active=active,
+        nt_before_settlement=np.where(active, nt, 0.0),
+        final_env=np.where(active, env, 0.0),
+        final_nt=np.where(active, final_settlement_array(nt, env, rules), 0.0),
+        is_winner=active & (env == max_env),
+        organic_rounds=organic_rounds,
+        strategy=strategy,
+        phase2_cheat_applications=phase2_cheats,
+        phase2_caught=phase2_caught,
+        phase3_cheat_applications=phase3_cheats,
+        phase3_vote_caught=phase3_vote_caught,
+        phase3_system_caught=phase3_system_caught,
+        history={key: np.stack(values) for key, values in history.items()} if record else None,
+    )
+
+
+def chunk_seeds(num_games: int, seed=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    把 num_games 局按 chunk_size 切成固定的批次，每批从主种子派生一个独立的 SeedSequence。
+    批次划分只取决于局数与批大小，与进程数无关，因此结果只由主种子决定。
+
+    Returns:
+        [(本批局数, SeedSequence), ...]
+    """
+    if num_games < 1:
+        raise ValueError(f"模拟局数至少为 1，收到 {num_games}")
+    sizes = [min(chunk_size, num_games - start) for start in range(0, num_games, chunk_size)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def _simulate_seeded_chunk(size: int, seed_seq: np.random.SeedSequence, min_players: int, max_players: int,
+                           record: bool, rules: GameRules,
+                           population: Population = DEFAULT_POPULATION) -> SimulationResult:
+    rng = np.random.default_rng(seed_seq)
+    num_players = rng.integers(min_players, max_players + 1, size=size)
+    return simulate_chunk(num_players, rng, record=record, rules=rules, population=population)
+
+
+def simulate_games(
+    num_games: int,
+    min_players: int = 20,
+    max_players: int = 30,
+    seed=None,
+    record: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rules: GameRules = DEFAULT_RULES,
+    population: Population = DEFAULT_POPULATION,
+) -> SimulationResult:
+    """
+    模拟 num_games 局，每局人数在 [min_players, max_players] 内随机。
+    对局按 chunk_size 分批推进，内存占用与批大小成正比。
+    """
+    results = [
+        _simulate_seeded_chunk(size, seed_seq, min_players, max_players, record, rules, population)
+        for size, seed_seq in chunk_seeds(num_games, seed, chunk_size)
+    ]
+    return SimulationResult.concat(results)
+
+
+@dataclass
+class SimulationSummary:
+    """
+    可合并的模拟统计量：最终 NT / ENV 的均值与方差（按 Chan 并行算法合并）、
+    获胜者分布与各阶段识破次数。按固定顺序合并时结果逐比特一致。
+    """
+    games: int
+    players: int
+    nt_mean: float
+    nt_m2: float                              # 最终 NT 离均差平方和
+    env_mean: float
+    env_m2: float
+    winners_per_game: np.ndarray              # [k] 每局获胜人数为 k 的局数
+    winners_by_organic_rounds: np.ndarray     # [16] 有机肥轮数为 k 的获胜者人数
+    players_by_organic_rounds: np.ndarray     # [16] 有机肥轮数为 k 的玩家人数
+    nt_sum_by_organic_rounds: np.ndarray      # [16] 有机肥轮数为 k 的玩家最终 NT 之和
+    players_by_strategy: np.ndarray           # [S] 使用第 s 个策略的玩家人数
+    winners_by_strategy: np.ndarray           # [S] 使用第 s 个策略的获胜者人数
+    nt_sum_by_strategy: np.ndarray            # [S] 使用第 s 个策略的玩家最终 NT 之和
+    phase2_cheat_applications: int
+    phase2_caught: int
+    phase3_cheat_applications: int
+    phase3_vote_caught: int
+    phase3_system_caught: int
+
+    @classmethod
+    def from_result(cls, result: SimulationResult, num_strategies: int) -> "SimulationSummary":
+        """num_strategies 取 len(Population.strategies)，按策略的统计长度固定，与是否有人抽到无关"""
+        active = result.active
+        final_nt = result.final_nt[active]
+        final_env = result.final_env[active]
+        organic_rounds = result.organic_rounds[active]
+        strategy = result.strategy[active]
+        return cls(
+            games=result.num_games,
+            players=int(active.sum()),
+            nt_mean=float(final_nt.mean()),
+            nt_m2=float(((final_nt - final_nt.mean()) ** 2).sum()),
+            env_mean=float(final_env.mean()),
+            env_m2=float(((final_env - final_env.mean()) ** 2).sum()),
+            winners_per_game=np.bincount(result.is_winner.sum(axis=1)),
+            winners_by_organic_rounds=np.bincount(
+                result.organic_rounds[result.is_winner], minlength=TOTAL_ROUNDS + 1),
+            players_by_organic_rounds=np.bincount(organic_rounds, minlength=TOTAL_ROUNDS + 1),
+            nt_sum_by_organic_rounds=np.bincount(organic_rounds, weights=final_nt, minlength=TOTAL_ROUNDS + 1),
+            players_by_strategy=np.bincount(strategy, minlength=num_strategies),
+            winners_by_strategy=np.bincount(result.strategy[result.is_winner], minlength=num_strategies),
+            nt_sum_by_strategy=np.bincount(strategy, weights=final_nt, minlength=num_strategies),
+            phase2_cheat_applications=int(result.phase2_cheat_applications.sum()),
+            phase2_caught=int(result.phase2_caught.sum()),
+            phase3_cheat_applications=int(result.phase3_cheat_applications.sum()),
+            phase3_vote_caught=int(result.phase3_vote_caught.sum()),
+            phase3_system_caught=int(result.phase3_system_caught.sum()),
+        )
+
+    def merge(self, other: "SimulationSummary") -> "SimulationSummary":
+        def merge_moments(mean_a, m2_a, mean_b, m2_b):
+            n_a, n_b = self.players, other.players
+            n = n_a + n_b
+            delta = mean_b - mean_a
+            return mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+        def add_hist(a, b):
+            out = np.zeros(max(len(a), len(b)), dtype=np.result_type(a, b))
+            out[:len(a)] += a
+            out[:len(b)] += b
+            return out
+
+        nt_mean, nt_m2 = merge_moments(self.nt_mean, self.nt_m2, other.nt_mean, other.nt_m2)
+        env_mean, env_m2 = merge_moments(self.env_mean, self.env_m2, other.env_mean, other.env_m2)
+        return SimulationSummary(
+            games=self.games + other.games,
+            players=self.players + other.players,
+            nt_mean=nt_mean,
+            nt_m2=nt_m2,
+            env_mean=env_mean,
+            env_m2=env_m2,
+            winners_per_game=add_hist(self.winners_per_game, other.winners_per_game),
+            winners_by_organic_rounds=self.winners_by_organic_rounds + other.winners_by_organic_rounds,
+            players_by_organic_rounds=self.players_by_organic_rounds + other.players_by_organic_rounds,
+            nt_sum_by_organic_rounds=self.nt_sum_by_organic_rounds + other.nt_sum_by_organic_rounds,
+            players_by_strategy=add_hist(self.players_by_strategy, other.players_by_strategy),
+            winners_by_strategy=add_hist(self.winners_by_strategy, other.winners_by_strategy),
+            nt_sum_by_strategy=add_hist(self.nt_sum_by_strategy, other.nt_sum_by_strategy),
+            phase2_cheat_applications=self.phase2_cheat_applications + other.phase2_cheat_applications,
+            phase2_caught=self.phase2_caught + other.phase2_caught,
+            phase3_cheat_applications=self.phase3_cheat_applications + other.phase3_cheat_applications,
+            phase3_vote_caught=self.phase3_vote_caught + other.phase3_vote_caught,
+            phase3_system_caught=self.phase3_system_caught + other.phase3_system_caught,
+        )
+
+    @property
+    def nt_var(self) -> float:
+        return self.nt_m2 / self.players
+
+    @property
+    def env_var(self) -> float:
+        return self.env_m2 / self.players
+
+    @property
+    def win_rate_by_organic_rounds(self) -> np.ndarray:
+        """有机肥轮数为 k 的玩家中获胜者的比例（无此类玩家为 nan）"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.winners_by_organic_rounds / self.players_by_organic_rounds
+
+    @property
+    def nt_mean_by_organic_rounds(self) -> np.ndarray:
+        """有机肥轮数为 k 的玩家的平均最终 NT（无此类玩家为 nan）"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.nt_sum_by_organic_rounds / self.players_by_organic_rounds
+
+    @property
+    def win_rate_by_strategy(self) -> np.ndarray:
+        """各策略玩家中获胜者的比例（下标同 Population.strategies）"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.winners_by_strategy / self.players_by_strategy
+
+    @property
+    def nt_mean_by_strategy(self) -> np.ndarray:
+        """各策略玩家的平均最终 NT"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.nt_sum_by_strategy / self.players_by_strategy
+
+    @property
+    def phase2_catch_rate(self) -> float:
+        return self.phase2_caught / self.phase2_cheat_applications if self.phase2_cheat_applications else 0.0
+
+    @property
+    def phase3_vote_catch_rate(self) -> float:
+        return self.phase3_vote_caught / self.phase3_cheat_applications if self.phase3_cheat_applications else 0.0
+
+    @property
+    def phase3_system_catch_rate(self) -> float:
+        return self.phase3_system_caught / self.phase3_cheat_applications if self.phase3_cheat_applications else 0.0
+
+
+def summarize_seeded_chunk(size: int, seed_seq: np.random.SeedSequence, min_players: int, max_players: int,
+                            rules: GameRules,
+                            population: Population = DEFAULT_POPULATION) -> SimulationSummary:
+    """进程池任务：模拟一批并只返回统计量，避免回传大数组"""
+    return SimulationSummary.from_result(
+        _simulate_seeded_chunk(size, seed_seq, min_players, max_players, False, rules, population),
+        len(population.strategies))
+
+
+def simulate_summary(
+    num_games: int,
+    min_players: int = 20,
+    max_players: int = 30,
+    seed=None,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rules: GameRules = DEFAULT_RULES,
+    population: Population = DEFAULT_POPULATION,
+) -> SimulationSummary:
+    """
+    模拟 num_games 局并返回合并后的统计量。workers > 1 时各批次分发到 ProcessPoolExecutor，
+    每批使用从主种子派生的独立种子，按批次顺序合并，结果与 workers 取值无关。
+    """
+    chunks = chunk_seeds(num_games, seed, chunk_size)
+    args = (
+        [size for size, _ in chunks],
+        [seed_seq for _, seed_seq in chunks],
+        [min_players] * len(chunks),
+        [max_players] * len(chunks),
+        [rules] * len(chunks),
+        [population] * len(chunks),
+    )
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = list(pool.map(summarize_seeded_chunk, *args))
+    else:
+        summaries = list(map(summarize_seeded_chunk, *args))
+    return reduce(SimulationSummary.merge, summaries)
+
+
+def materialize_to_db(db: Session, result: SimulationResult, rules: GameRules = DEFAULT_RULES) -> List[int]:
+    """
+    将模拟结果写成 Game / GamePlayer / GameRound / GameVote 行（批量插入），供 Excel 导出复用。
+    需要 simulate_* 时 record=True。
+
+    Returns:
+        新建的 game_id 列表（与模拟对局顺序一致）
+    """
+    if result.history is None:
+        raise ValueError("模拟结果没有逐轮明细，请使用 record=True 重新模拟")
+    h = result.history
+    next_game_id = (db.query(func.max(Game.id)).scalar() or 0) + 1
+    next_player_id = (db.query(func.max(GamePlayer.id)).scalar() or 0) + 1
+    now = datetime.utcnow()
+    games, players, rounds, votes = [], [], [], []
+    game_ids = []
+    verified_values = {VERIFIED_NONE: None, VERIFIED_CAUGHT: False, VERIFIED_PASSED: True}
+
+    def caught_by(r: int, g: int, seat: int) -> Optional[str]:
+        """识破途径：Phase 3 被投票核查识破记为 vote，其余识破（Phase 2 / Phase 3 系统核查）记为 system"""
+        if h["verified"][r, g, seat] != VERIFIED_CAUGHT:
+            return None
+        return "vote" if h["vote_caught"][r, g, seat] else "system"
+
+    for g in range(result.num_games):
+        game_id = next_game_id + g
+        game_ids.append(game_id)
+        seats = np.flatnonzero(result.active[g])
+        player_ids = {int(s): next_player_id + i for i, s in enumerate(seats)}
+        next_player_id += len(seats)
+        games.append({
+            "id": game_id,
+            "game_code": f"SIM{game_id:06d}",
+            "creator_id": player_ids[0],
+            "status": "finished",
+            "current_round": TOTAL_ROUNDS,
+            "phase": 3,
+            "created_at": now,
+            "finished_at": now,
+        })
+        for seat, pid in player_ids.items():
+            players.append({
+                "id": pid,
+                "game_id": game_id,
+                "user_id": None,
+                "username": f"测试玩家{seat + 1}",
+                "initial_nt": rules.initial_nt,
+                "current_nt": float(result.nt_before_settlement[g, seat]),
+                "current_env": float(result.final_env[g, seat]),
+                "final_nt": float(result.final_nt[g, seat]),
+                "final_env": float(result.final_env[g, seat]),
+                "is_winner": bool(result.is_winner[g, seat]),
+            })
+            for r in range(TOTAL_ROUNDS):
+                round_number = r + 1
+                phase = phase_of_round(round_number)
+                rounds.append({
+                    "game_id": game_id,
+                    "round_number": round_number,
+                    "phase": phase,
+                    "player_id": pid,
+                    "choice": "organic" if h["organic"][r, g, seat] else "inorganic",
+                    "applied_subsidy": bool(h["applied"][r, g, seat]),
+                    "subsidy_verified": verified_values[int(h["verified"][r, g, seat])],
+                    "votes_received": 0,
+                    "caught_by": caught_by(r, g, seat),
+                    "nt_before": float(h["nt_before"][r, g, seat]),
+                    "nt_after": float(h["nt_after"][r, g, seat]),
+                    "env_before": float(h["env_before"][r, g, seat]),
+                    "env_after": float(h["env_after"][r, g, seat]),
+                    "round_nt_earned": float(h["earned"][r, g, seat]),
+                })
+                if phase == 3:
+                    target = int(h["vote_target"][r, g, seat])
+                    votes.append({
+                        "game_id": game_id,
+                        "round_number": round_number,
+                        "voter_id": pid,
+                        "target_id": player_ids[target] if target >= 0 else None,
+                    })
+
+    db.bulk_insert_mappings(Game, games)
+    db.bulk_insert_mappings(GamePlayer, players)
+    db.bulk_insert_mappings(GameRound, rounds)
+    db.bulk_insert_mappings(GameVote, votes)
+    db.commit()
+    return game_ids
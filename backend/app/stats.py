@@ -0,0 +1,272 @@
+"""
+跨局汇总统计（/api/stats）
+
+汇总表（models.StatsRound / StatsGame）按对局结束日期累计，游戏结束时在结算事务中用一条
+INSERT ... SELECT ... ON CONFLICT DO UPDATE 把该局的轮次记录与玩家结果加到对应日期上（accumulate_game），
+接口只读汇总表（每天最多 15 + 1 行），不扫描 game_rounds。迁移（版本 4）用同样的语句从已结束的对局重建汇总表。
+
+- 每 (阶段, 轮次)：有机肥占比、补贴申请率、系统 / 投票识破率（分母为使用无机肥并申请补贴的人次，
+  与 simulation 中的 catch_rate 一致）、轮末 NT / ENV 分布；
+  game_rounds.nt_after 是本轮基础结算后、投票结算前的余额，Phase 3 的轮末 NT 另取投票结算后的余额
+  （即下一轮的 nt_before，最后一轮取玩家的 current_nt），包含投票罚没、投票奖励与补贴返还；
+- 每局：局数、玩家数、获胜者数、最终 NT / ENV 分布；分布为均值、标准差（总体）、最小、最大值。
+
+读取在独立的统计线程中进行，不占用数据库写线程（app.db_executor），同一日期范围的结果缓存
+STATS_CACHE_SECONDS 秒，多个看板同时轮询也只读一次；WAL 模式下读事务不阻塞写入。
+"""
+import asyncio
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app.models import SessionLocal, StatsRound, StatsGame
+
+STATS_CACHE_SECONDS = float(os.environ.get("STATS_CACHE_SECONDS", "5"))
+STATS_CACHE_KEEP = 64
+
+# 对局所属日期：结束时间（旧数据没有结束时间时取创建时间），与列式导出的时间范围一致
+_GAME_DAY = "date(coalesce(g.finished_at, g.created_at))"
+
+# 轮末 NT：Phase 3 取投票结算后的余额（见模块说明），其他阶段即 nt_after
+_SETTLED_NT = """CASE WHEN r.phase = 3 THEN coalesce(
+        (SELECT n.nt_before FROM game_rounds n
+         WHERE n.game_id = r.game_id AND n.player_id = r.player_id AND n.round_number = r.round_number + 1
+         ORDER BY n.id LIMIT 1),
+        (SELECT p.current_nt FROM game_players p WHERE p.id = r.player_id AND r.round_number = g.current_round),
+        r.nt_after
+    ) ELSE r.nt_after END"""
+
+
+def _upsert_sql(table: str, keys: List[str], columns: List[str], select: str) -> str:
+    """累加型 upsert：计数与和相加，*_min / *_max 取较小 / 较大值，phase 直接覆盖"""
+    updates = []
+    for column in columns:
+        if column == "phase":
+            updates.append(f"{column} = excluded.{column}")
+        elif column.endswith("_min"):
+            updates.append(f"{column} = min({column}, excluded.{column})")
+        elif column.endswith("_max"):
+            updates.append(f"{column} = max({column}, excluded.{column})")
+        else:
+            updates.append(f"{column} = {column} + excluded.{column}")
+    return (
+        f"INSERT INTO {table} ({', '.join(keys + columns)}) {select} "
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(updates)}"
+    )
+
+
+ROUND_STATS_SQL = _upsert_sql(
+    StatsRound.__tablename__,
+    ["day", "round_number"],
+    [
+        "phase", "games", "player_rounds", "organic", "subsidy_applied", "cheat_applied",
+        "caught_system", "caught_vote",
+        "nt_sum", "nt_sq_sum", "nt_min", "nt_max", "env_sum", "env_sq_sum", "env_min", "env_max",
+    ],
+    f"""
+    SELECT day, round_number, max(phase), count(DISTINCT game_id), count(*),
+        count(CASE WHEN choice = 'organic' THEN 1 END),
+        count(CASE WHEN applied_subsidy THEN 1 END),
+        count(CASE WHEN choice = 'inorganic' AND applied_subsidy THEN 1 END),
+        count(CASE WHEN caught_by = 'system' THEN 1 END),
+        count(CASE WHEN caught_by = 'vote' THEN 1 END),
+        sum(nt), sum(nt * nt), min(nt), max(nt),
+        sum(env_after), sum(env_after * env_after), min(env_after), max(env_after)
+    FROM (
+        SELECT {_GAME_DAY} AS day, r.round_number, r.phase, r.game_id, r.choice, r.applied_subsidy, r.caught_by,
+            {_SETTLED_NT} AS nt, r.env_after
+        FROM game_rounds r JOIN games g ON g.id = r.game_id
+        WHERE {{where}}
+    )
+    GROUP BY day, round_number
+    """,
+)
+
+GAME_STATS_SQL = _upsert_sql(
+    StatsGame.__tablename__,
+    ["day"],
+    [
+        "games", "players", "winners",
+        "final_nt_sum", "final_nt_sq_sum", "final_nt_min", "final_nt_max",
+        "final_env_sum", "final_env_sq_sum", "final_env_min", "final_env_max",
+    ],
+    f"""
+    SELECT {_GAME_DAY}, count(DISTINCT g.id), count(*), count(CASE WHEN p.is_winner THEN 1 END),
+        sum(nt), sum(nt * nt), min(nt), max(nt), sum(env), sum(env * env), min(env), max(env)
+    FROM games g JOIN (
+        SELECT game_id, is_winner, coalesce(final_nt, current_nt) AS nt, coalesce(final_env, current_env) AS env
+        FROM game_players
+    ) p ON p.game_id = g.id
+    WHERE {{where}}
+    GROUP BY 1
+    """,
+)
+
+
+def accumulate_game(db: Session, game_id: int) -> None:
+    """把刚结束的一局加入汇总表（不提交，由调用方在结算事务中 commit；每局只能调用一次）"""
+    params = {"game_id": game_id}
+    db.execute(text(ROUND_STATS_SQL.format(where="g.id = :game_id")), params)
+    db.execute(text(GAME_STATS_SQL.format(where="g.id = :game_id")), params)
+
+
+def rebuild_stats(conn: sqlite3.Connection) -> None:
+    """清空并按所有已结束的对局重建汇总表（迁移中使用，可重复执行）"""
+    conn.execute(f"DELETE FROM {StatsRound.__tablename__}")
+    conn.execute(f"DELETE FROM {StatsGame.__tablename__}")
+    conn.execute(ROUND_STATS_SQL.format(where="g.status = 'finished'"))
+    conn.execute(GAME_STATS_SQL.format(where="g.status = 'finished'"))
+
+
+def _rate(count: int, total: int) -> Optional[float]:
+    return count / total if total else None
+
+
+def _distribution(n: int, total: float, sq_total: float, lo: Optional[float], hi: Optional[float]) -> Optional[dict]:
+    if not n:
+        return None
+    mean = total / n
+    return {
+        "mean": mean,
+        "std": math.sqrt(max(sq_total / n - mean * mean, 0.0)),
+        "min": lo,
+        "max": hi,
+    }
+
+
+def _round_summary(c: dict) -> dict:
+    return {
+        "player_rounds": c["player_rounds"],
+        "organic_share": _rate(c["organic"], c["player_rounds"]),
+        "subsidy_applications": c["subsidy_applied"],
+        "subsidy_application_rate": _rate(c["subsidy_applied"], c["player_rounds"]),
+        "cheat_applications": c["cheat_applied"],
+        "caught_system": c["caught_system"],
+        "caught_vote": c["caught_vote"],
+        "system_catch_rate": _rate(c["caught_system"], c["cheat_applied"]),
+        "vote_catch_rate": _rate(c["caught_vote"], c["cheat_applied"]),
+        "nt": _distribution(c["player_rounds"], c["nt_sum"], c["nt_sq_sum"], c["nt_min"], c["nt_max"]),
+        "env": _distribution(c["player_rounds"], c["env_sum"], c["env_sq_sum"], c["env_min"], c["env_max"]),
+    }
+
+
+_ROUND_COUNTS = [
+    "games", "player_rounds", "organic", "subsidy_applied", "cheat_applied", "caught_system", "caught_vote",
+    "nt_sum", "nt_sq_sum", "env_sum", "env_sq_sum",
+]
+
+
+def load_stats(db: Session, since: Optional[date] = None, until: Optional[date] = None) -> dict:
+    """按结束日期范围 [since, until]（含两端，UTC）读取汇总表"""
+    def in_range(query, model):
+        if since is not None:
+            query = query.filter(model.day >= since.isoformat())
+        if until is not None:
+            query = query.filter(model.day <= until.isoformat())
+        return query
+
+    rounds_query = db.query(
+        StatsRound.round_number, func.max(StatsRound.phase).label("phase"),
+        *[func.sum(getattr(StatsRound, name)).label(name) for name in _ROUND_COUNTS],
+        func.min(StatsRound.nt_min).label("nt_min"), func.max(StatsRound.nt_max).label("nt_max"),
+        func.min(StatsRound.env_min).label("env_min"), func.max(StatsRound.env_max).label("env_max"),
+    )
+    round_rows = in_range(rounds_query, StatsRound).group_by(StatsRound.round_number).order_by(StatsRound.round_number).all()
+
+    game_columns = ["games", "players", "winners", "final_nt_sum", "final_nt_sq_sum", "final_env_sum", "final_env_sq_sum"]
+    games_query = db.query(
+        *[func.coalesce(func.sum(getattr(StatsGame, name)), 0).label(name) for name in game_columns],
+        func.min(StatsGame.final_nt_min).label("final_nt_min"), func.max(StatsGame.final_nt_max).label("final_nt_max"),
+        func.min(StatsGame.final_env_min).label("final_env_min"), func.max(StatsGame.final_env_max).label("final_env_max"),
+    )
+    g = in_range(games_query, StatsGame).one()
+
+    rounds = []
+    phases: Dict[int, dict] = {}
+    for row in round_rows:
+        counts = row._asdict()
+        rounds.append({"round_number": row.round_number, "phase": row.phase, "games": row.games, **_round_summary(counts)})
+        # 阶段汇总：计数相加，最小 / 最大值取极值
+        phase = phases.setdefault(row.phase, {name: 0 for name in _ROUND_COUNTS})
+        for name in _ROUND_COUNTS:
+            phase[name] += counts[name]
+        for name, pick in [("nt_min", min), ("nt_max", max), ("env_min", min), ("env_max", max)]:
+            phase[name] = counts[name] if phase.get(name) is None else pick(phase[name], counts[name])
+
+    return {
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "generated_at": datetime.utcnow().isoformat(),
+        "games": g.games,
+        "players": g.players,
+        "winners": g.winners,
+        "final_nt": _distribution(g.players, g.final_nt_sum, g.final_nt_sq_sum, g.final_nt_min, g.final_nt_max),
+        "final_env": _distribution(g.players, g.final_env_sum, g.final_env_sq_sum, g.final_env_min, g.final_env_max),
+        "phases": [{"phase": number, **_round_summary(phases[number])} for number in sorted(phases)],
+        "rounds": rounds,
+    }
+
+
+def _read_stats(since: Optional[date], until: Optional[date]) -> dict:
+    """在统计线程中执行：独立会话，只读汇总表"""
+    db = SessionLocal()
+    try:
+        return load_stats(db, since, until)
+    finally:
+        db.close()
+
+
+class StatsCache:
+    """统计线程 + 按日期范围缓存的结果；同一范围并发请求共享同一次读取"""
+
+    def __init__(self, ttl: float = STATS_CACHE_SECONDS, keep: int = STATS_CACHE_KEEP):
+        self.ttl = ttl
+        self.keep = keep
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._entries: Dict[Tuple, Tuple[float, asyncio.Future]] = {}  # (since, until) -> (过期时间, 读取任务)
+
+    async def get(self, since: Optional[date] = None, until: Optional[date] = None) -> dict:
+        key = (since, until)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats")
+            loop = asyncio.get_running_loop()
+            entry = (now + self.ttl, loop.run_in_executor(self._executor, _read_stats, since, until))
+            self._entries[key] = entry
+            self._evict(now)
+        try:
+            return await asyncio.shield(entry[1])
+        except Exception:
+            # 失败的结果不缓存
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            raise
+
+    def _evict(self, now: float) -> None:
+        for key, (expires, future) in list(self._entries.items()):
+            if len(self._entries) <= self.keep:
+                break
+            if expires <= now and future.done():
+                del self._entries[key]
+
+    def invalidate(self) -> None:
+        """有对局结束时丢弃缓存，下次请求重新读取（其他 worker 的缓存按 TTL 过期）"""
+        self._entries.clear()
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._entries.clear()
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,202 @@
+"""
+模拟玩家的行为策略。每个策略对整批 [games, players] 座位一次给出决策（向量化），
+模拟器按座位分配的策略把各自的决策拼起来，因此上千名混合策略的玩家也只需几次数组运算。
+
+内置策略：
+- random：与原批量测试相同，选择 / 申领 / 投票全部随机；
+- organic：始终有机肥，Phase 2/3 始终申领补贴，不投票；
+- cheat：始终无机肥，Phase 2/3 始终申领补贴，不投票；
+- tit_for_tat：看上一轮他人对自己生态值的影响，他人整体变好（≥0）就用有机肥并申领补贴，否则无机肥；不投票；
+- vote_richest：选择与申领同 random，投票时投给除自己外 NT 最高的申请者。
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+from app.game_logic import GameRules, DEFAULT_RULES
+
+
+@dataclass
+class RoundView:
+    """
+    策略在一轮中可观察到的信息（均为 [games, players] 数组）。
+    决策时 nt / env 为本轮开始时的值；投票时 nt 为本轮基础结算后的值，applied 为本轮申请补贴者。
+    """
+    round_number: int
+    phase: int
+    active: np.ndarray
+    nt: np.ndarray
+    env: np.ndarray
+    prev_env: np.ndarray                  # 上一轮开始时的 ENV（第 1 轮等于 env）
+    prev_organic: np.ndarray              # 自己上一轮是否选择有机肥（第 1 轮为 True）
+    rules: GameRules = DEFAULT_RULES
+    applied: Optional[np.ndarray] = None
+
+
+class Strategy(ABC):
+    """策略基类：decide 给出选择与是否申领补贴，vote 给出投票对象（座位号，-1 表示谁都不选）"""
+    name = "strategy"
+
+    @abstractmethod
+    def decide(self, view: RoundView, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (organic, applied)：[G, P] 是否选择有机肥、是否申领补贴
+        """
+
+    def vote(self, view: RoundView, rng: np.random.Generator) -> np.ndarray:
+        return np.full(view.active.shape, -1, dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+def _may_apply(view: RoundView) -> np.ndarray:
+    """Phase 2/3 才能申领补贴"""
+    if view.phase >= 2:
+        return view.active.copy()
+    return np.zeros(view.active.shape, dtype=bool)
+
+
+def random_votes(rng: np.random.Generator, active: np.ndarray, applied: np.ndarray) -> np.ndarray:
+    """
+    每位玩家在「谁都不选」+ 全部申请者中等概率选一个。
+
+    Returns:
+        [G, P] 被投票者座位号，-1 表示谁都不选
+    """
+    num_applicants = applied.sum(axis=1, keepdims=True)
+    pick = np.floor(rng.random(active.shape) * (num_applicants + 1)).astype(np.int64)
+    # 每局申请者座位按座位号排在最前
+    applicant_seats = np.argsort(~applied, axis=1, kind="stable")
+    target = np.take_along_axis(applicant_seats, np.maximum(pick - 1, 0), axis=1)
+    return np.where((pick > 0) & active, target, -1)
+
+
+class RandomStrategy(Strategy):
+    name = "random"
+
+    def decide(self, view, rng):
+        organic = rng.random(view.active.shape) < 0.5
+        if view.phase >= 2:
+            apply_subsidy = (rng.random(view.active.shape) < 0.5) & view.active
+        else:
+            apply_subsidy = np.zeros(view.active.shape, dtype=bool)
+        return organic, apply_subsidy
+
+    def vote(self, view, rng):
+        return random_votes(rng, view.active, view.applied)
+
+
+class AlwaysOrganicStrategy(Strategy):
+    name = "organic"
+
+    def decide(self, view, rng):
+        return np.ones(view.active.shape, dtype=bool), _may_apply(view)
+
+
+class AlwaysCheatStrategy(Strategy):
+    name = "cheat"
+
+    def decide(self, view, rng):
+        return np.zeros(view.active.shape, dtype=bool), _may_apply(view)
+
+
+class TitForTatStrategy(Strategy):
+    name = "tit_for_tat"
+
+    def decide(self, view, rng):
+        rules = view.rules
+        own_change = np.where(view.prev_organic, rules.env_self_organic, rules.env_self_inorganic)
+        others_change = view.env - view.prev_env - own_change
+        organic = (view.round_number == 1) | (others_change >= 0)
+        return organic, organic & _may_apply(view)
+
+
+class VoteRichestStrategy(RandomStrategy):
+    name = "vote_richest"
+
+    def vote(self, view, rng):
+        games, players = view.active.shape
+        wealth = np.where(view.applied, view.nt, -np.inf)
+        ranked = np.argsort(-wealth, axis=1, kind="stable")
+        richest, runner_up = ranked[:, 0], ranked[:, min(1, players - 1)]
+        rows = np.arange(games)
+        seats = np.arange(players)[None, :]
+        # 自己是最富的申请者时投给第二富的申请者
+        target = np.where(seats == richest[:, None], runner_up[:, None], richest[:, None])
+        valid = view.applied[rows[:, None], target] & (target != seats) & view.active
+        return np.where(valid, target, -1)
+
+
+STRATEGIES: Dict[str, type] = {
+    cls.name: cls for cls in (
+        RandomStrategy, AlwaysOrganicStrategy, AlwaysCheatStrategy, TitForTatStrategy, VoteRichestStrategy,
+    )
+}
+
+
+@dataclass(frozen=True)
+class Population:
+    """玩家策略构成：每个座位按 weights 独立抽取一个策略"""
+    strategies: Tuple[Strategy, ...] = (RandomStrategy(),)
+    weights: Tuple[float, ...] = (1.0,)
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(s.name for s in self.strategies)
+
+    def assign(self, rng: np.random.Generator, active: np.ndarray) -> np.ndarray:
+        """为每个座位分配策略下标；只有一种策略时不消耗随机数"""
+        if len(self.strategies) == 1:
+            return np.zeros(active.shape, dtype=np.int8)
+        cumulative = np.cumsum(self.weights) / np.sum(self.weights)
+        index = np.searchsorted(cumulative, rng.random(active.shape), side="right")
+        return np.minimum(index, len(self.strategies) - 1).astype(np.int8)
+
+    def decide(self, assignment: np.ndarray, view: RoundView, rng: np.random.Generator):
+        """按座位策略拼出本轮全部选择与申领"""
+        organic = np.zeros(view.active.shape, dtype=bool)
+        apply_subsidy = np.zeros(view.active.shape, dtype=bool)
+        for k, strategy in enumerate(self.strategies):
+            mask = (assignment == k) & view.active
+            if not mask.any():
+                continue
+            o, a = strategy.decide(view, rng)
+            organic = np.where(mask, o, organic)
+            apply_subsidy = np.where(mask, a, apply_subsidy)
+        return organic, apply_subsidy
+
+    def vote(self, assignment: np.ndarray, view: RoundView, rng: np.random.Generator) -> np.ndarray:
+        """按座位策略拼出本轮全部投票"""
+        target = np.full(view.active.shape, -1, dtype=np.int64)
+        for k, strategy in enumerate(self.strategies):
+            mask = (assignment == k) & view.active
+            if not mask.any():
+                continue
+            target = np.where(mask, strategy.vote(view, rng), target)
+        return target
+
+
+DEFAULT_POPULATION = Population()
+
+
+def parse_population(spec: str) -> Population:
+    """
+    解析策略构成，如 "random=0.5,organic=0.2,cheat=0.3"；省略权重时记为 1。
+    """
+    strategies, weights = [], []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in STRATEGIES:
+            raise ValueError(f"未知策略: {name}（可选：{', '.join(STRATEGIES)}）")
+        strategies.append(STRATEGIES[name]())
+        weights.append(float(weight) if weight else 1.0)
+    if not strategies:
+        raise ValueError("策略构成不能为空")
+    return Population(tuple(strategies), tuple(weights))
@@ -0,0 +1,110 @@
+"""
+数值参数扫描：在一组 GameRules 上批量模拟，比较不同数值设计拉开玩家差距的效果。
+每套规则使用同一组对局种子（共同随机数），差异只来自数值本身；
+结果按列存为压缩 .npz，每套规则一行。
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from functools import reduce
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+from app.game_logic import GameRules, DEFAULT_RULES
+from app.simulation import (
+    DEFAULT_CHUNK_SIZE, SimulationSummary, chunk_seeds, summarize_seeded_chunk,
+)
+from app.strategies import DEFAULT_POPULATION, Population
+
+RULE_FIELDS = tuple(f.name for f in fields(GameRules))
+
+
+def _check_fields(names) -> None:
+    unknown = [name for name in names if name not in RULE_FIELDS]
+    if unknown:
+        raise ValueError(f"未知的规则参数: {', '.join(unknown)}")
+
+
+def grid_rules(grid: Dict[str, Sequence[float]], base: GameRules = DEFAULT_RULES) -> List[GameRules]:
+    """网格扫描：grid 中各参数取值的笛卡尔积，未列出的参数沿用 base"""
+    _check_fields(grid)
+    names = list(grid)
+    return [base.replace(**dict(zip(names, values))) for values in itertools.product(*grid.values())]
+
+
+def sample_rules(ranges: Dict[str, Tuple[float, float]], n: int, seed=None,
+                 base: GameRules = DEFAULT_RULES) -> List[GameRules]:
+    """随机扫描：各参数在 [low, high) 内均匀采样 n 套规则"""
+    _check_fields(ranges)
+    rng = np.random.default_rng(seed)
+    samples = {name: rng.uniform(low, high, size=n) for name, (low, high) in ranges.items()}
+    return [base.replace(**{name: float(values[i]) for name, values in samples.items()}) for i in range(n)]
+
+
+def run_sweep(
+    rules_list: List[GameRules],
+    games_per_config: int,
+    min_players: int = 20,
+    max_players: int = 30,
+    seed=None,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    population: Population = DEFAULT_POPULATION,
+) -> List[SimulationSummary]:
+    """
+    对每套规则模拟 games_per_config 局。所有 (规则, 批次) 任务一起分发到进程池，
+    再按批次顺序合并为每套规则一个 SimulationSummary；结果与 workers 取值无关。
+    """
+    chunks = chunk_seeds(games_per_config, seed, chunk_size)
+    tasks = [(rules, size, seed_seq) for rules in rules_list for size, seed_seq in chunks]
+    args = (
+        [size for _, size, _ in tasks],
+        [seed_seq for _, _, seed_seq in tasks],
+        [min_players] * len(tasks),
+        [max_players] * len(tasks),
+        [rules for rules, _, _ in tasks],
+        [population] * len(tasks),
+    )
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batch = max(1, len(tasks) // (workers * 4))
+            summaries = list(pool.map(summarize_seeded_chunk, *args, chunksize=batch))
+    else:
+        summaries = list(map(summarize_seeded_chunk, *args))
+    per_config = len(chunks)
+    return [
+        reduce(SimulationSummary.merge, summaries[i:i + per_config])
+        for i in range(0, len(summaries), per_config)
+    ]
+
+
+def sweep_columns(rules_list: List[GameRules], summaries: List[SimulationSummary]) -> Dict[str, np.ndarray]:
+    """把扫描结果整理为列：规则参数 + 统计量，每套规则一行"""
+    columns = {name: np.array([getattr(r, name) for r in rules_list], dtype=np.float64) for name in RULE_FIELDS}
+    columns.update({
+        "games": np.array([s.games for s in summaries]),
+        "players": np.array([s.players for s in summaries]),
+        "nt_mean": np.array([s.nt_mean for s in summaries]),
+        "nt_std": np.sqrt([s.nt_var for s in summaries]),
+        "env_mean": np.array([s.env_mean for s in summaries]),
+        "env_std": np.sqrt([s.env_var for s in summaries]),
+        "phase2_catch_rate": np.array([s.phase2_catch_rate for s in summaries]),
+        "phase3_vote_catch_rate": np.array([s.phase3_vote_catch_rate for s in summaries]),
+        "phase3_system_catch_rate": np.array([s.phase3_system_catch_rate for s in summaries]),
+        "winners_per_game_mean": np.array([
+            (s.winners_per_game * np.arange(len(s.winners_per_game))).sum() / s.games for s in summaries
+        ]),
+        # [configs, 16]：按有机肥轮数分组的平均最终 NT / 获胜率，用于衡量数值对玩家的区分度
+        "nt_mean_by_organic_rounds": np.stack([s.nt_mean_by_organic_rounds for s in summaries]),
+        "win_rate_by_organic_rounds": np.stack([s.win_rate_by_organic_rounds for s in summaries]),
+        # [configs, S]：按策略（Population.strategies 顺序）分组的平均最终 NT / 获胜率
+        "nt_mean_by_strategy": np.stack([s.nt_mean_by_strategy for s in summaries]),
+        "win_rate_by_strategy": np.stack([s.win_rate_by_strategy for s in summaries]),
+    })
+    return columns
+
+
+def save_sweep(path: str, rules_list: List[GameRules], summaries: List[SimulationSummary]) -> str:
+    """保存为压缩 .npz，可用 numpy.load 或 pandas.DataFrame(dict(np.load(path))) 读取一维列"""
+    np.savez_compressed(path, **sweep_columns(rules_list, summaries))
+    return path
@@ -1,59 +1,280 @@
 """
 WebSocket连接管理
+
+- 每条广播只编码一次（有 orjson 时用 orjson），编码后的文本放进每个连接各自的有界发送队列；
+- 每个连接一个写协程按顺序从队列取出发送，每次发送都有超时（WS_SEND_TIMEOUT 秒），
+  广播本身只是入队，不等待任何客户端；
+- 发送失败或超时的连接被视为已断开，自动移出房间并关闭；
+- 慢客户端：队列满（WS_QUEUE_SIZE 条）时按 WS_SLOW_POLICY 处理：
+  - coalesce（默认）：丢弃队列中同类型的旧状态消息（COALESCE_TYPES，只有最新一条有意义），
+    没有可合并的消息时断开；
+  - drop：丢弃新消息；
+  - disconnect：直接断开，客户端重连后重新同步。
+广播返回未能入队（连接已断开或被判定为慢客户端）的 player_id 列表。广播只负责入队，
+入队之后的发送失败或超时发生在各连接的写协程中，不反映在返回值里：写协程记录日志、移出并关闭该连接，
+玩家重连后由房间快照重新同步。
+
+多进程部署时（app.room_bus），本进程发出的广播经 relay 转发给其他 worker，
+其他 worker 转来的广播由 deliver 发给本进程内的连接。
+
+提交进度由 StatusPublisher 按房间去抖：一个窗口（STATUS_DEBOUNCE_MS 毫秒）内的多次提交只广播一次增量
+（submission_progress / vote_submission_progress：上次广播后新增的 player_id 与已提交总数），
+全员提交完成时立即广播完整名单（submission_status / vote_submission_status），房间快照也带完整名单。
 """
-from typing import Dict, Set
+import asyncio
+import os
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
 import json
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，缺失时退回标准库
+    orjson = None
+
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "5"))
+WS_CLOSE_TIMEOUT = 1.0
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", "64"))
+WS_SLOW_POLICY = os.environ.get("WS_SLOW_POLICY", "coalesce")  # coalesce / drop / disconnect
+
+# 状态快照类消息：新消息完全覆盖旧消息，队列满时可以合并（增量消息不能合并）
+COALESCE_TYPES = {"submission_status", "vote_submission_status"}
+# 完整进度消息类型 -> 增量消息类型
+PROGRESS_TYPES = {"submission_status": "submission_progress", "vote_submission_status": "vote_submission_progress"}
+
+STATUS_DEBOUNCE_MS = float(os.environ.get("STATUS_DEBOUNCE_MS", "100"))
+
+
+def encode_message(message: dict) -> str:
+    """把消息编码为 JSON 文本（前端用 JSON.parse 解析文本帧）"""
+    if orjson is not None:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(message, separators=(",", ":"))
+
+
+class ClientConnection:
+    """一个 WebSocket 连接及其有界发送队列"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int = WS_QUEUE_SIZE):
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.outbox: Deque[Tuple[Optional[str], str]] = deque()  # (消息类型, 编码后的文本)
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+
+    def offer(self, message_type: Optional[str], text: str, policy: str = WS_SLOW_POLICY) -> bool:
+        """
+        入队一条消息
+
+        Returns:
+            False 表示队列已满且按策略应断开该连接
+        """
+        if len(self.outbox) >= self.queue_size:
+            if policy == "drop":
+                return True
+            if policy != "coalesce" or message_type not in COALESCE_TYPES:
+                return False
+            kept = deque(item for item in self.outbox if item[0] != message_type)
+            if len(kept) >= self.queue_size:
+                return False
+            self.outbox = kept
+        self.outbox.append((message_type, text))
+        self.wakeup.set()
+        return True
+
+
 class ConnectionManager:
-    def __init__(self):
-        # 游戏房间：{game_id: {player_id: websocket}}
-        self.active_connections: Dict[int, Dict[int, WebSocket]] = {}
+    def __init__(self, send_timeout: float = WS_SEND_TIMEOUT, queue_size: int = WS_QUEUE_SIZE,
+                 slow_policy: str = WS_SLOW_POLICY):
+        # 游戏房间：{game_id: {player_id: ClientConnection}}
+        self.active_connections: Dict[int, Dict[int, ClientConnection]] = {}
         # 玩家到游戏的映射：{player_id: game_id}
         self.player_games: Dict[int, int] = {}
-    
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+        # 多进程时把消息转发给其他 worker（app.room_bus），单进程时为 None
+        self.relay: Optional[Callable[[dict], Awaitable[None]]] = None
+        self._close_tasks: Set[asyncio.Task] = set()  # 保留关闭任务的引用，避免完成前被回收
+
     async def connect(self, websocket: WebSocket, game_id: int, player_id: int):
         await websocket.accept()
-        
+
         if game_id not in self.active_connections:
             self.active_connections[game_id] = {}
-        
-        self.active_connections[game_id][player_id] = websocket
+
+        previous = self.active_connections[game_id].get(player_id)
+        if previous is not None:
+            _stop_writer(previous)
+        client = ClientConnection(websocket, self.queue_size)
+        client.writer = asyncio.ensure_future(self._write_loop(client, game_id, player_id))
+        self.active_connections[game_id][player_id] = client
         self.player_games[player_id] = game_id
-    
-    def disconnect(self, game_id: int, player_id: int):
-        if game_id in self.active_connections:
-            if player_id in self.active_connections[game_id]:
-                del self.active_connections[game_id][player_id]
-        
-        if player_id in self.player_games:
+
+    def disconnect(self, game_id: int, player_id: int, websocket: Optional[WebSocket] = None):
+        """移除连接；传入 websocket 时只在它仍是该玩家的当前连接时移除（避免误删重连后的新连接）"""
+        connections = self.active_connections.get(game_id)
+        if connections is not None and player_id in connections:
+            client = connections[player_id]
+            if websocket is not None and client.websocket is not websocket:
+                return
+            del connections[player_id]
+            _stop_writer(client)
+            if not connections:
+                del self.active_connections[game_id]
+
+        if self.player_games.get(player_id) == game_id:
             del self.player_games[player_id]
-    
-    async def send_personal_message(self, message: dict, game_id: int, player_id: int):
-        if game_id in self.active_connections:
-            if player_id in self.active_connections[game_id]:
-                try:
-                    await self.active_connections[game_id][player_id].send_json(message)
-                except:
-                    pass
-    
-    async def broadcast_to_game(self, message: dict, game_id: int, exclude_player: int = None):
-        """向游戏内所有玩家广播消息"""
-        if game_id in self.active_connections:
-            for pid, websocket in self.active_connections[game_id].items():
-                if pid != exclude_player:
-                    try:
-                        await websocket.send_json(message)
-                    except:
-                        pass
-    
-    async def broadcast_to_all_in_game(self, message: dict, game_id: int):
-        """向游戏内所有玩家广播（包括发送者）"""
-        if game_id in self.active_connections:
-            for pid, websocket in self.active_connections[game_id].items():
-                try:
-                    await websocket.send_json(message)
-                except:
-                    pass
+
+    def _evict(self, client: ClientConnection, game_id: int, player_id: int, reason: str):
+        print(f"WebSocket 连接已移除（游戏 {game_id} 玩家 {player_id}）: {reason}")
+        self.disconnect(game_id, player_id, client.websocket)
+        task = asyncio.ensure_future(_close_quietly(client.websocket))
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
+
+    async def _write_loop(self, client: ClientConnection, game_id: int, player_id: int):
+        """按顺序发送队列中的消息；发送失败或超时时移除并关闭该连接"""
+        while True:
+            while not client.outbox:
+                client.wakeup.clear()
+                await client.wakeup.wait()
+            _, text = client.outbox.popleft()
+            try:
+                await asyncio.wait_for(client.websocket.send_text(text), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                reason = "发送超时" if isinstance(e, asyncio.TimeoutError) else repr(e)
+                self._evict(client, game_id, player_id, reason)
+                return
+
+    def _enqueue(self, client: ClientConnection, message_type: Optional[str], text: str,
+                 game_id: int, player_id: int) -> bool:
+        if client.offer(message_type, text, self.slow_policy):
+            return True
+        self._evict(client, game_id, player_id, f"发送队列已满（{self.queue_size} 条）")
+        return False
+
+    def _fan_out(self, payloads: Dict[int, Tuple[Optional[str], str]], game_id: int) -> List[int]:
+        """把已编码的消息放进各连接的发送队列，返回未能入队的 player_id"""
+        connections = self.active_connections.get(game_id, {})
+        failed = []
+        for pid, (message_type, text) in payloads.items():
+            client = connections.get(pid)
+            if client is not None and not self._enqueue(client, message_type, text, game_id, pid):
+                failed.append(pid)
+        return failed
+
+    async def send_personal_message(self, message: dict, game_id: int, player_id: int) -> bool:
+        """发送给单个玩家；玩家不在线或被判定为慢客户端时返回 False（True 只表示已入队，不表示已送达）"""
+        return not await self.send_to_players({player_id: message}, game_id)
+
+    async def send_to_players(self, messages: Dict[int, dict], game_id: int) -> List[int]:
+        """
+        向多名玩家发送各自的消息，返回未能入队的 player_id（不在本进程的玩家转发给其他 worker）；
+        入队后的发送失败由写协程移除连接，不在返回值中
+        """
+        connections = self.active_connections.get(game_id, {})
+        payloads = {pid: (message.get("type"), encode_message(message)) for pid, message in messages.items()}
+        remote = {pid: payload for pid, payload in payloads.items() if pid not in connections}
+        if remote and self.relay is not None:
+            await self.relay({"kind": "deliver", "game_id": game_id, "each": remote})
+            return self._fan_out(payloads, game_id)
+        return self._fan_out(payloads, game_id) + list(remote)
+
+    async def broadcast_to_game(self, message: dict, game_id: int, exclude_player: int = None) -> List[int]:
+        """
+        向游戏内所有玩家广播消息（只编码一次），返回本进程内未能入队的 player_id；
+        入队后的发送失败由写协程移除连接，不在返回值中
+        """
+        connections = self.active_connections.get(game_id, {})
+        payload = (message.get("type"), encode_message(message))
+        if self.relay is not None:
+            await self.relay({"kind": "deliver", "game_id": game_id, "all": payload, "exclude": exclude_player})
+        return self._fan_out({pid: payload for pid in connections if pid != exclude_player}, game_id)
+
+    async def broadcast_to_all_in_game(self, message: dict, game_id: int) -> List[int]:
+        """向游戏内所有玩家广播（包括发送者，只编码一次），返回本进程内未能入队的 player_id"""
+        return await self.broadcast_to_game(message, game_id)
+
+    def deliver(self, relayed: dict) -> List[int]:
+        """把其他 worker 转来的消息发给本进程内的连接"""
+        game_id = relayed["game_id"]
+        connections = self.active_connections.get(game_id, {})
+        if "all" in relayed:
+            payload = tuple(relayed["all"])
+            exclude = relayed.get("exclude")
+            return self._fan_out({pid: payload for pid in connections if pid != exclude}, game_id)
+        payloads = {int(pid): tuple(payload) for pid, payload in relayed["each"].items()}
+        return self._fan_out({pid: payload for pid, payload in payloads.items() if pid in connections}, game_id)
+
+class StatusPublisher:
+    """
+    按房间去抖的进度广播：publish 在窗口结束时广播一次增量（相对上次广播新增的 submitted_player_ids），
+    publish_now 取消等待中的广播并立即发送完整名单（全员完成时使用），之后重新从空名单开始计算增量
+    """
+
+    def __init__(self, manager: ConnectionManager, window_ms: float = STATUS_DEBOUNCE_MS):
+        self.manager = manager
+        self.window = window_ms / 1000
+        self._pending: Dict[Tuple[int, str], asyncio.TimerHandle] = {}
+        self._published: Dict[Tuple[int, str], Set[int]] = {}  # 已广播给客户端的 player_id
+        self._tasks: Set[asyncio.Task] = set()  # 保留发送任务的引用，避免完成前被回收
+
+    def publish(self, game_id: int, message_type: str, build: Callable[[], dict]):
+        """窗口内只广播一次；build 在发送时调用，返回当时的完整进度消息（含 submitted_player_ids）"""
+        key = (game_id, message_type)
+        if key in self._pending:
+            return
+        if self.window <= 0:
+            self._fire(key, build)
+            return
+        self._pending[key] = asyncio.get_running_loop().call_later(self.window, self._fire, key, build)
+
+    async def publish_now(self, game_id: int, message: dict):
+        """取消同类型的等待中广播并立即发送完整名单"""
+        self.cancel(game_id, message["type"])
+        self._published.pop((game_id, message["type"]), None)
+        await self.manager.broadcast_to_all_in_game(message, game_id)
+
+    def cancel(self, game_id: int, message_type: str):
+        handle = self._pending.pop((game_id, message_type), None)
+        if handle is not None:
+            handle.cancel()
+
+    def reset(self, game_id: int):
+        """丢弃该房间等待中的广播与增量基准（房间从数据库重建时使用）"""
+        for key in [key for key in set(self._pending) | set(self._published) if key[0] == game_id]:
+            self.cancel(*key)
+            self._published.pop(key, None)
+
+    def _fire(self, key: Tuple[int, str], build: Callable[[], dict]):
+        self._pending.pop(key, None)
+        message = build()
+        ids = message["submitted_player_ids"]
+        published = self._published.get(key, set())
+        if published.issubset(ids):
+            added = [pid for pid in ids if pid not in published]
+            if not added:
+                return
+            message = {"type": PROGRESS_TYPES[key[1]], "added_player_ids": added, "count": len(ids)}
+        # 名单比上次广播的少（已进入新的一轮等）时发送完整名单
+        self._published[key] = set(ids)
+        task = asyncio.ensure_future(self.manager.broadcast_to_all_in_game(message, key[0]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+def _stop_writer(client: ClientConnection):
+    if client.writer is not None and not client.writer.done():
+        client.writer.cancel()
+
+async def _close_quietly(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(websocket.close(), timeout=WS_CLOSE_TIMEOUT)
+    except Exception:
+        pass
 
 manager = ConnectionManager()
+status_publisher = StatusPublisher(manager)
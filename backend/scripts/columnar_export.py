@@ -0,0 +1,61 @@
+"""
+列式导出：把数据库中的对局按长格式导出为 games / players / rounds / votes 四张表
+（Parquet / Arrow IPC，未安装 pyarrow 时为 CSV），供 pandas 等工具直接读取，见 app/columnar_export.py。
+
+只读取数据库，不修改任何数据。
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# 保证能导入 app（从 backend 目录运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+from app.models import create_sqlite_engine
+from app.columnar_export import EXPORT_CHUNK_GAMES, FORMATS, export_columnar, select_game_ids
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="长格式列式导出")
+    parser.add_argument("--db", default="game.db", help="数据库文件（默认 backend/game.db）")
+    parser.add_argument("--games", default=None, help="只导出这些 game_id，逗号分隔")
+    parser.add_argument("--since", type=_parse_date, default=None, help="起始日期 YYYY-MM-DD（含）")
+    parser.add_argument("--until", type=_parse_date, default=None, help="截止日期 YYYY-MM-DD（含当天）")
+    parser.add_argument("--include-unfinished", action="store_true", help="同时导出未结束的游戏")
+    parser.add_argument("--format", choices=FORMATS, default="parquet", help="输出格式（缺少 pyarrow 时退回 csv）")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK_GAMES, help="每批查询的局数")
+    parser.add_argument("--out", default=None, help="输出目录（默认 exports/columnar_{时间戳}）")
+    args = parser.parse_args(argv)
+
+    # 只读导出，使用 SQLite 默认设置，不改变数据库的日志模式
+    engine = create_sqlite_engine(f"sqlite:///{args.db}", "default")
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        game_ids = select_game_ids(
+            db,
+            game_ids=[int(g) for g in args.games.split(",")] if args.games else None,
+            since=args.since,
+            until=args.until + timedelta(days=1) if args.until else None,
+            finished_only=not args.include_unfinished,
+        )
+        out_dir = args.out or os.path.join("exports", f"columnar_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        started = time.perf_counter()
+        paths = export_columnar(db, game_ids, out_dir, args.format, args.chunk)
+        print(f"  导出 {len(game_ids)} 局，用时 {time.perf_counter() - started:.2f}s")
+        for name, path in paths.items():
+            print(f"  {name}: {os.path.abspath(path)}")
+    finally:
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
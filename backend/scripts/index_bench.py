@@ -0,0 +1,129 @@
+"""
+索引基准：在临时数据库中写入 N 局已结束的游戏（默认 1 万局），
+对比执行迁移补建复合索引（app/migrations.py）前后热点查询的耗时：
+- 轮次结算 / 恢复：load_round_context（按房间取玩家、按 (房间, 轮次) 取轮次记录与投票）；
+- 复入：按 (房间, 用户) 查找玩家；
+- 导出：按房间取全部轮次记录与投票。
+
+不会写入真实 game.db。
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# 保证能导入 app（从 backend 目录运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, GamePlayer, GameRound, GameVote, create_sqlite_engine
+from app.migrations import run_migrations
+from app.round_engine import load_round_context
+
+ROUNDS = 15
+
+
+def seed_database(path: str, games: int, players: int, seed: int) -> None:
+    """直接用 sqlite3 批量写入，避免 ORM 开销"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    game_rows, player_rows, round_rows, vote_rows = [], [], [], []
+    player_id = 0
+    for game_id in range(1, games + 1):
+        game_rows.append((game_id, f"G{game_id:07d}", "finished", ROUNDS, 3))
+        ids = list(range(player_id + 1, player_id + players + 1))
+        player_id += players
+        for pid in ids:
+            player_rows.append((pid, game_id, pid, f"p{pid}"))
+        for round_number in range(1, ROUNDS + 1):
+            phase = 1 if round_number <= 5 else 2 if round_number <= 10 else 3
+            for pid in ids:
+                round_rows.append((game_id, round_number, phase, pid, rng.choice(["organic", "inorganic"]),
+                                   10.0, 13.0, 0.0, 1.0, 3.0))
+            if phase == 3:
+                for pid in ids:
+                    vote_rows.append((game_id, round_number, pid, rng.choice([None] + ids)))
+    conn.executemany("INSERT INTO games (id, game_code, status, current_round, phase) VALUES (?, ?, ?, ?, ?)", game_rows)
+    conn.executemany("INSERT INTO game_players (id, game_id, user_id, username) VALUES (?, ?, ?, ?)", player_rows)
+    conn.executemany(
+        "INSERT INTO game_rounds (game_id, round_number, phase, player_id, choice, "
+        "nt_before, nt_after, env_before, env_after, round_nt_earned) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        round_rows)
+    conn.executemany("INSERT INTO game_votes (game_id, round_number, voter_id, target_id) VALUES (?, ?, ?, ?)", vote_rows)
+    conn.commit()
+    conn.close()
+
+
+def time_queries(SessionLocal, games: int, players: int, samples: int, seed: int) -> dict:
+    """各查询的耗时中位数（毫秒）"""
+    rng = random.Random(seed)
+    picks = [(rng.randint(1, games), rng.randint(1, ROUNDS)) for _ in range(samples)]
+    timings = {"load_round_context": [], "rejoin_lookup": [], "export_rounds_votes": []}
+    db = SessionLocal()
+    for game_id, round_number in picks:
+        started = time.perf_counter()
+        load_round_context(db, game_id, round_number)
+        timings["load_round_context"].append(time.perf_counter() - started)
+
+        user_id = (game_id - 1) * players + 1
+        started = time.perf_counter()
+        db.query(GamePlayer).filter(GamePlayer.game_id == game_id, GamePlayer.user_id == user_id).first()
+        timings["rejoin_lookup"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        db.query(GameRound).filter(GameRound.game_id == game_id).order_by(
+            GameRound.round_number, GameRound.player_id).all()
+        db.query(GameVote).filter(GameVote.game_id == game_id).all()
+        timings["export_rounds_votes"].append(time.perf_counter() - started)
+        db.expunge_all()
+    db.close()
+    return {name: statistics.median(values) * 1000 for name, values in timings.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="复合索引前后的热点查询耗时")
+    parser.add_argument("--games", type=int, default=10000, help="已结束的游戏局数")
+    parser.add_argument("--players", type=int, default=20, help="每局人数")
+    parser.add_argument("--samples", type=int, default=50, help="每个查询的采样次数")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="index_bench_")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        engine = create_sqlite_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        # 去掉新增的复合索引，模拟旧库
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    if len(index.columns) > 1:
+                        index.drop(bind=conn)
+        engine.dispose()
+
+        started = time.perf_counter()
+        seed_database(path, args.games, args.players, args.seed)
+        print(f"写入 {args.games} 局 × {args.players} 人 × {ROUNDS} 轮：{time.perf_counter() - started:.1f}s")
+
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        before = time_queries(SessionLocal, args.games, args.players, args.samples, args.seed)
+        started = time.perf_counter()
+        run_migrations(engine)
+        print(f"补建索引：{time.perf_counter() - started:.1f}s")
+        after = time_queries(SessionLocal, args.games, args.players, args.samples, args.seed)
+
+        print(f"{'查询':24s}{'无索引 ms':>12s}{'有索引 ms':>12s}{'加速':>10s}")
+        for name in before:
+            print(f"{name:24s}{before[name]:12.2f}{after[name]:12.2f}{before[name] / after[name]:9.1f}x")
+        engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+分片压测：在本机依次以 K = 1, 2, 4 … 个 worker 启动分片前端（app/shard_proxy.py），
+同时跑 R 个房间、每房间 N 个机器人玩完整 15 轮，比较总用时与每秒完成的轮次数，观察吞吐随 worker 数的扩展。
+
+每次运行都在临时目录中使用全新的 game.db，不会写入真实数据库。
+压测客户端本身也要消耗 CPU，可用 --clients 把房间分给多个客户端进程；
+worker 数超过 CPU 核数后吞吐不会再增长。
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _post(base: str, path: str) -> dict:
+    request = urllib.request.Request(base + path, method="POST", data=b"")
+    return json.loads(urllib.request.urlopen(request).read())
+
+
+async def play_room(port: int, players: int, seed: int) -> float:
+    """一个房间：创建、加入、连接、开局后玩完 15 轮，返回开局到结束的用时（秒）"""
+    import websockets
+
+    rng = random.Random(seed)
+    base = f"http://127.0.0.1:{port}"
+    loop = asyncio.get_running_loop()
+    game = await loop.run_in_executor(None, _post, base, "/api/games/create?username=bot0")
+    game_id, player_ids = game["id"], [game["player_id"]]
+    for i in range(1, players):
+        joined = await loop.run_in_executor(None, _post, base, f"/api/games/{game_id}/join?username=bot{i}")
+        player_ids.append(joined["player_id"])
+
+    sockets, inboxes = {}, {}
+
+    async def reader(player_id, ws):
+        try:
+            async for raw in ws:
+                inboxes[player_id].put_nowait(json.loads(raw))
+        except Exception:
+            pass
+
+    async def wait_for(player_id, message_type):
+        while True:
+            message = await asyncio.wait_for(inboxes[player_id].get(), 120)
+            if message.get("type") == message_type:
+                return message
+
+    for player_id in player_ids:
+        ws = await websockets.connect(f"ws://127.0.0.1:{port}/ws/game/{game_id}/player/{player_id}", max_size=None)
+        sockets[player_id], inboxes[player_id] = ws, asyncio.Queue()
+        asyncio.ensure_future(reader(player_id, ws))
+
+    await loop.run_in_executor(None, _post, base, f"/api/games/{game_id}/start?player_id={player_ids[0]}")
+    for player_id in player_ids:
+        await wait_for(player_id, "game_started")
+    started = time.perf_counter()
+
+    for round_number in range(1, 16):
+        phase = 1 if round_number <= 5 else 2 if round_number <= 10 else 3
+        for player_id in player_ids:
+            await sockets[player_id].send(json.dumps({
+                "type": "submit_choice",
+                "choice": rng.choice(["organic", "inorganic"]),
+                "apply_subsidy": phase >= 2 and rng.random() < 0.5,
+            }))
+        if phase == 3:
+            voting = [await wait_for(player_id, "voting_start") for player_id in player_ids]
+            applicants = [a["player_id"] for a in voting[0]["applicants"]]
+            for player_id in player_ids:
+                await sockets[player_id].send(json.dumps({"type": "submit_vote", "target_id": rng.choice([0] + applicants)}))
+        for player_id in player_ids:
+            await wait_for(player_id, "round_result")
+        if phase >= 2:
+            for player_id in player_ids:
+                await sockets[player_id].send(json.dumps({"type": "ready_for_next_round"}))
+        if round_number < 15:
+            for player_id in player_ids:
+                await wait_for(player_id, "next_round")
+    for player_id in player_ids:
+        await wait_for(player_id, "game_finished")
+    elapsed = time.perf_counter() - started
+    for ws in sockets.values():
+        await ws.close()
+    return elapsed
+
+
+def _run_client(args: Tuple[int, List[int], int]) -> List[float]:
+    """一个压测客户端进程：并发跑分到的房间"""
+    port, seeds, players = args
+
+    async def run():
+        return await asyncio.gather(*(play_room(port, players, seed) for seed in seeds))
+
+    return asyncio.run(run())
+
+
+def _wait_ready(port: int, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("分片前端启动超时")
+
+
+def run_once(workers: int, rooms: int, players: int, clients: int, port: int, seed: int) -> Tuple[float, List[float]]:
+    """以 workers 个 worker 跑一轮压测，返回（总用时，各房间用时）"""
+    workdir = tempfile.mkdtemp(prefix="shard_load_")
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "app.shard_proxy", "--workers", str(workers), "--host", "127.0.0.1",
+         "--port", str(port), "--base-port", str(port + 1)],
+        cwd=workdir, env=env,
+    )
+    try:
+        _wait_ready(port)
+        seeds = [seed + i for i in range(rooms)]
+        batches = [(port, seeds[i::clients], players) for i in range(clients) if seeds[i::clients]]
+        started = time.perf_counter()
+        with multiprocessing.Pool(len(batches)) as pool:
+            per_room = [t for batch in pool.map(_run_client, batches) for t in batch]
+        return time.perf_counter() - started, per_room
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分片前端压测")
+    parser.add_argument("--workers", default="1,2,4", help="依次测试的 worker 数，逗号分隔")
+    parser.add_argument("--rooms", type=int, default=16, help="同时进行的房间数")
+    parser.add_argument("--players", type=int, default=30, help="每个房间的人数")
+    parser.add_argument("--clients", type=int, default=2, help="压测客户端进程数")
+    parser.add_argument("--port", type=int, default=8700, help="分片前端端口（worker 依次使用之后的端口）")
+    parser.add_argument("--seed", type=int, default=1, help="机器人选择的随机种子")
+    args = parser.parse_args(argv)
+
+    print(f"CPU 核数：{os.cpu_count()}，房间数：{args.rooms}，每房间 {args.players} 人，压测客户端 {args.clients} 个")
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        elapsed, per_room = run_once(workers, args.rooms, args.players, args.clients, args.port, args.seed)
+        rounds_per_second = args.rooms * 15 / elapsed
+        baseline = baseline or rounds_per_second
+        per_room.sort()
+        print(f"  {workers} 个 worker：总用时 {elapsed:.2f}s，{rounds_per_second:.1f} 轮/秒"
+              f"（{rounds_per_second / baseline:.2f}x），单房间用时中位数 {per_room[len(per_room) // 2]:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+SQLite 存储配置微基准：在临时数据库上模拟 99 人房间的 Phase 3 轮次写入，比较各存储配置（app/models.py 的
+SQLITE_PROFILES）的提交吞吐。
+
+两种写入方式：
+- 逐条提交：每位玩家的提交、投票各一次 commit（旧流程的写法），每轮约 2N+1 次提交；
+- 轮次批量：写后队列的三个任务（轮次结算、投票结算、进入下一轮），每轮 3 次提交。
+
+不会写入真实 game.db。
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# 保证能导入 app（从 backend 目录运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, Game, GamePlayer, GameRound, GameVote, SQLITE_PROFILES, create_sqlite_engine
+from app.round_engine import resolve_round
+from app.rooms import PlayerState, persist_round_job, persist_votes_job, persist_advance_job
+
+
+def _setup(SessionLocal, players: int):
+    db = SessionLocal()
+    game = Game(game_code="BENCH1", status="playing", current_round=11, phase=3)
+    db.add(game)
+    db.flush()
+    rows = [GamePlayer(game_id=game.id, username=f"p{i}") for i in range(players)]
+    db.add_all(rows)
+    db.commit()
+    state = [PlayerState(p.id, None, p.username, p.current_nt, p.current_env) for p in rows]
+    game_id = game.id
+    db.close()
+    return game_id, state
+
+
+def _round_inputs(rng: random.Random, state):
+    choices = {
+        p.id: {"choice": rng.choice(["organic", "inorganic"]), "apply_subsidy": rng.random() < 0.5}
+        for p in state
+    }
+    outcomes = resolve_round(state, choices, 3)
+    for o in outcomes:
+        o["subsidy_verified"] = rng.random() < 0.5 if o["applied_subsidy"] else None
+    votes = {p.id: rng.choice([None] + [o["player_id"] for o in outcomes if o["applied_subsidy"]][:3]) for p in state}
+    return outcomes, votes
+
+
+def bench_per_row(SessionLocal, game_id, state, rounds: int, rng: random.Random) -> int:
+    """逐条提交：每条 GameRound / GameVote 各一次 commit"""
+    commits = 0
+    for r in range(rounds):
+        outcomes, votes = _round_inputs(rng, state)
+        db = SessionLocal()
+        for o in outcomes:
+            db.add(GameRound(game_id=game_id, round_number=11 + r, phase=3, player_id=o["player_id"],
+                             choice=o["choice"], applied_subsidy=o["applied_subsidy"],
+                             nt_before=o["nt_before"], nt_after=o["nt_after"],
+                             env_before=o["env_before"], env_after=o["env_after"],
+                             round_nt_earned=o["round_nt_earned"]))
+            player = db.get(GamePlayer, o["player_id"])
+            player.current_nt, player.current_env = o["nt_after"], o["env_after"]
+            db.commit()
+            commits += 1
+        for voter_id, target_id in votes.items():
+            db.add(GameVote(game_id=game_id, round_number=11 + r, voter_id=voter_id, target_id=target_id))
+            db.commit()
+            commits += 1
+        db.query(Game).filter(Game.id == game_id).update({"current_round": 12 + r})
+        db.commit()
+        commits += 1
+        db.close()
+    return commits
+
+
+def bench_batched(SessionLocal, game_id, state, rounds: int, rng: random.Random) -> int:
+    """轮次批量：写后队列的三个任务，每个任务一次 commit"""
+    for r in range(rounds):
+        outcomes, votes = _round_inputs(rng, state)
+        jobs = [
+            (persist_round_job, (game_id, 11 + r, 3, outcomes)),
+            (persist_votes_job, (game_id, 11 + r, votes, {o["player_id"]: o for o in outcomes},
+                                 {o["player_id"]: o["nt_after"] for o in outcomes})),
+            (persist_advance_job, (game_id, 12 + r, 3)),
+        ]
+        for job, args in jobs:
+            db = SessionLocal()
+            job(db, *args)
+            db.close()
+    return rounds * 3
+
+
+def run(profile: str, mode: str, players: int, rounds: int, seed: int):
+    workdir = tempfile.mkdtemp(prefix="sqlite_bench_")
+    try:
+        engine = create_sqlite_engine(f"sqlite:///{workdir}/bench.db", profile)
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        game_id, state = _setup(SessionLocal, players)
+        bench = bench_per_row if mode == "per_row" else bench_batched
+        started = time.perf_counter()
+        commits = bench(SessionLocal, game_id, state, rounds, random.Random(seed))
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+        return commits, elapsed
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite 存储配置微基准（99 人 Phase 3 轮次写入）")
+    parser.add_argument("--players", type=int, default=99, help="房间人数")
+    parser.add_argument("--rounds", type=int, default=5, help="模拟轮数")
+    parser.add_argument("--profiles", default=",".join(SQLITE_PROFILES), help="要比较的存储配置，逗号分隔")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    args = parser.parse_args(argv)
+
+    print(f"{args.players} 人 Phase 3，{args.rounds} 轮")
+    for mode, label in (("per_row", "逐条提交"), ("batched", "轮次批量")):
+        print(f"  {label}：")
+        for profile in args.profiles.split(","):
+            commits, elapsed = run(profile, mode, args.players, args.rounds, args.seed)
+            print(f"    {profile:8s} {commits} 次提交，{elapsed:.3f}s，"
+                  f"{commits / elapsed:.0f} 次提交/秒，每轮 {elapsed / args.rounds * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
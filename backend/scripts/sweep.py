@@ -0,0 +1,77 @@
+"""
+数值参数扫描：对 game_logic 中的数值常量做网格 / 随机扫描，每套数值批量模拟若干局，
+统计结果存为 exports/sweep_*.npz（每套数值一行），无需修改 game_logic.py。
+
+示例（在 backend 目录下）：
+    python scripts/sweep.py --grid phase3_catch_probability=0.3,0.5,0.7 --grid phase3_subsidy=1,2,3 --games 2000
+    python scripts/sweep.py --sample 200 --range env_nt_bonus_rate=0.02:0.1 --range final_env_negative_rate=0.5:2 --workers 8
+    python scripts/sweep.py --grid phase3_catch_probability=0.3,0.5,0.7 --mix random=0.5,cheat=0.5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+# 保证能导入 app（从 backend 目录运行）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.strategies import DEFAULT_POPULATION, parse_population
+from app.sweep import RULE_FIELDS, grid_rules, sample_rules, run_sweep, save_sweep
+
+
+def _parse_assignment(text: str):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError(f"格式应为 参数名=取值：{text}")
+    name, value = text.split("=", 1)
+    return name.strip(), value.strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="game_logic 数值参数扫描")
+    parser.add_argument("--grid", action="append", default=[], type=_parse_assignment,
+                        help="网格参数，如 phase3_subsidy=1,2,3（可重复）")
+    parser.add_argument("--sample", type=int, default=0, help="随机采样的规则套数（配合 --range）")
+    parser.add_argument("--range", action="append", default=[], type=_parse_assignment,
+                        help="随机采样范围，如 env_nt_bonus_rate=0.02:0.1（可重复）")
+    parser.add_argument("--games", type=int, default=2000, help="每套规则模拟局数")
+    parser.add_argument("--min-players", type=int, default=20, help="每局最少人数")
+    parser.add_argument("--max-players", type=int, default=30, help="每局最多人数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（所有规则共用同一组对局种子）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--mix", default=None,
+                        help="玩家策略构成，如 random=0.6,cheat=0.2,tit_for_tat=0.2（默认全部随机）")
+    parser.add_argument("--out", default=None, help="输出 .npz 路径，默认 exports/sweep_{时间戳}.npz")
+    args = parser.parse_args(argv)
+
+    if args.sample:
+        ranges = {}
+        for name, value in args.range:
+            low, high = value.split(":")
+            ranges[name] = (float(low), float(high))
+        rules_list = sample_rules(ranges, args.sample, seed=args.seed)
+    else:
+        rules_list = grid_rules({name: [float(v) for v in value.split(",")] for name, value in args.grid})
+    print(f"  共 {len(rules_list)} 套规则，每套 {args.games} 局，{args.workers} 个进程")
+    print(f"  可扫描参数：{', '.join(RULE_FIELDS)}")
+    population = parse_population(args.mix) if args.mix else DEFAULT_POPULATION
+    print(f"  玩家策略：{', '.join(population.names)}")
+
+    start = time.perf_counter()
+    summaries = run_sweep(
+        rules_list, args.games, args.min_players, args.max_players,
+        seed=args.seed, workers=args.workers, population=population,
+    )
+    print(f"  扫描完成，用时 {time.perf_counter() - start:.2f}s")
+
+    out_path = args.out
+    if out_path is None:
+        os.makedirs("exports", exist_ok=True)
+        out_path = os.path.join("exports", f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.npz")
+    save_sweep(out_path, rules_list, summaries)
+    print(f"  已导出: {os.path.abspath(out_path)}")
+
+
+if __name__ == "__main__":
+    main()
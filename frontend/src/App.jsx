@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import Login from './components/Login'
 import Questionnaire from './components/Questionnaire'
 import Lobby from './components/Lobby'
@@ -18,6 +18,8 @@ function App() {
   const [gameState, setGameState] = useState(null)
   const [ws, setWs] = useState(null)
   const [phaseIntroDismissed, setPhaseIntroDismissed] = useState(null)
+  // 玩家数据版本号：连接时收到完整快照，之后 next_round 只带有变化的字段
+  const playersSeq = useRef(null)
 
   // 游戏结束或离开房间时重置阶段介绍，下次进入会再显示
   useEffect(() => {
@@ -30,7 +32,7 @@ function App() {
   useEffect(() => {
     if (game && player) {
       const websocket = useWebSocket(game.id, player.id, (message) => {
-        handleWebSocketMessage(message)
+        handleWebSocketMessage(message, game.id)
       })
       setWs(websocket)
       return () => {
@@ -39,10 +41,66 @@ function App() {
     }
   }, [game, player])
 
-  const handleWebSocketMessage = (message) => {
+  // 把增量合并进玩家列表（只覆盖有变化的 NT / ENV）
+  const applyPlayerChanges = (players, changes) => {
+    if (!players) return players
+    const byId = new Map(changes.map((c) => [c.id, c]))
+    return players.map((p) => (byId.has(p.id) ? { ...p, ...byId.get(p.id) } : p))
+  }
+
+  // 把提交进度增量（新增的 player_id）合并进已提交名单
+  const mergeSubmittedIds = (ids, added) => [...new Set([...(ids || []), ...(added || [])])]
+
+  // 错过增量时重新获取完整快照
+  const resyncPlayers = async (gameId) => {
+    try {
+      const snapshot = (await api.get(`/games/${gameId}/snapshot`)).data
+      playersSeq.current = snapshot.seq
+      setGameState(prev => ({
+        ...prev,
+        players: snapshot.players,
+        submitted_player_ids: snapshot.submitted_player_ids ?? prev?.submitted_player_ids,
+        vote_submitted_player_ids: snapshot.vote_submitted_player_ids ?? prev?.vote_submitted_player_ids
+      }))
+    } catch (error) {
+      console.error('同步玩家数据失败:', error)
+    }
+  }
+
+  const handleWebSocketMessage = (message, gameId) => {
     const { type } = message
     // 使用函数式更新避免闭包导致 state 丢失（如 status: 'playing'）
-    if (type === 'game_started') {
+    if (type === 'room_snapshot') {
+      playersSeq.current = message.seq
+      setGameState(prev => ({
+        ...prev,
+        players: message.players,
+        submitted_player_ids: message.submitted_player_ids ?? prev?.submitted_player_ids,
+        vote_submitted_player_ids: message.vote_submitted_player_ids ?? prev?.vote_submitted_player_ids
+      }))
+    } else if (type === 'room_reloaded') {
+      // 服务器保存数据失败后从数据库重建了房间：回到重建后的轮次，本轮界面重新挂载（之后可能补发投票 / 结果消息）
+      playersSeq.current = message.seq
+      setGameState(prev => ({
+        ...prev,
+        status: message.status,
+        current_round: message.current_round,
+        phase: message.phase,
+        players: message.players,
+        round_result: null,
+        broadcast: null,
+        phase2_broadcasts: null,
+        voting_phase: false,
+        submitted_player_ids: message.submitted_player_ids || [],
+        vote_submitted_player_ids: message.vote_submitted_player_ids || [],
+        room_epoch: (prev?.room_epoch || 0) + 1
+      }))
+      alert(message.message)
+    } else if (type === 'error') {
+      alert(message.message)
+    } else if (type === 'game_started') {
+      // 等待期间可能有新玩家加入，开局时重新获取完整快照
+      resyncPlayers(gameId)
       setGameState(prev => ({
         ...prev,
         status: 'playing',
@@ -56,6 +114,13 @@ function App() {
         voting_phase: false
       }))
     } else if (type === 'next_round') {
+      const inSequence = playersSeq.current !== null && message.seq === playersSeq.current + 1
+      const changes = message.player_changes || []
+      if (inSequence) {
+        playersSeq.current = message.seq
+      } else {
+        resyncPlayers(gameId)
+      }
       setGameState(prev => ({
         ...prev,
         current_round: message.current_round,
@@ -66,12 +131,22 @@ function App() {
         voting_phase: false,
         submitted_player_ids: message.submitted_player_ids || [],
         vote_submitted_player_ids: [],
-        ...(message.players && { players: message.players })
+        ...(inSequence && { players: applyPlayerChanges(prev?.players, changes) })
       }))
     } else if (type === 'submission_status') {
       setGameState(prev => ({ ...prev, submitted_player_ids: message.submitted_player_ids || [] }))
+    } else if (type === 'submission_progress') {
+      setGameState(prev => ({
+        ...prev,
+        submitted_player_ids: mergeSubmittedIds(prev?.submitted_player_ids, message.added_player_ids)
+      }))
     } else if (type === 'vote_submission_status') {
       setGameState(prev => ({ ...prev, vote_submitted_player_ids: message.submitted_player_ids || [] }))
+    } else if (type === 'vote_submission_progress') {
+      setGameState(prev => ({
+        ...prev,
+        vote_submitted_player_ids: mergeSubmittedIds(prev?.vote_submitted_player_ids, message.added_player_ids)
+      }))
     } else if (type === 'phase2_broadcasts') {
       setGameState(prev => ({ ...prev, phase2_broadcasts: message }))
     } else if (type === 'subsidy_applied') {
@@ -88,7 +163,10 @@ function App() {
         vote_submitted_player_ids: message.vote_submitted_player_ids || []
       }))
     } else if (type === 'game_finished') {
-      setGameState(prev => ({ ...prev, status: 'finished' }))
+      // Excel 在后台生成，完成后另有 excel_ready 消息
+      setGameState(prev => ({ ...prev, status: 'finished', excel_status: 'pending' }))
+    } else if (type === 'excel_ready') {
+      setGameState(prev => ({ ...prev, excel_status: message.status }))
     }
   }
 
@@ -208,7 +286,7 @@ function App() {
   }
 
   if (gameState?.status === 'finished') {
-    return <Results game={game} player={player} />
+    return <Results game={game} player={player} excelStatus={gameState.excel_status} />
   }
 
   if (gameState?.status === 'playing') {
@@ -244,13 +322,13 @@ function App() {
         />
         <div className="game-main">
           {phase === 1 && (
-            <GamePhase1 game={game} player={player} gameState={gameState} ws={ws} />
+            <GamePhase1 key={gameState.room_epoch || 0} game={game} player={player} gameState={gameState} ws={ws} />
           )}
           {phase === 2 && (
-            <GamePhase2 game={game} player={player} gameState={gameState} ws={ws} />
+            <GamePhase2 key={gameState.room_epoch || 0} game={game} player={player} gameState={gameState} ws={ws} />
           )}
           {phase === 3 && (
-            <GamePhase3 game={game} player={player} gameState={gameState} ws={ws} />
+            <GamePhase3 key={gameState.room_epoch || 0} game={game} player={player} gameState={gameState} ws={ws} />
           )}
         </div>
       </div>
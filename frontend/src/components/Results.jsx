@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react'
 import { api } from '../services/api'
 
-function Results({ game, player }) {
+function Results({ game, player, excelStatus }) {
   const [results, setResults] = useState(null)
 
   useEffect(() => {
@@ -102,7 +102,7 @@ function Results({ game, player }) {
       </div>
 
       <button onClick={downloadExcel} style={{ width: '100%', marginTop: '20px' }}>
-        下载Excel数据表格
+        {excelStatus === 'pending' ? 'Excel 生成中…（可直接点击，生成完成后开始下载）' : '下载Excel数据表格'}
       </button>
     </div>
   )
@@ -1,4 +1,23 @@
 #!/bin/bash
 echo "启动后端服务器..."
 cd backend
-python -m uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
+WORKERS=${WORKERS:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    # 多进程：先启动房间总线代理，同一房间的玩家可以落在不同 worker 上
+    export ROOM_BUS=unix
+    export ROOM_BUS_PATH=${ROOM_BUS_PATH:-/tmp/nantang_room_bus.sock}
+    rm -f "$ROOM_BUS_PATH"
+    python -m app.room_bus &
+    BROKER_PID=$!
+    trap "kill $BROKER_PID" EXIT
+    # 等待代理创建 socket 文件（最多 10 秒）
+    for _ in $(seq 100); do
+        [ -S "$ROOM_BUS_PATH" ] && break
+        kill -0 "$BROKER_PID" 2>/dev/null || { echo "房间总线代理启动失败"; exit 1; }
+        sleep 0.1
+    done
+    [ -S "$ROOM_BUS_PATH" ] || { echo "等待房间总线代理超时: $ROOM_BUS_PATH"; exit 1; }
+    python -m uvicorn app.main:app --workers "$WORKERS" --host 0.0.0.0 --port 8000
+else
+    python -m uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
+fi